@@ -1,59 +1,145 @@
-import pandas as pd
-from collections import Counter
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
 from backend.data_storage.database import ReceiptDB
-from typing import Dict, Any, List
-
-def calculate_aggregates(db: Session) -> Dict[str, Any]:
-    receipts = db.query(ReceiptDB).all()
-    if not receipts:
-        return {
-            "total_spend": 0.0,
-            "mean_spend": 0.0,
-            "median_spend": 0.0,
-            "mode_spend": [],
-            "vendor_frequency": {},
-            "monthly_spend_trend": {}
-        }
-
-    # Convert SQLAlchemy objects to dictionaries for DataFrame creation
-    # Using a list comprehension to ensure all attributes are available.
-    data_for_df = []
-    for r in receipts:
-        receipt_dict = {
-            'id': r.id,
-            'vendor': r.vendor,
-            'transaction_date': r.transaction_date,
-            'amount': r.amount,
-            'category': r.category
-        }
-        data_for_df.append(receipt_dict)
-
-    df = pd.DataFrame(data_for_df)
-    df['transaction_date'] = pd.to_datetime(df['transaction_date'])
-
-    # Sum, Mean, Median
-    total_spend = df['amount'].sum()
-    mean_spend = df['amount'].mean()
-    median_spend = df['amount'].median()
-
-    # Mode (can be multiple)
-    mode_spend = df['amount'].mode().tolist()
-
-    # Frequency distributions of vendor occurrences
-    vendor_frequency = df['vendor'].value_counts().to_dict()
-
-    # Monthly spend trend
-    df['month_year'] = df['transaction_date'].dt.to_period('M')
-    monthly_spend_trend = df.groupby('month_year')['amount'].sum().to_dict()
-    # Convert Period objects to strings for JSON serialization
-    monthly_spend_trend = {str(k): v for k, v in monthly_spend_trend.items()}
+from backend.data_storage.summary import read_summaries, histogram_median, histogram_mode
+from backend.data_storage import columnar
+from backend.data_storage.column_store import current_store
+from backend.metrics import query_span
+from typing import Dict, Any, List, Optional
+
+def _empty_aggregates() -> Dict[str, Any]:
+    return {
+        "total_spend": 0.0,
+        "mean_spend": 0.0,
+        "median_spend": 0.0,
+        "mode_spend": [],
+        "vendor_frequency": {},
+        "monthly_spend_trend": {}
+    }
+
+@query_span("aggregate")
+def calculate_aggregates(db: Session, exact: bool = False, conditions: Optional[list] = None,
+                         spec=None) -> Dict[str, Any]:
+    # With filter conditions (see query.ReceiptQuery.filter_conditions) everything is
+    # pushed down into SQL; without them the summary tables answer directly.
+    # A ReceiptQuery spec may be passed instead of its conditions, so that
+    # filtered aggregates can come from the column store when it is current.
+    if spec is not None:
+        store = spec.column_store(db) if spec.has_filters() else None
+        if store is not None:
+            return store.aggregates(**spec.column_filters()) or _empty_aggregates()
+        conditions = spec.filter_conditions()
+    if conditions:
+        return calculate_filtered_aggregates(db, conditions)
+
+    # Reads the incrementally maintained summary tables instead of loading every
+    # receipt: total, mean, vendor counts and the monthly trend are O(1)-sized
+    # reads. Median and mode come from the amount histogram (within 1%), or
+    # from the receipts table itself when exact=True.
+    summaries = read_summaries(db)
+    receipt_count = summaries["receipt_count"]
+    if not receipt_count:
+        return _empty_aggregates()
+
+    # Sum, Mean, Median. Receipts without an amount are left out of the
+    # mean as well; the histogram holds every non-NULL amount once.
+    total_spend = summaries["total_amount"]
+    amount_count = sum(count for _, count in summaries["histogram"])
+    mean_spend = total_spend / amount_count if amount_count else 0.0
+    store = current_store(db) if exact else None
+    snapshot = columnar.current_snapshot(db) if exact and store is None else None
+    if store is not None:
+        median_spend, mode_spend = store.median_and_mode()
+    elif snapshot is not None:
+        # The memory-mapped columnar snapshot is up to date, so the exact
+        # statistics come from it instead of sorting the receipts table.
+        median_spend = columnar.snapshot_median(snapshot)
+        mode_spend = columnar.snapshot_mode(snapshot)
+    elif exact:
+        median_spend = exact_median(db, amount_count)
+        # Mode (can be multiple)
+        mode_spend = exact_mode(db)
+    else:
+        median_spend = histogram_median(summaries["histogram"])
+        mode_spend = histogram_mode(summaries["histogram"])
 
     return {
         "total_spend": total_spend,
         "mean_spend": mean_spend,
         "median_spend": median_spend,
         "mode_spend": mode_spend,
-        "vendor_frequency": vendor_frequency,
-        "monthly_spend_trend": monthly_spend_trend
-    }
\ No newline at end of file
+        # Frequency distributions of vendor occurrences
+        "vendor_frequency": summaries["vendor_frequency"],
+        # Monthly spend trend
+        "monthly_spend_trend": summaries["monthly_spend_trend"]
+    }
+
+def calculate_filtered_aggregates(db: Session, conditions: list) -> Dict[str, Any]:
+    # Every statistic is one SQL query over the filtered rows; only the small
+    # result sets (one row, one row per vendor/month) reach Python.
+    receipt_count, amount_count, total_spend = db.execute(
+        # Summing integer cents keeps the total exact
+        select(func.count(ReceiptDB.id), func.count(ReceiptDB.amount_cents),
+               func.coalesce(func.sum(ReceiptDB.amount_cents), 0) / 100.0).where(*conditions)
+    ).one()
+    if not receipt_count:
+        return _empty_aggregates()
+
+    vendor_counts = db.execute(
+        select(ReceiptDB.vendor, func.count(ReceiptDB.id).label("receipt_count"))
+        .where(*conditions)
+        .group_by(ReceiptDB.vendor)
+        .order_by(func.count(ReceiptDB.id).desc(), ReceiptDB.vendor)
+    ).all()
+
+    month = month_expression(db)
+    monthly_totals = db.execute(
+        # A month whose receipts have no amounts totals 0.0, as in the summary
+        # tables and the column store, rather than NULL
+        select(month.label("month"), func.coalesce(func.sum(ReceiptDB.amount_cents), 0) / 100.0)
+        .where(ReceiptDB.transaction_date.isnot(None), *conditions)
+        .group_by(month)
+        .order_by(month)
+    ).all()
+
+    return {
+        "total_spend": total_spend,
+        "mean_spend": total_spend / amount_count if amount_count else 0.0, # Receipts with an amount
+        "median_spend": exact_median(db, amount_count, conditions),
+        "mode_spend": exact_mode(db, conditions),
+        "vendor_frequency": {vendor: count for vendor, count in vendor_counts},
+        "monthly_spend_trend": {m: total for m, total in monthly_totals}
+    }
+
+def month_expression(db: Session):
+    if db.get_bind().dialect.name == "postgresql":
+        return func.to_char(ReceiptDB.transaction_date, "YYYY-MM")
+    return func.strftime("%Y-%m", ReceiptDB.transaction_date)
+
+def exact_median(db: Session, amount_count: int, conditions: Optional[list] = None) -> float:
+    # amount_count: rows matching conditions that have an amount
+    conditions = [ReceiptDB.amount_cents.isnot(None), *(conditions or [])]
+    if db.get_bind().dialect.name == "postgresql":
+        return (db.execute(
+            select(func.percentile_cont(0.5).within_group(ReceiptDB.amount_cents)).where(*conditions)
+        ).scalar() or 0.0) / 100
+    # Elsewhere only the one or two middle rows are fetched
+    middle = db.execute(
+        select(ReceiptDB.amount_cents)
+        .where(*conditions)
+        .order_by(ReceiptDB.amount_cents)
+        .offset((amount_count - 1) // 2)
+        .limit(2 if amount_count % 2 == 0 else 1)
+    ).scalars().all()
+    return sum(middle) / len(middle) / 100 if middle else 0.0
+
+def exact_mode(db: Session, conditions: Optional[list] = None) -> List[float]:
+    counts = (
+        select(ReceiptDB.amount_cents, func.count().label("occurrences"))
+        .where(ReceiptDB.amount_cents.isnot(None), *(conditions or []))
+        .group_by(ReceiptDB.amount_cents)
+        .subquery()
+    )
+    top = select(func.max(counts.c.occurrences)).scalar_subquery()
+    cents = db.execute(select(counts.c.amount_cents).where(counts.c.occurrences == top)).scalars().all()
+    return sorted(c / 100 for c in cents)
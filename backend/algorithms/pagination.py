@@ -0,0 +1,102 @@
+import json
+import base64
+from datetime import date
+from typing import Any, List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+
+from backend.data_storage.database import ReceiptDB
+from backend.data_storage.fulltext import receipts_fts
+
+# sort_by values accepted by the API and the column each one sorts on
+SORT_COLUMNS = {
+    "id": ReceiptDB.id,
+    "vendor": ReceiptDB.vendor,
+    "date": ReceiptDB.transaction_date,
+    "amount": ReceiptDB.amount_cents,
+    "category": ReceiptDB.category,
+    # bm25 score of a full-text match (lower is better); needs a search query
+    "relevance": receipts_fts.c.rank,
+}
+# Columns a client may request with fields=, and what each one selects
+FIELD_COLUMNS = {
+    "id": ReceiptDB.id,
+    "vendor": ReceiptDB.vendor,
+    "transaction_date": ReceiptDB.transaction_date,
+    "amount": ReceiptDB.amount.label("amount"), # Converted from cents in SQL
+    "category": ReceiptDB.category,
+}
+PROJECTABLE_FIELDS = list(FIELD_COLUMNS)
+MAX_PAGE_SIZE = 1000
+
+
+def sort_column(sort_by: Optional[str]):
+    column = SORT_COLUMNS.get(sort_by or "id")
+    if column is None:
+        raise ValueError(f"Invalid sort_by field: {sort_by}")
+    return column
+
+
+def is_unique_column(column) -> bool:
+    # The full-text index's rowid is the receipt id, so either one orders
+    # receipts completely on its own and is never NULL.
+    return column is ReceiptDB.id or column is receipts_fts.c.rowid
+
+
+def order_by_clauses(sort_by: Optional[str], sort_order: str = "asc", column=None) -> list:
+    # The id tie-breaker makes the order total, which keyset pagination needs.
+    # NULLs are placed explicitly so the cursor conditions below hold on every
+    # backend (SQLite and PostgreSQL disagree on the default).
+    # column overrides the one sort_by names (see ReceiptQuery.order_column).
+    column = sort_column(sort_by) if column is None else column
+    if is_unique_column(column):
+        return [column.desc() if sort_order == "desc" else column.asc()]
+    if sort_order == "desc":
+        return [column.desc().nulls_last(), ReceiptDB.id.desc()]
+    return [column.asc().nulls_first(), ReceiptDB.id.asc()]
+
+
+def encode_cursor(sort_value: Any, receipt_id: int) -> str:
+    if isinstance(sort_value, date):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, receipt_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort_by: Optional[str]) -> Tuple[Any, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, receipt_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if sort_by == "date" and sort_value is not None:
+            sort_value = date.fromisoformat(sort_value)
+        return sort_value, int(receipt_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+
+def keyset_condition(sort_by: Optional[str], sort_order: str, cursor: str, column=None):
+    # Rows strictly after the cursor position in (sort column, id) order, so
+    # every page is an index range scan instead of an OFFSET skip.
+    column = sort_column(sort_by) if column is None else column
+    last_value, last_id = decode_cursor(cursor, sort_by)
+    if is_unique_column(column):
+        return column < last_id if sort_order == "desc" else column > last_id
+    if sort_order == "desc":
+        # Order: non-NULL values descending, then NULLs
+        if last_value is None:
+            return and_(column.is_(None), ReceiptDB.id < last_id)
+        return or_(column < last_value, and_(column == last_value, ReceiptDB.id < last_id), column.is_(None))
+    # Order: NULLs first, then values ascending
+    if last_value is None:
+        return or_(and_(column.is_(None), ReceiptDB.id > last_id), column.isnot(None))
+    return or_(column > last_value, and_(column == last_value, ReceiptDB.id > last_id))
+
+
+def projected_columns(fields: Optional[str]) -> List[str]:
+    if not fields:
+        return list(PROJECTABLE_FIELDS)
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in PROJECTABLE_FIELDS]
+    if unknown:
+        raise ValueError(f"Invalid fields: {', '.join(unknown)}. Choose from {', '.join(PROJECTABLE_FIELDS)}.")
+    return requested
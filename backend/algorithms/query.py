@@ -0,0 +1,178 @@
+from dataclasses import dataclass
+from datetime import date
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from backend.data_storage.database import ReceiptDB, to_minor_units
+from backend.data_storage import fulltext
+from backend.data_storage.column_store import ColumnStore, current_store
+from backend.metrics import query_span
+from backend.algorithms.pagination import (
+    order_by_clauses, keyset_condition, sort_column, encode_cursor, decode_cursor, projected_columns, FIELD_COLUMNS
+)
+
+def text_condition(query: str):
+    # Uses the FTS5 index (word-prefix match on vendor, category and receipt
+    # text) when it is available, otherwise a substring scan of vendor/category.
+    expression = fulltext.match_expression(query) if fulltext.is_enabled() else None
+    if expression is None:
+        return (
+            (ReceiptDB.vendor_lower.contains(func.lower(query))) |
+            (ReceiptDB.category_lower.contains(func.lower(query)))
+        )
+    return ReceiptDB.id.in_(
+        select(fulltext.receipts_fts.c.rowid).where(fulltext.match_clause(expression))
+    )
+
+
+def filter_conditions(query: Optional[str] = None, start_date: Optional[date] = None,
+                      end_date: Optional[date] = None, min_amount: Optional[float] = None,
+                      max_amount: Optional[float] = None, category: Optional[str] = None) -> list:
+    conditions = []
+    if query:
+        conditions.append(text_condition(query))
+    if start_date:
+        conditions.append(ReceiptDB.transaction_date >= start_date)
+    if end_date:
+        conditions.append(ReceiptDB.transaction_date <= end_date)
+    if min_amount:
+        conditions.append(ReceiptDB.amount_cents >= to_minor_units(min_amount))
+    if max_amount:
+        conditions.append(ReceiptDB.amount_cents <= to_minor_units(max_amount))
+    if category:
+        conditions.append(ReceiptDB.category_lower == func.lower(category))
+    return conditions
+
+
+@dataclass
+class ReceiptQuery:
+    # One description of a receipts request (filters, sort, page, projection)
+    # that compiles to a single SELECT. search_receipts, sort_receipts, the
+    # list/aggregate/export endpoints all go through it, so a request never
+    # queries the table more than once.
+    query: Optional[str] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    min_amount: Optional[float] = None
+    max_amount: Optional[float] = None
+    category: Optional[str] = None
+    sort_by: Optional[str] = None
+    sort_order: str = "asc"
+    limit: Optional[int] = None
+    after: Optional[str] = None # Keyset cursor from a previous page
+    fields: Optional[str] = None # Comma-separated projection; None selects ORM objects
+
+    def validate(self):
+        # Raises ValueError for a bad sort_by, fields or cursor
+        sort_column(self.sort_by)
+        if self.ranked() and not self.uses_index():
+            raise ValueError("sort_by=relevance needs a search query and the full-text index.")
+        self.field_names()
+        if self.after:
+            keyset_condition(self.sort_by, self.sort_order, self.after)
+
+    def filter_conditions(self) -> list:
+        return filter_conditions(self.query, self.start_date, self.end_date,
+                                 self.min_amount, self.max_amount, self.category)
+
+    def ranked(self) -> bool:
+        return self.sort_by == "relevance"
+
+    def uses_index(self) -> bool:
+        # Text searches join the FTS5 index when it is available
+        return bool(self.query) and fulltext.is_enabled() and fulltext.match_expression(self.query) is not None
+
+    def order_column(self):
+        # Ordering a full-text search by the index rowid (= receipt id) lets
+        # FTS5 hand back matches already in order and stop after one page,
+        # instead of collecting every match and sorting them.
+        column = sort_column(self.sort_by)
+        if column is ReceiptDB.id and self.uses_index():
+            return fulltext.receipts_fts.c.rowid
+        return column
+
+    def has_filters(self) -> bool:
+        return bool(self.filter_conditions())
+
+    def column_filters(self) -> dict:
+        return {"start_date": self.start_date, "end_date": self.end_date, "min_amount": self.min_amount,
+                "max_amount": self.max_amount, "category": self.category}
+
+    def column_store(self, db: Session) -> Optional[ColumnStore]:
+        # The in-memory column store, when it is enabled and current and the
+        # query has no text search (that needs raw_text and the FTS5 index)
+        return None if self.query else current_store(db)
+
+    def field_names(self) -> List[str]:
+        return projected_columns(self.fields)
+
+    def sort_field(self) -> str:
+        return sort_column(self.sort_by).key
+
+    def selected_columns(self) -> list:
+        # The cursor needs the sort key and id even when they are not requested
+        columns = {name: FIELD_COLUMNS[name] for name in self.field_names() + ["id"]}
+        sort = sort_column(self.sort_by)
+        columns.setdefault(sort.key, sort)
+        return list(columns.values())
+
+    def statement(self, projected: bool = True):
+        self.validate()
+        if self.uses_index():
+            # The match goes on the joined index (rank is only defined there)
+            # rather than into an IN (...) list of every matching id.
+            conditions = filter_conditions(None, self.start_date, self.end_date,
+                                           self.min_amount, self.max_amount, self.category)
+            conditions.append(fulltext.match_clause(fulltext.match_expression(self.query)))
+        else:
+            conditions = self.filter_conditions()
+        column = self.order_column()
+        if self.after:
+            conditions.append(keyset_condition(self.sort_by, self.sort_order, self.after, column))
+        stmt = select(*self.selected_columns()) if projected else select(ReceiptDB)
+        if self.uses_index():
+            stmt = stmt.join(fulltext.receipts_fts, fulltext.receipts_fts.c.rowid == ReceiptDB.id)
+        stmt = stmt.where(*conditions).order_by(*order_by_clauses(self.sort_by, self.sort_order, column))
+        if self.limit:
+            stmt = stmt.limit(self.limit + 1) # One extra row tells us whether there is a next page
+        return stmt
+
+    def fetch_page(self, db: Session) -> Tuple[List[dict], Optional[str]]:
+        # Returns the projected rows as dicts and the cursor for the next page
+        field_names = self.field_names()
+        store = self.column_store(db)
+        if store is not None:
+            self.validate()
+            after = decode_cursor(self.after, self.sort_by) if self.after else None
+            with query_span("page"):
+                rows, last = store.page(field_names, self.sort_by, self.sort_order, after, self.limit,
+                                        **self.column_filters())
+            return rows, encode_cursor(*last) if last else None
+        with query_span("search" if self.query else "page"):
+            rows = db.execute(self.statement()).all()
+        next_cursor = None
+        if self.limit and len(rows) > self.limit:
+            rows = rows[:self.limit]
+            last = rows[-1]._mapping
+            next_cursor = encode_cursor(last[self.sort_field()], last["id"])
+        return [{name: row._mapping[name] for name in field_names} for row in rows], next_cursor
+
+    def fetch_receipts(self, db: Session) -> List[ReceiptDB]:
+        store = self.column_store(db)
+        if store is not None and not self.after:
+            # Filtered and ordered in memory; only the matching rows are loaded
+            self.validate()
+            return load_receipts(db, store.ids(self.sort_by, self.sort_order, self.limit, **self.column_filters()))
+        rows = db.execute(self.statement(projected=False)).scalars().all()
+        return rows[:self.limit] if self.limit else rows
+
+
+def load_receipts(db: Session, ids: List[int], chunk_size: int = 10000) -> List[ReceiptDB]:
+    # ReceiptDB objects for ids, in that order (IN lists are bounded in size)
+    found = {}
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        found.update((r.id, r) for r in db.execute(select(ReceiptDB).where(ReceiptDB.id.in_(chunk))).scalars())
+    return [found[i] for i in ids if i in found]
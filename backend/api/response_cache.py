@@ -0,0 +1,100 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+# Seconds a cached response may be served (0 disables the cache).
+RESPONSE_CACHE_TTL = float(os.getenv("RECEIPT_RESPONSE_CACHE_TTL", "60"))
+# Upper bound for cached response bodies, in bytes.
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RECEIPT_RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+
+class CachedResponse:
+    def __init__(self, version: int, body: bytes, headers: Dict[str, str], expires: float):
+        self.version = version
+        self.body = body
+        self.headers = headers
+        self.expires = expires
+        self.etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+class ResponseCache:
+    # LRU cache of serialized GET responses for the list and aggregate
+    # endpoints, keyed by the endpoint and its parsed parameters. Each entry
+    # remembers the data version (see summary.data_version) it was computed
+    # at and is only served while the database is still at that version, so
+    # a write from any process (API worker, job runner, bulk import) makes it
+    # stale at once. The TTL bounds how long an entry lives regardless.
+
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL, max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def get(self, key: Hashable, version: int) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry.version != version or entry.expires <= time.monotonic()):
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Hashable, version: int, body: bytes, headers: Dict[str, str]) -> CachedResponse:
+        entry = CachedResponse(version, body, headers, time.monotonic() + self.ttl)
+        if not self.enabled() or len(body) > self.max_bytes:
+            return entry
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self.current_bytes += len(body)
+            # Evict least recently used entries until we fit again
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted.body)
+        return entry
+
+    def _remove(self, key: Hashable):
+        self.current_bytes -= len(self._entries.pop(key).body)
+
+    def clear(self):
+        # Called after writes in this process to free the now stale entries
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # If-None-Match may list several tags, weak ones included, or be "*"
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+
+response_cache = ResponseCache()
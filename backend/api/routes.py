@@ -1,134 +1,335 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
-from sqlalchemy.orm import Session
-from backend.models.receipt import ReceiptData, ReceiptInput
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Request, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from backend.models.receipt import ReceiptData, ReceiptInput, BatchReceiptResult, JobStatus
 from backend.data_storage.database import get_db, ReceiptDB
-from backend.data_ingestion.file_handler import extract_text_from_file, decode_base64_file
-from backend.data_parsing.rule_parser import parse_receipt_data
-from backend.algorithms.search import search_receipts
-from backend.algorithms.sort import sort_receipts
+from backend.data_ingestion.pipeline import (
+    process_upload, build_receipt_data, store_receipt, find_existing_receipts, spool_upload,
+    process_spooled_upload, DuplicateReceiptError, UploadTooLargeError, MAX_BATCH_SIZE, MAX_UPLOAD_BYTES, UPLOAD_CHUNK_SIZE
+)
+from backend.data_ingestion.job_queue import submit_job, get_job, QueueFullError, JOB_POLL_INTERVAL
+from backend.data_ingestion.bulk_import import import_events, IMPORT_FORMATS, IMPORT_MAX_BYTES
+from backend.data_parsing.rules import reload_rules, get_rule_table, rule_stats
+from backend.algorithms.query import ReceiptQuery
+from backend.algorithms.pagination import MAX_PAGE_SIZE
 from backend.algorithms.aggregate import calculate_aggregates
+from backend.data_storage.export import export_stream, EXPORT_FORMATS
+from backend.data_storage.summary import data_version
+from backend.api.response_cache import response_cache, etag_matches
+from backend.metrics import UPLOADS_IN_FLIGHT, stage_span
+from dataclasses import astuple
 from datetime import date
+import asyncio
 import base64
-import io
-import csv
+import os
 import json
 from fastapi.responses import StreamingResponse
 from typing import Optional, List
 
 router = APIRouter()
 
-@router.post("/upload_receipt/")
-async def upload_receipt(receipt_input: ReceiptInput, db: Session = Depends(get_db)):
+def _receipt_data_from_db(db_receipt: ReceiptDB) -> ReceiptData:
+    return ReceiptData(
+        vendor=db_receipt.vendor,
+        transaction_date=db_receipt.transaction_date,
+        amount=db_receipt.amount,
+        category=db_receipt.category
+    )
+
+async def _track_upload():
+    # Uploads in flight, from the request being routed to the response
+    UPLOADS_IN_FLIGHT.inc()
     try:
-        file_content_bytes = decode_base64_file(receipt_input.file_content_base64)
-        extracted_text = extract_text_from_file(file_content_bytes, receipt_input.file_type)
-        parsed_data = parse_receipt_data(extracted_text)
-
-        # Ensure all required fields for ReceiptData are present, even if None
-        # Pydantic will validate based on its schema
-        receipt_data_dict = {
-            "vendor": parsed_data.get("vendor"),
-            "transaction_date": parsed_data.get("transaction_date"),
-            "amount": parsed_data.get("amount"),
-            "category": parsed_data.get("category")
-        }
+        yield
+    finally:
+        UPLOADS_IN_FLIGHT.dec()
+
+@router.post("/upload_receipt/", dependencies=[Depends(_track_upload)])
+async def upload_receipt(receipt_input: ReceiptInput, db: AsyncSession = Depends(get_db)):
+    try:
+        # Decoding, OCR/PDF extraction and parsing are CPU-bound, so they run in
+        # the worker pool instead of blocking the event loop. Re-uploads of the
+        # same file are answered from the extraction cache.
+        content_hash, result = await process_upload(receipt_input.file_content_base64, receipt_input.file_type)
 
         # Validate with Pydantic model
-        validated_data = ReceiptData(**receipt_data_dict)
+        validated_data = build_receipt_data(result["parsed"])
 
-        db_receipt = ReceiptDB(
-            vendor=validated_data.vendor,
-            transaction_date=validated_data.transaction_date,
-            amount=validated_data.amount,
-            category=validated_data.category
-        )
-        db.add(db_receipt)
-        db.commit()
-        db.refresh(db_receipt)
-        return {"message": "Receipt uploaded and processed successfully!", "data": validated_data.dict()}
+        # The sync storage helpers run on the session's greenlet; its IO is async
+        with stage_span("store"):
+            db_receipt, created = await db.run_sync(
+                store_receipt, validated_data, content_hash, raw_text=result["extracted_text"]
+            )
+            await db.commit()
+        response_cache.clear()
+        if not created:
+            return {
+                "message": "Receipt already exists; merged with the stored record.",
+                "receipt_id": db_receipt.id,
+                "duplicate": True,
+                "data": _receipt_data_from_db(db_receipt).dict()
+            }
+        return {
+            "message": "Receipt uploaded and processed successfully!",
+            "receipt_id": db_receipt.id,
+            "duplicate": False,
+            "data": validated_data.dict()
+        }
+    except DuplicateReceiptError as de:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(de))
+    except ValueError as ve:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ve))
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to process receipt: {e}")
+
+async def _ingest_stream(db: AsyncSession, file_name: str, file_type: str, chunks) -> dict:
+    file_path = None
+    try:
+        file_path, size, content_hash = await spool_upload(chunks)
+        result, cached = await process_spooled_upload(file_path, content_hash, file_type)
+        validated_data = build_receipt_data(result["parsed"])
+        with stage_span("store"):
+            db_receipt, created = await db.run_sync(
+                store_receipt, validated_data, content_hash, raw_text=result["extracted_text"]
+            )
+            await db.commit()
+        response_cache.clear()
+    except UploadTooLargeError as te:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(te))
+    except DuplicateReceiptError as de:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(de))
     except ValueError as ve:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ve))
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to process receipt: {e}")
+    finally:
+        if file_path:
+            os.unlink(file_path)
+
+    return {
+        "message": "Receipt uploaded and processed successfully!" if created
+                   else "Receipt already exists; merged with the stored record.",
+        "file_name": file_name,
+        "receipt_id": db_receipt.id,
+        "duplicate": not created,
+        "data": (validated_data if created else _receipt_data_from_db(db_receipt)).dict(),
+        "memory": {
+            "upload_bytes": size,
+            "cached": cached,
+            # Peak RSS of the worker while it handled this file (Linux only; not
+            # reported on cache hits)
+            "worker_peak_rss_kb": None if cached else result.get("worker_peak_rss_kb")
+        }
+    }
+
+def _check_declared_size(request: Request):
+    # Reject oversized uploads before reading the body when the client says how big it is
+    declared_size = request.headers.get("content-length")
+    if declared_size and declared_size.isdigit() and int(declared_size) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"File too large: limit is {MAX_UPLOAD_BYTES} bytes.")
+
+@router.post("/upload_receipt/file/", dependencies=[Depends(_check_declared_size), Depends(_track_upload)])
+async def upload_receipt_file(file: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
+    # Multipart upload: no base64, and the file is copied to disk in chunks.
+    async def chunks():
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    file_type = file.content_type or "application/octet-stream"
+    try:
+        return await _ingest_stream(db, file.filename or "upload", file_type, chunks())
+    finally:
+        await file.close()
+
+@router.post("/upload_receipt/raw/", dependencies=[Depends(_check_declared_size), Depends(_track_upload)])
+async def upload_receipt_raw(request: Request, file_name: str = "upload", db: AsyncSession = Depends(get_db)):
+    # Raw body upload: the request body is the file itself and Content-Type its type.
+    file_type = request.headers.get("content-type", "application/octet-stream")
+    return await _ingest_stream(db, file_name, file_type, request.stream())
+
+@router.post("/upload_receipts/batch/", response_model=List[BatchReceiptResult], dependencies=[Depends(_track_upload)])
+async def upload_receipts_batch(receipt_inputs: List[ReceiptInput], db: AsyncSession = Depends(get_db)):
+    if not receipt_inputs:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No files provided.")
+    if len(receipt_inputs) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Batch too large: {len(receipt_inputs)} files (maximum is {MAX_BATCH_SIZE})."
+        )
+
+    # Fan every file out to the process pool at once; results come back in input order.
+    processed = await asyncio.gather(
+        *(process_upload(r.file_content_base64, r.file_type) for r in receipt_inputs),
+        return_exceptions=True
+    )
+    # One lookup for every duplicate candidate in the batch
+    existing = await db.run_sync(find_existing_receipts, [p[0] for p in processed if not isinstance(p, BaseException)])
+
+    results: List[BatchReceiptResult] = []
+    pending = []  # (result, db_receipt) pairs waiting for an id
+    for receipt_input, processed_item in zip(receipt_inputs, processed):
+        result = BatchReceiptResult(file_name=receipt_input.file_name, success=False)
+        results.append(result)
+        if isinstance(processed_item, BaseException):
+            result.error = f"Failed to process receipt: {processed_item}"
+            continue
+        content_hash, extraction = processed_item
+        try:
+            validated_data = build_receipt_data(extraction["parsed"])
+            with stage_span("store"):
+                db_receipt, created = await db.run_sync(store_receipt, validated_data, content_hash, existing,
+                                                        raw_text=extraction["extracted_text"])
+        except (ValueError, DuplicateReceiptError) as e:
+            result.error = str(e)
+            continue
+        result.data = validated_data
+        result.duplicate = not created
+        pending.append((result, db_receipt))
 
-@router.get("/receipts/", response_model=List[ReceiptData])
-def get_receipts(
-    db: Session = Depends(get_db),
+    if pending:
+        try:
+            # One flush + commit for the whole batch; ids are read after the
+            # flush so the commit does not force a reload of every row.
+            with stage_span("store"):
+                await db.flush()
+                for result, db_receipt in pending:
+                    result.receipt_id = db_receipt.id
+                    result.success = True
+                await db.commit()
+            response_cache.clear()
+        except Exception as e:
+            await db.rollback()
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to store receipts: {e}")
+
+    return results
+
+@router.post("/jobs/", status_code=status.HTTP_202_ACCEPTED)
+async def submit_receipt_job(receipt_input: ReceiptInput, db: AsyncSession = Depends(get_db)):
+    # Queue the receipt for background processing and return immediately.
+    try:
+        job = await db.run_sync(submit_job, receipt_input)
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": str(max(1, int(JOB_POLL_INTERVAL * 5)))}
+        )
+    return {"job_id": job.id, "status": job.status}
+
+@router.get("/jobs/{job_id}/", response_model=JobStatus)
+async def get_receipt_job(job_id: int, db: AsyncSession = Depends(get_db)):
+    job = await db.run_sync(get_job, job_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+
+    data = None
+    if job.receipt_id is not None:
+        db_receipt = await db.get(ReceiptDB, job.receipt_id)
+        if db_receipt:
+            data = _receipt_data_from_db(db_receipt)
+    return JobStatus(
+        job_id=job.id,
+        status=job.status,
+        file_name=job.file_name,
+        attempts=job.attempts,
+        error=job.error,
+        receipt_id=job.receipt_id,
+        data=data,
+        created_at=job.created_at,
+        updated_at=job.updated_at
+    )
+
+@router.get("/rules/")
+def get_rules():
+    return get_rule_table().describe()
+
+@router.get("/rules/stats/")
+def get_rule_stats():
+    # Match counts per rule for receipts parsed by this server process
+    return rule_stats()
+
+@router.post("/rules/reload/")
+def reload_category_rules():
+    # Rules are also picked up automatically when the file changes; this forces it.
+    try:
+        return reload_rules(force=True).describe()
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to load rules: {e}")
+
+def receipt_filters(
     query: Optional[str] = None,
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
     min_amount: Optional[float] = None,
     max_amount: Optional[float] = None,
-    category: Optional[str] = None,
+    category: Optional[str] = None
+) -> ReceiptQuery:
+    # Filter parameters shared by the list, aggregate and export endpoints
+    return ReceiptQuery(query=query, start_date=start_date, end_date=end_date,
+                        min_amount=min_amount, max_amount=max_amount, category=category)
+
+async def _cached_json(request: Request, db: AsyncSession, key, compute) -> Response:
+    # Serves a GET from the response cache while the data version it was
+    # computed at is current; compute() returns (JSON bytes, headers) and only
+    # runs on a miss. The ETag is a hash of the body, so a client that sends
+    # it back in If-None-Match gets a 304 until the result itself changes.
+    # Reading the version and the rows in one session keeps them consistent.
+    version = await db.run_sync(data_version)
+    entry = response_cache.get(key, version)
+    if entry is None:
+        body, headers = await compute()
+        entry = response_cache.put(key, version, body, headers)
+    headers = {**entry.headers, "ETag": entry.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+@router.get("/receipts/")
+async def get_receipts(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    spec: ReceiptQuery = Depends(receipt_filters),
     sort_by: Optional[str] = None,
-    sort_order: str = "asc"
+    sort_order: str = "asc",
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    fields: Optional[str] = None
 ):
-    receipts = search_receipts(db, query, start_date, end_date, min_amount, max_amount, category)
+    # Filters, sort, keyset pagination and projection all go into one SELECT.
+    # Pass limit to page; the cursor for the next page comes back in the
+    # X-Next-Cursor header and is sent as after=. fields=vendor,amount selects
+    # only those columns.
+    spec.sort_by, spec.sort_order, spec.limit, spec.after, spec.fields = sort_by, sort_order, limit, after, fields
+    try:
+        spec.validate()
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-    if sort_by:
-        try:
-            # Re-query with sort for efficiency, rather than sorting in-memory if possible
-            # If search_receipts already returned a filtered list, you might sort that in-memory
-            # For simplicity here, we re-apply sort directly on the DB query for `search_receipts`
-            # or you can load all and then sort in memory if the dataset is small.
-            # For this example, search_receipts fetches all matching, so sorting in-memory is fine.
-            receipts = sort_receipts(db, sort_by, sort_order) # This will re-query and sort everything if no filters
-            # A more correct approach would be to apply sorting on the result of search_receipts:
-            # receipts_filtered = search_receipts(...)
-            # receipts = sort_receipts_in_memory(receipts_filtered, sort_by, sort_order)
-            # But for API, it's better to build the query chain directly for performance.
-            # Let's adjust search_receipts/sort_receipts to work with query objects.
-            # For now, `sort_receipts` as provided operates on the whole table.
-            # To combine:
-            base_query = db.query(ReceiptDB)
-            if query:
-                base_query = base_query.filter(
-                    (func.lower(ReceiptDB.vendor).contains(func.lower(query))) |
-                    (func.lower(ReceiptDB.category).contains(func.lower(query)))
-                )
-            if start_date:
-                base_query = base_query.filter(ReceiptDB.transaction_date >= start_date)
-            if end_date:
-                base_query = base_query.filter(ReceiptDB.transaction_date <= end_date)
-            if min_amount:
-                base_query = base_query.filter(ReceiptDB.amount >= min_amount)
-            if max_amount:
-                base_query = base_query.filter(ReceiptDB.amount <= max_amount)
-            if category:
-                base_query = base_query.filter(func.lower(ReceiptDB.category) == func.lower(category))
-
-            if sort_by == "vendor":
-                if sort_order == "asc": base_query = base_query.order_by(ReceiptDB.vendor.asc())
-                else: base_query = base_query.order_by(ReceiptDB.vendor.desc())
-            elif sort_by == "date":
-                if sort_order == "asc": base_query = base_query.order_by(ReceiptDB.transaction_date.asc())
-                else: base_query = base_query.order_by(ReceiptDB.transaction_date.desc())
-            elif sort_by == "amount":
-                if sort_order == "asc": base_query = base_query.order_by(ReceiptDB.amount.asc())
-                else: base_query = base_query.order_by(ReceiptDB.amount.desc())
-            elif sort_by == "category":
-                if sort_order == "asc": base_query = base_query.order_by(ReceiptDB.category.asc())
-                else: base_query = base_query.order_by(ReceiptDB.category.desc())
-            else:
-                raise ValueError("Invalid sort_by field") # Should be caught by the outer try-except
-
-            receipts = base_query.all()
-
-        except ValueError as e:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
-
-
-    # Convert SQLAlchemy models to Pydantic models for response
-    return [ReceiptData.from_orm(r) for r in receipts]
+    async def compute():
+        rows, next_cursor = await db.run_sync(spec.fetch_page)
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+        return json.dumps(rows, default=str).encode(), headers
+    return await _cached_json(request, db, ("receipts", astuple(spec)), compute)
 
 @router.get("/receipts/aggregates/")
-def get_receipt_aggregates(db: Session = Depends(get_db)):
-    aggregates = calculate_aggregates(db)
-    return aggregates
+async def get_receipt_aggregates(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    spec: ReceiptQuery = Depends(receipt_filters),
+    exact: bool = False
+):
+    # Accepts the same filters as /receipts/. exact=true computes median/mode from
+    # the receipts table instead of the histogram (filtered results are always exact).
+    async def compute():
+        aggregates = await db.run_sync(calculate_aggregates, exact=exact, spec=spec)
+        return json.dumps(aggregates, default=str).encode(), {}
+    return await _cached_json(request, db, ("aggregates", astuple(spec), exact), compute)
 
 @router.put("/receipts/{receipt_id}/", response_model=ReceiptData)
-def update_receipt(receipt_id: int, receipt_data: ReceiptData, db: Session = Depends(get_db)):
-    db_receipt = db.query(ReceiptDB).filter(ReceiptDB.id == receipt_id).first()
+async def update_receipt(receipt_id: int, receipt_data: ReceiptData, db: AsyncSession = Depends(get_db)):
+    db_receipt = await db.get(ReceiptDB, receipt_id)
     if not db_receipt:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Receipt not found")
 
@@ -136,32 +337,41 @@ def update_receipt(receipt_id: int, receipt_data: ReceiptData, db: Session = Dep
     for key, value in receipt_data.dict(exclude_unset=True).items():
         setattr(db_receipt, key, value)
 
-    db.commit()
-    db.refresh(db_receipt)
+    await db.commit()
+    response_cache.clear()
     return db_receipt
 
+@router.post("/import_receipts/", response_class=StreamingResponse)
+async def import_receipts(request: Request, format: str = "csv", gzip: bool = False):
+    # The request body is a CSV/JSON/NDJSON file in the export layout (gzip=true
+    # if compressed). It is spooled to disk, then imported in batches while the
+    # response streams NDJSON progress events, ending with a "done" event that
+    # lists the rows that failed validation.
+    if format not in IMPORT_FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Invalid format. Choose one of: {', '.join(IMPORT_FORMATS)}.")
+    try:
+        file_path, _, _ = await spool_upload(request.stream(), max_bytes=IMPORT_MAX_BYTES)
+    except UploadTooLargeError as te:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(te))
+
+    async def body():
+        async for event in import_events(file_path, format, compressed=gzip):
+            if event["event"] == "done":
+                response_cache.clear()
+            yield json.dumps(event, default=str) + "\n"
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
 @router.get("/export_receipts/", response_class=StreamingResponse)
-def export_receipts(db: Session = Depends(get_db), format: str = "csv"):
-    receipts = db.query(ReceiptDB).all()
-    # Convert SQLAlchemy objects to dicts, handling date types for JSON serialization
-    data = []
-    for r in receipts:
-        r_dict = r.__dict__.copy()
-        r_dict.pop('_sa_instance_state', None) # Remove SQLAlchemy internal state
-        if 'transaction_date' in r_dict and isinstance(r_dict['transaction_date'], date):
-            r_dict['transaction_date'] = r_dict['transaction_date'].isoformat()
-        data.append(r_dict)
-
-    if format == "csv":
-        output = io.StringIO()
-        # Ensure fieldnames match dictionary keys for CSV writing
-        fieldnames = ["id", "vendor", "transaction_date", "amount", "category"] # Explicit order
-        writer = csv.DictWriter(output, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(data)
-        output.seek(0)
-        return StreamingResponse(output, media_type="text/csv", headers={"Content-Disposition": "attachment; filename=receipts.csv"})
-    elif format == "json":
-        return StreamingResponse(io.BytesIO(json.dumps(data, indent=2, default=str).encode('utf-8')), media_type="application/json", headers={"Content-Disposition": "attachment; filename=receipts.json"})
-    else:
-        raise HTTPException(status_code=400, detail="Invalid format. Choose 'csv' or 'json'.")
\ No newline at end of file
+async def export_receipts(spec: ReceiptQuery = Depends(receipt_filters), format: str = "csv", gzip: bool = False):
+    # Accepts the same filters as /receipts/. Rows are streamed in batches from
+    # a server-side cursor; gzip=true compresses the stream (receipts.csv.gz).
+    # format=arrow/parquet write typed, dictionary-encoded columns (needs pyarrow).
+    try:
+        body = export_stream(spec, format, compress=gzip)
+    except ValueError as ve:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ve))
+    media_type, extension = EXPORT_FORMATS[format]
+    file_name = f"receipts.{extension}.gz" if gzip else f"receipts.{extension}"
+    return StreamingResponse(body, media_type="application/gzip" if gzip else media_type,
+                             headers={"Content-Disposition": f"attachment; filename={file_name}"})
\ No newline at end of file
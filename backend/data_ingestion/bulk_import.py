@@ -0,0 +1,341 @@
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import os
+import sys
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import func, insert, select
+
+from backend.data_storage import fulltext
+from backend.data_storage.database import ReceiptDB, engine, init_db, to_minor_units
+from backend.data_storage.summary import apply_bulk_insert, apply_inserted_since
+from backend.models.receipt import ReceiptData
+
+# Bulk import of already-structured receipts, e.g. files written by
+# /api/export_receipts/. Rows are parsed as a stream, validated against
+# ReceiptData a batch at a time and inserted with one executemany per batch,
+# committing every IMPORT_COMMIT_ROWS rows. Within each transaction the
+# search index and summary tables are updated once for all its rows rather
+# than per row. Extra columns such as the exported id are ignored: imported
+# receipts get new ids.
+#
+# bulk=True is for initial loads, while nothing else writes: the whole import
+# is one transaction that drops the receipts table's secondary indexes first,
+# and recreates them and rebuilds the search index once at the end. The write
+# lock is held until then, and a malformed file imports nothing. The rebuild
+# covers the whole table, so it only pays off when the file is larger than
+# what is already stored.
+
+# Rows validated and inserted together.
+IMPORT_BATCH_SIZE = int(os.getenv("RECEIPT_IMPORT_BATCH_SIZE", "10000"))
+# Rows per transaction. Larger is faster; the SQLite write lock is held for
+# the duration of each transaction.
+IMPORT_COMMIT_ROWS = int(os.getenv("RECEIPT_IMPORT_COMMIT_ROWS", "100000"))
+# Per-row errors kept for the report (all failures are still counted).
+IMPORT_MAX_ERRORS = int(os.getenv("RECEIPT_IMPORT_MAX_ERRORS", "1000"))
+# Upload limit for POST /api/import_receipts/.
+IMPORT_MAX_BYTES = int(os.getenv("RECEIPT_IMPORT_MAX_BYTES", str(10 * 1024 ** 3)))
+
+IMPORT_FORMATS = ("csv", "json", "ndjson")
+_EXTENSIONS = {".csv": "csv", ".json": "json", ".ndjson": "ndjson", ".jsonl": "ndjson"}
+
+_receipts_adapter = TypeAdapter(List[ReceiptData])
+_json_decoder = json.JSONDecoder()
+
+# (record, parse error): exactly one of the two is set
+Record = Tuple[Optional[Dict[str, Any]], Optional[str]]
+
+
+def _csv_records(stream: TextIO) -> Iterator[Record]:
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None:
+        return
+    for values in reader:
+        if not values:
+            continue # Blank line
+        if len(values) != len(header):
+            yield None, f"expected {len(header)} columns, got {len(values)}"
+            continue
+        # Empty cells are how the CSV export writes None
+        yield {name: value if value != "" else None for name, value in zip(header, values)}, None
+
+
+def _ndjson_records(stream: TextIO) -> Iterator[Record]:
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield None, f"invalid JSON: {e}"
+            continue
+        yield (record, None) if isinstance(record, dict) else (None, "expected a JSON object")
+
+
+def _json_records(stream: TextIO, chunk_size: int = 1 << 16) -> Iterator[Record]:
+    # A JSON array of objects, decoded one element at a time so the file is
+    # never held in memory. Works for any layout (one object per line as the
+    # export writes it, indented, or all on one line).
+    buffer = stream.read(chunk_size).lstrip()
+    if not buffer.startswith("["):
+        raise ValueError("JSON import expects an array of objects.")
+    position, eof = 1, False
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position < len(buffer) and buffer[position] == "]":
+            return
+        try:
+            if position == len(buffer):
+                raise ValueError("need more input")
+            record, position = _json_decoder.raw_decode(buffer, position)
+        except ValueError:
+            if eof:
+                raise ValueError("Invalid or truncated JSON array.")
+            more = stream.read(chunk_size)
+            eof = not more
+            buffer, position = buffer[position:] + more, 0
+            continue
+        yield (record, None) if isinstance(record, dict) else (None, "expected a JSON object")
+
+
+READERS: Dict[str, Callable[[TextIO], Iterator[Record]]] = {
+    "csv": _csv_records, "json": _json_records, "ndjson": _ndjson_records
+}
+
+
+def detect_format(path: str) -> str:
+    name = path[:-3] if path.endswith(".gz") else path
+    file_format = _EXTENSIONS.get(os.path.splitext(name)[1].lower())
+    if file_format is None:
+        raise ValueError(f"Cannot tell the format of {path}; pass one of: {', '.join(IMPORT_FORMATS)}.")
+    return file_format
+
+
+def _error_message(error: Dict[str, Any]) -> str:
+    field = ".".join(str(part) for part in error["loc"][1:])
+    return f"{field}: {error['msg']}" if field else error["msg"]
+
+
+def validate_batch(records: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[int, str]]:
+    # One pydantic call validates the whole batch. If some rows fail, their
+    # positions come from the error locations and the remaining rows are
+    # validated again together. Returns insertable rows and {index: error}.
+    errors: Dict[int, str] = {}
+    try:
+        receipts = _receipts_adapter.validate_python(records)
+    except ValidationError as e:
+        for error in e.errors(include_url=False):
+            index = error["loc"][0]
+            errors[index] = f"{errors[index]}; {_error_message(error)}" if index in errors else _error_message(error)
+        receipts = _receipts_adapter.validate_python([r for i, r in enumerate(records) if i not in errors])
+    rows = [{"vendor": r.vendor, "transaction_date": r.transaction_date,
+             "amount_cents": to_minor_units(r.amount), "category": r.category} for r in receipts]
+    return rows, errors
+
+
+# Dates are stored as YYYY-MM-DD text, the way SQLAlchemy's Date does on SQLite
+_SQLITE_INSERT = "INSERT INTO receipts (vendor, transaction_date, amount_cents, category) VALUES (?, ?, ?, ?)"
+
+
+class _Transaction:
+    # One import transaction: rows are inserted as they come, the search
+    # index and summaries are brought up to date just before the commit.
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.transaction = connection.begin()
+        self.last_id = fulltext.suspend_insert_trigger(connection)
+        self.inserted = 0
+        self.summary_rows: List[Dict[str, Any]] = []
+
+    def _insert(self, rows: List[Dict[str, Any]]):
+        if self.connection.dialect.name == "sqlite":
+            # Plain tuples straight to the driver's executemany: SQLAlchemy's
+            # per-row parameter processing costs as much as SQLite's insert.
+            self.connection.exec_driver_sql(_SQLITE_INSERT, [
+                (r["vendor"], r["transaction_date"].isoformat(), r["amount_cents"], r["category"]) for r in rows
+            ])
+        else:
+            self.connection.execute(insert(ReceiptDB.__table__), rows) # executemany
+        self.inserted += len(rows)
+
+    def insert(self, rows: List[Dict[str, Any]]):
+        self._insert(rows)
+        self.summary_rows.extend({"vendor": r["vendor"], "transaction_date": r["transaction_date"],
+                                  "amount": r["amount_cents"] / 100} for r in rows)
+
+    def commit(self) -> int:
+        fulltext.resume_insert_trigger(self.connection, self.last_id)
+        apply_bulk_insert(self.connection, self.summary_rows)
+        self.transaction.commit()
+        return self.inserted
+
+    def rollback(self):
+        self.transaction.rollback()
+
+
+class _BulkTransaction(_Transaction):
+    # The single transaction of a bulk=True import. Dropping the indexes is
+    # transactional too, so other connections never see them missing. The
+    # summaries are computed from the new rows in SQL at the end rather than
+    # kept in memory for every row of the file.
+
+    def __init__(self, connection):
+        super().__init__(connection)
+        self.first_id = connection.execute(select(func.coalesce(func.max(ReceiptDB.id), 0))).scalar()
+        for index in ReceiptDB.__table__.indexes:
+            index.drop(connection, checkfirst=True)
+
+    def insert(self, rows: List[Dict[str, Any]]):
+        self._insert(rows)
+
+    def commit(self) -> int:
+        for index in ReceiptDB.__table__.indexes:
+            index.create(self.connection, checkfirst=True)
+        fulltext.resume_insert_trigger(self.connection, self.last_id, rebuild=True)
+        apply_inserted_since(self.connection, self.first_id)
+        self.transaction.commit()
+        return self.inserted
+
+
+def _batches(records: Iterable[Record], size: int) -> Iterator[List[Record]]:
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_records(records: Iterable[Record], progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                   bind=None, batch_size: int = IMPORT_BATCH_SIZE, commit_rows: int = IMPORT_COMMIT_ROWS,
+                   bulk: bool = False) -> Dict[str, Any]:
+    # Returns {"rows", "imported", "failed", "errors", "seconds", "error"}.
+    # "imported" only counts committed rows. A malformed file stops the import
+    # with "error" set; the batches committed before it are kept.
+    stats: Dict[str, Any] = {"rows": 0, "imported": 0, "failed": 0, "errors": [], "seconds": 0.0, "error": None}
+    started = time.perf_counter()
+    with (bind or engine).connect() as connection:
+        transaction = _BulkTransaction(connection) if bulk else _Transaction(connection)
+        try:
+            for batch in _batches(records, batch_size):
+                first_row = stats["rows"] + 1 # Rows are numbered from 1 in input order
+                parsed = [(i, record) for i, (record, _) in enumerate(batch) if record is not None]
+                rows, errors = validate_batch([record for _, record in parsed])
+                failures = {first_row + i: message for i, (record, message) in enumerate(batch) if record is None}
+                failures.update({first_row + parsed[i][0]: message for i, message in errors.items()})
+                if rows:
+                    transaction.insert(rows)
+                if not bulk and transaction.inserted >= commit_rows:
+                    stats["imported"] += transaction.commit()
+                    transaction = _Transaction(connection)
+                stats["rows"] += len(batch)
+                stats["failed"] += len(failures)
+                room = IMPORT_MAX_ERRORS - len(stats["errors"])
+                stats["errors"].extend({"row": row, "error": failures[row]} for row in sorted(failures)[:room])
+                stats["seconds"] = time.perf_counter() - started
+                if progress:
+                    progress(stats)
+            stats["imported"] += transaction.commit()
+        except ValueError as e:
+            transaction.rollback()
+            stats["error"] = str(e)
+        except BaseException:
+            transaction.rollback()
+            raise
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+
+def import_file(path: str, file_format: Optional[str] = None, compressed: Optional[bool] = None,
+                progress: Optional[Callable[[Dict[str, Any]], None]] = None, bind=None,
+                bulk: bool = False) -> Dict[str, Any]:
+    file_format = file_format or detect_format(path)
+    if file_format not in READERS:
+        raise ValueError(f"Invalid format. Choose one of: {', '.join(IMPORT_FORMATS)}.")
+    if compressed is None:
+        compressed = path.endswith(".gz")
+    # utf-8-sig drops a byte order mark (spreadsheet CSVs often start with one)
+    opener = gzip.open if compressed else open
+    with opener(path, "rt", encoding="utf-8-sig", newline="") as stream:
+        return import_records(READERS[file_format](stream), progress=progress, bind=bind, bulk=bulk)
+
+
+def progress_summary(stats: Dict[str, Any]) -> Dict[str, Any]:
+    rate = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+    return {"rows": stats["rows"], "imported": stats["imported"], "failed": stats["failed"],
+            "rows_per_second": round(rate)}
+
+
+async def import_events(path: str, file_format: str, compressed: bool = False) -> AsyncIterator[Dict[str, Any]]:
+    # Runs import_file() on a worker thread (it uses the synchronous engine)
+    # and yields a "progress" event per batch and a final "done" event with
+    # the per-row errors. The file is deleted afterwards.
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+
+    def emit(event):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    def run():
+        try:
+            stats = import_file(path, file_format, compressed,
+                                progress=lambda s: emit({"event": "progress", **progress_summary(s)}))
+            emit({"event": "done", **progress_summary(stats), "seconds": round(stats["seconds"], 3),
+                  "error": stats["error"], "errors": stats["errors"]})
+        except Exception as e:
+            emit({"event": "done", "error": f"Import failed: {e}"})
+        finally:
+            os.unlink(path)
+            emit(None)
+
+    loop.run_in_executor(None, run)
+    while True:
+        event = await events.get()
+        if event is None:
+            return
+        yield event
+
+
+def main(argv=None) -> int:
+    # python -m backend.data_ingestion.bulk_import receipts.csv [...]
+    parser = argparse.ArgumentParser(description="Import receipts from CSV/JSON/NDJSON files (optionally .gz).")
+    parser.add_argument("files", nargs="+", help="files written by /api/export_receipts/ or in the same layout")
+    parser.add_argument("--format", choices=IMPORT_FORMATS, help="default: from the file extension")
+    parser.add_argument("--bulk", action="store_true",
+                        help="one transaction per file, indexes rebuilt at the end (no concurrent writers)")
+    args = parser.parse_args(argv)
+
+    def report(stats):
+        summary = progress_summary(stats)
+        print(f"\r  {summary['rows']} rows, {summary['imported']} committed, {summary['failed']} failed "
+              f"({summary['rows_per_second']} rows/s)", end="", file=sys.stderr, flush=True)
+
+    init_db() # Creates or migrates the schema, like starting the API would
+    status = 0
+    for path in args.files:
+        print(f"Importing {path}", file=sys.stderr)
+        stats = import_file(path, args.format, progress=report, bulk=args.bulk)
+        print(file=sys.stderr)
+        for error in stats["errors"][:20]:
+            print(f"  row {error['row']}: {error['error']}")
+        if stats["failed"] > 20:
+            print(f"  ... {stats['failed'] - 20} more rows failed")
+        if stats["error"]:
+            print(f"  stopped: {stats['error']}")
+            status = 1
+        print(f"{path}: imported {stats['imported']} of {stats['rows']} rows in {stats['seconds']:.1f}s")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
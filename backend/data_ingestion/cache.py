@@ -0,0 +1,71 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Upper bound for the extraction cache, in bytes of cached text and fields.
+CACHE_MAX_BYTES = int(os.getenv("RECEIPT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+class ExtractionCache:
+    # Content-addressed LRU cache of OCR/PDF extraction results. Keys are built
+    # from the SHA-256 of the decoded file, values hold the extracted text, so
+    # a re-upload never goes back to Tesseract/PyMuPDF. Parsing is redone on a
+    # hit, so edited category rules apply to re-uploaded files too.
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _entry_size(value: Dict[str, Any]) -> int:
+        return sys.getsizeof(value.get("extracted_text") or "") + sum(
+            sys.getsizeof(v) for v in (value.get("parsed") or {}).values()
+        )
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, value: Dict[str, Any]):
+        size = self._entry_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            # Evict least recently used entries until we fit again
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+extraction_cache = ExtractionCache()
@@ -1,38 +1,145 @@
 import base64
+import logging
+import os
+import time
 from io import BytesIO
+from typing import Callable, Dict, List, Optional, Tuple, Union
 from PIL import Image # For images
 import PyPDF2 # For PDFs (can also use pdfminer.six or fitz/PyMuPDF)
 import fitz # PyMuPDF for more robust PDF text extraction
+from backend.data_ingestion.ocr import OCR_PREPROCESS, ocr_image
+from backend.data_parsing.rule_parser import parse_receipt_data
+
+logger = logging.getLogger(__name__)
+
+# PDF pages without a text layer (scans) are rendered at this resolution and
+# OCRed (0 disables the fallback).
+PDF_OCR_DPI = int(os.getenv("RECEIPT_PDF_OCR_DPI", "300"))
+# Stop reading a PDF once the pages read so far give a vendor, a date and a
+# total. Much faster on long bills that have them on the first page, but the
+# category (and a field the parser would have taken from a later, more
+# specific match) then only reflects those pages. Off by default.
+PDF_EARLY_STOP = int(os.getenv("RECEIPT_PDF_EARLY_STOP", "0"))
+
+PdfSource = Union[bytes, str] # The file's bytes or its path
 
 def decode_base64_file(base64_string: str) -> bytes:
     return base64.b64decode(base64_string)
 
+def _image_to_text(image_source) -> str:
+    # image_source may be a path or a file-like object; PIL reads it lazily.
+    try:
+        # Requires Tesseract OCR installed on the system and the pytesseract
+        # (or tesserocr) Python package. The image is downscaled, binarized,
+        # cropped and deskewed first (see ocr.py).
+        img = Image.open(image_source)
+        return ocr_image(img)
+    except ImportError:
+        logger.warning("Pytesseract not installed or Tesseract not found. Skipping OCR.")
+        return "Pytesseract not configured or Tesseract not found on system path."
+    except Exception as e:
+        logger.warning("Error processing image with OCR: %s", e)
+        return f"Error during OCR: {e}"
+
+def _open_pdf(source: PdfSource):
+    if isinstance(source, bytes):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source, filetype="pdf")
+
+def pdf_page_count(source: PdfSource) -> int:
+    # Only reads the page tree; 0 if the file can't be opened
+    try:
+        with _open_pdf(source) as doc:
+            return doc.page_count
+    except Exception:
+        return 0
+
+def _ocr_page(page) -> str:
+    pixmap = page.get_pixmap(dpi=PDF_OCR_DPI, colorspace=fitz.csGRAY)
+    image = Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples)
+    # Rendered at the DPI OCR wants already, so no downscaling
+    return ocr_image(image, tuple(step for step in OCR_PREPROCESS if step != "downscale"))
+
+def _page_text(page) -> Tuple[str, str]:
+    text = page.get_text()
+    if text.strip() or not PDF_OCR_DPI or not page.get_images():
+        return text, "text"
+    try:
+        return _ocr_page(page), "ocr"
+    except Exception as e:
+        logger.warning("OCR of PDF page %d failed: %s", page.number + 1, e)
+        return "", "ocr"
+
+def track_fields() -> Callable[[str], bool]:
+    # A stop_when for extract_pdf_pages: true once the pages seen so far gave
+    # a vendor, a date and a total. Each page is parsed once, on its own, and
+    # the fields found are remembered, so a long bill costs linear time.
+    found = set()
+
+    def fields_found(page_text: str) -> bool:
+        parsed = parse_receipt_data(page_text)
+        if parsed["vendor"] != "Unknown Vendor":
+            found.add("vendor")
+        if parsed["transaction_date"] is not None:
+            found.add("transaction_date")
+        if parsed["amount"] > 0:
+            found.add("amount")
+        return len(found) == 3
+    return fields_found
+
+def extract_pdf_pages(source: PdfSource, start: int = 0, stop: Optional[int] = None,
+                      stop_when: Optional[Callable[[str], bool]] = None) -> Tuple[List[str], List[Dict]]:
+    # Text of pages [start, stop), loaded one at a time, and how long each
+    # took and how ("text" layer or "ocr"). With stop_when, calls it with the
+    # text of each page and stops after the first one for which it is true.
+    texts: List[str] = []
+    timings: List[Dict] = []
+    with _open_pdf(source) as doc:
+        for number in range(start, doc.page_count if stop is None else min(stop, doc.page_count)):
+            started = time.perf_counter()
+            text, method = _page_text(doc.load_page(number))
+            texts.append(text)
+            timings.append({"page": number + 1, "method": method, "seconds": time.perf_counter() - started})
+            if stop_when is not None and stop_when(text):
+                break
+    return texts, timings
+
+def extract_pdf_text(source: PdfSource, start: int = 0, stop: Optional[int] = None) -> Tuple[str, List[Dict]]:
+    # The text of the document (or of pages [start, stop)), joined once rather
+    # than concatenated page by page, and the per-page timings
+    try:
+        texts, timings = extract_pdf_pages(source, start, stop, stop_when=track_fields() if PDF_EARLY_STOP else None)
+        return "".join(texts), timings
+    except Exception as e:
+        logger.warning("Error processing PDF: %s", e)
+        return f"Error during PDF text extraction: {e}", []
+
+def _pdf_to_text(source: PdfSource) -> str:
+    return extract_pdf_text(source)[0]
+
 def extract_text_from_file(file_content: bytes, file_type: str) -> str:
     text = ""
     if "image" in file_type:
-        try:
-            # Requires Tesseract OCR installed on the system
-            # and pytesseract Python package
-            from pytesseract import image_to_string
-            img = Image.open(BytesIO(file_content))
-            text = image_to_string(img)
-        except ImportError:
-            print("Pytesseract not installed or Tesseract not found. Skipping OCR.")
-            text = "Pytesseract not configured or Tesseract not found on system path."
-        except Exception as e:
-            print(f"Error processing image with OCR: {e}")
-            text = f"Error during OCR: {e}"
+        text = _image_to_text(BytesIO(file_content))
     elif "pdf" in file_type:
-        try:
-            doc = fitz.open(stream=file_content, filetype="pdf")
-            for page in doc:
-                text += page.get_text()
-            doc.close()
-        except Exception as e:
-            print(f"Error processing PDF: {e}")
-            text = f"Error during PDF text extraction: {e}"
+        text = _pdf_to_text(file_content)
     elif "text" in file_type:
         text = file_content.decode('utf-8')
     else:
         raise ValueError(f"Unsupported file type: {file_type}")
-    return text
\ No newline at end of file
+    return text
+
+def extract_text_from_path(file_path: str, file_type: str) -> str:
+    # Same as extract_text_from_file, but PIL and PyMuPDF read straight from the
+    # spooled upload on disk instead of from an in-memory copy of it.
+    text = ""
+    if "image" in file_type:
+        text = _image_to_text(file_path)
+    elif "pdf" in file_type:
+        text = _pdf_to_text(file_path)
+    elif "text" in file_type:
+        with open(file_path, "r", encoding="utf-8") as f:
+            text = f.read()
+    else:
+        raise ValueError(f"Unsupported file type: {file_type}")
+    return text
@@ -0,0 +1,235 @@
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import List, Optional, Set
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from backend.data_storage.database import SessionLocal, ReceiptJobDB
+from backend.data_ingestion.pipeline import (
+    process_upload_sync, build_receipt_data, store_receipt, DuplicateReceiptError, MAX_WORKERS
+)
+from backend.metrics import stage_span
+from backend.models.receipt import ReceiptInput
+
+logger = logging.getLogger(__name__)
+
+# Number of jobs processed concurrently by this process (0 disables the runner).
+JOB_WORKERS = int(os.getenv("RECEIPT_JOB_WORKERS", str(MAX_WORKERS)))
+# Attempts before a job is marked as failed for good.
+JOB_MAX_ATTEMPTS = int(os.getenv("RECEIPT_JOB_MAX_ATTEMPTS", "3"))
+# Back-pressure: submissions are rejected once this many jobs are queued or running.
+JOB_MAX_PENDING = int(os.getenv("RECEIPT_JOB_MAX_PENDING", "1000"))
+# How long an idle runner sleeps before polling the queue again.
+JOB_POLL_INTERVAL = float(os.getenv("RECEIPT_JOB_POLL_INTERVAL", "1.0"))
+# A running job's lease (its updated_at) is renewed every third of this while
+# its process is alive; once it is older than this the job is assumed lost
+# (e.g. the process was killed) and is put back on the queue.
+JOB_LEASE_SECONDS = int(os.getenv("RECEIPT_JOB_LEASE_SECONDS", "60"))
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def submit_job(db: Session, receipt_input: ReceiptInput) -> ReceiptJobDB:
+    in_flight = db.query(ReceiptJobDB).filter(ReceiptJobDB.status.in_([PENDING, RUNNING])).count()
+    if in_flight >= JOB_MAX_PENDING:
+        raise QueueFullError(f"Job queue is full ({in_flight} jobs pending). Retry later.")
+
+    now = datetime.utcnow()
+    job = ReceiptJobDB(
+        status=PENDING,
+        file_name=receipt_input.file_name,
+        file_type=receipt_input.file_type,
+        file_content_base64=receipt_input.file_content_base64,
+        attempts=0,
+        created_at=now,
+        updated_at=now,
+        next_attempt_at=now
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    _wake_up.set()
+    return job
+
+
+def get_job(db: Session, job_id: int) -> Optional[ReceiptJobDB]:
+    return db.query(ReceiptJobDB).filter(ReceiptJobDB.id == job_id).first()
+
+
+def renew_leases(db: Session, job_ids: List[int]):
+    if job_ids:
+        db.execute(
+            update(ReceiptJobDB)
+            .where(ReceiptJobDB.id.in_(job_ids), ReceiptJobDB.status == RUNNING)
+            .values(updated_at=datetime.utcnow())
+        )
+        db.commit()
+
+
+def requeue_stale_jobs(db: Session) -> int:
+    # Jobs left "running" by a crashed or restarted process go back to pending.
+    # The lost run was counted as an attempt when it was claimed, so a job
+    # that keeps taking its process down fails after JOB_MAX_ATTEMPTS.
+    now = datetime.utcnow()
+    stale = (ReceiptJobDB.status == RUNNING, ReceiptJobDB.updated_at < now - timedelta(seconds=JOB_LEASE_SECONDS))
+    failed = db.execute(
+        update(ReceiptJobDB)
+        .where(*stale, ReceiptJobDB.attempts >= JOB_MAX_ATTEMPTS)
+        .values(status=FAILED, error="Failed to process receipt: the worker was lost on the last attempt",
+                file_content_base64=None, updated_at=now)
+    ).rowcount
+    requeued = db.execute(
+        update(ReceiptJobDB)
+        .where(*stale)
+        .values(status=PENDING, error="The worker was lost during the last attempt", updated_at=now,
+                next_attempt_at=now)
+    ).rowcount
+    db.commit()
+    return failed + requeued
+
+
+def _claim_next_job(db: Session) -> Optional[ReceiptJobDB]:
+    now = datetime.utcnow()
+    candidate = (
+        db.query(ReceiptJobDB.id)
+        .filter(ReceiptJobDB.status == PENDING, ReceiptJobDB.next_attempt_at <= now)
+        .order_by(ReceiptJobDB.next_attempt_at, ReceiptJobDB.id)
+        .first()
+    )
+    if candidate is None:
+        return None
+    # Conditional update so that only one runner (in any process) wins the job.
+    result = db.execute(
+        update(ReceiptJobDB)
+        .where(ReceiptJobDB.id == candidate.id, ReceiptJobDB.status == PENDING)
+        .values(status=RUNNING, attempts=ReceiptJobDB.attempts + 1, updated_at=now)
+    )
+    db.commit()
+    if result.rowcount != 1:
+        return None
+    return get_job(db, candidate.id)
+
+
+def _run_job(db: Session, job: ReceiptJobDB):
+    try:
+        # A retried job whose extraction already succeeded is served from the cache
+        content_hash, result = process_upload_sync(job.file_content_base64, job.file_type)
+        validated_data = build_receipt_data(result["parsed"])
+        with stage_span("store"):
+            db_receipt, _ = store_receipt(db, validated_data, content_hash, raw_text=result["extracted_text"])
+    except (ValueError, DuplicateReceiptError) as e:
+        # Unsupported files, unparseable receipts and rejected duplicates will
+        # not succeed on retry.
+        db.rollback()
+        _finish_job(db, job, FAILED, error=str(e))
+        return
+    except Exception as e:
+        db.rollback()
+        if job.attempts >= JOB_MAX_ATTEMPTS:
+            _finish_job(db, job, FAILED, error=f"Failed to process receipt: {e}")
+        else:
+            # Exponential back-off between attempts: 2s, 4s, 8s, ...
+            job.status = PENDING
+            job.error = f"Attempt {job.attempts} failed: {e}"
+            job.updated_at = datetime.utcnow()
+            job.next_attempt_at = job.updated_at + timedelta(seconds=2 ** job.attempts)
+            db.commit()
+        return
+
+    db.flush()
+    _finish_job(db, job, DONE, receipt_id=db_receipt.id)
+
+
+def _finish_job(db: Session, job: ReceiptJobDB, status: str, error: Optional[str] = None,
+                receipt_id: Optional[int] = None):
+    job.status = status
+    job.error = error
+    job.receipt_id = receipt_id
+    job.file_content_base64 = None # The payload is no longer needed
+    job.updated_at = datetime.utcnow()
+    db.commit()
+
+
+_wake_up = threading.Event()
+_stop = threading.Event()
+_threads: List[threading.Thread] = []
+# Jobs this process is running, whose leases _lease_loop renews
+_running: Set[int] = set()
+_running_lock = threading.Lock()
+
+
+def _runner_loop():
+    while not _stop.is_set():
+        db = SessionLocal()
+        try:
+            job = _claim_next_job(db)
+            if job is not None:
+                with _running_lock:
+                    _running.add(job.id)
+                try:
+                    _run_job(db, job)
+                finally:
+                    with _running_lock:
+                        _running.discard(job.id)
+                continue
+        except Exception:
+            db.rollback()
+            logger.exception("Job runner error")
+        finally:
+            db.close()
+        _wake_up.wait(JOB_POLL_INTERVAL)
+        _wake_up.clear()
+
+
+def _lease_loop():
+    # Renews the leases of this process's running jobs, then requeues the jobs
+    # of processes that stopped renewing theirs.
+    while not _stop.wait(JOB_LEASE_SECONDS / 3):
+        db = SessionLocal()
+        try:
+            with _running_lock:
+                job_ids = list(_running)
+            renew_leases(db, job_ids)
+            if requeue_stale_jobs(db):
+                _wake_up.set()
+        except Exception:
+            db.rollback()
+            logger.exception("Job lease error")
+        finally:
+            db.close()
+
+
+def start_job_workers():
+    if _threads or JOB_WORKERS <= 0:
+        return
+    db = SessionLocal()
+    try:
+        requeue_stale_jobs(db)
+    finally:
+        db.close()
+    _stop.clear()
+    for i in range(JOB_WORKERS):
+        thread = threading.Thread(target=_runner_loop, name=f"receipt-job-runner-{i}", daemon=True)
+        thread.start()
+        _threads.append(thread)
+    thread = threading.Thread(target=_lease_loop, name="receipt-job-lease", daemon=True)
+    thread.start()
+    _threads.append(thread)
+
+
+def stop_job_workers():
+    _stop.set()
+    _wake_up.set()
+    for thread in _threads:
+        thread.join()
+    _threads.clear()
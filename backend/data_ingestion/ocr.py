@@ -0,0 +1,221 @@
+import os
+import shlex
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+try:
+    import tesserocr # Optional: keeps one Tesseract engine per process instead of one subprocess per call
+except ImportError:
+    tesserocr = None
+
+# Image preprocessing ahead of Tesseract. Phone photos arrive at 12 MP with
+# uneven lighting, a background around the receipt and a slight tilt, and
+# Tesseract's time grows with the pixel count while its accuracy drops on
+# all of the rest. The steps, in order:
+#   downscale  to OCR_TARGET_DPI when the file declares a real DPI (scans),
+#              otherwise to at most OCR_MAX_PIXELS; JPEGs are decoded
+#              directly at the reduced size
+#   binarize   grayscale, then ink where a pixel is darker than its
+#              neighbourhood (local-mean threshold, robust to shadows),
+#              except on the background around the paper
+#   crop       to the bounding box of the ink plus a margin
+#   deskew     rotate by the angle whose row profile is sharpest
+# RECEIPT_OCR_PREPROCESS picks the steps (comma-separated, "none" for none).
+PREPROCESS_STEPS = ("downscale", "binarize", "crop", "deskew")
+OCR_PREPROCESS = tuple(step.strip() for step in os.getenv("RECEIPT_OCR_PREPROCESS", ",".join(PREPROCESS_STEPS))
+                       .split(",") if step.strip() and step.strip() != "none")
+OCR_TARGET_DPI = int(os.getenv("RECEIPT_OCR_TARGET_DPI", "300"))
+# 3 MP halves a 12 MP photo, which the JPEG decoder does almost for free; a
+# receipt filling 60% of the frame then comes out at about 300 dpi.
+OCR_MAX_PIXELS = int(os.getenv("RECEIPT_OCR_MAX_PIXELS", str(3 * 1000 * 1000)))
+# Largest tilt corrected, in degrees (0 skips the search).
+OCR_MAX_SKEW = float(os.getenv("RECEIPT_OCR_MAX_SKEW", "5"))
+# Tesseract page segmentation mode: 4 reads a single column of lines of
+# varying size, which is what a receipt is (3, Tesseract's default, looks for
+# a multi-column layout first and tends to split item names from prices).
+OCR_PSM = int(os.getenv("RECEIPT_OCR_PSM", "4"))
+OCR_LANG = os.getenv("RECEIPT_OCR_LANG", "eng")
+# Characters Tesseract may output (empty allows all), e.g. to keep stray
+# glyphs out of amounts: "0123456789.,:/$-ABC...xyz"
+OCR_WHITELIST = os.getenv("RECEIPT_OCR_WHITELIST", "")
+
+# Images that say they are below this are phone photos (72 dpi) or unset
+_MIN_REAL_DPI = 100
+_DESKEW_WIDTH = 600 # Pixels; the skew search runs on a thumbnail this wide
+_CROP_MARGIN = 20
+# Rows/columns with less ink than this fraction are noise, not text
+_CROP_MIN_INK = 0.005
+
+_api = None
+_api_lock = threading.Lock()
+
+
+def _scale_for(image: Image.Image) -> float:
+    dpi = image.info.get("dpi")
+    if dpi and dpi[0] >= _MIN_REAL_DPI:
+        scale = OCR_TARGET_DPI / float(dpi[0])
+    else:
+        scale = 1.0
+    pixels = image.width * image.height * scale * scale
+    if OCR_MAX_PIXELS and pixels > OCR_MAX_PIXELS:
+        scale *= (OCR_MAX_PIXELS / pixels) ** 0.5
+    return min(scale, 1.0)
+
+
+def downscale(image: Image.Image) -> Image.Image:
+    scale = _scale_for(image)
+    if scale >= 1.0:
+        return image
+    size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+    # JPEG can decode at 1/2, 1/4 or 1/8 scale, which skips most of the work
+    # for a 12 MP photo; it never goes below the requested size.
+    image.draft("L", size)
+    return image.resize(size, Image.LANCZOS, reducing_gap=2.0) if image.size != size else image
+
+
+def _otsu_threshold(histogram: List[int]) -> int:
+    counts = np.asarray(histogram[:256], dtype=np.float64)
+    levels = np.arange(256)
+    below = np.cumsum(counts)
+    above = below[-1] - below
+    below_mean = np.cumsum(counts * levels) / np.maximum(below, 1)
+    above_mean = (np.sum(counts * levels) - np.cumsum(counts * levels)) / np.maximum(above, 1)
+    return int(np.argmax(below * above * (below_mean - above_mean) ** 2))
+
+
+def _background(gray: Image.Image) -> np.ndarray:
+    # The table or scanner lid around a photographed receipt: the dark
+    # regions connected to the image border, grown from the border one pixel
+    # per pass on an eighth-size copy. Text never touches the border, so it
+    # is left alone.
+    small = gray.reduce(8)
+    dark = np.asarray(small) <= _otsu_threshold(small.histogram())
+    background = np.zeros_like(dark)
+    background[[0, -1], :] = dark[[0, -1], :]
+    background[:, [0, -1]] = dark[:, [0, -1]]
+    while True:
+        grown = background.copy()
+        grown[1:, :] |= background[:-1, :]
+        grown[:-1, :] |= background[1:, :]
+        grown[:, 1:] |= background[:, :-1]
+        grown[:, :-1] |= background[:, 1:]
+        grown &= dark
+        if np.array_equal(grown, background):
+            break
+        background = grown
+    # One more pixel covers the blurred edge of the paper
+    mask = Image.fromarray(background.astype(np.uint8) * 255).filter(ImageFilter.MaxFilter(3))
+    return np.asarray(mask.resize(gray.size, Image.NEAREST)) > 0
+
+
+def binarize(image: Image.Image) -> Image.Image:
+    gray = image.convert("L")
+    radius = max(8, min(image.size) // 40)
+    local_mean = np.asarray(gray.filter(ImageFilter.BoxBlur(radius)), dtype=np.int16)
+    # Text is darker than its surroundings; the offset keeps paper grain and
+    # JPEG noise in flat areas from turning into speckles
+    ink = (np.asarray(gray, dtype=np.int16) < local_mean - 12) & ~_background(gray)
+    return Image.fromarray(np.where(ink, 0, 255).astype(np.uint8))
+
+
+def _ink_span(counts: np.ndarray, length: int) -> Tuple[int, int]:
+    inked = np.flatnonzero(counts > max(2, length * _CROP_MIN_INK))
+    if not len(inked):
+        return 0, len(counts)
+    return max(0, inked[0] - _CROP_MARGIN), min(len(counts), inked[-1] + 1 + _CROP_MARGIN)
+
+
+def crop(image: Image.Image) -> Image.Image:
+    # A plain bounding box would stretch to the farthest speck of noise, so
+    # the box is where rows and columns hold a meaningful amount of ink
+    ink = np.asarray(image.convert("L")) < 128
+    top, bottom = _ink_span(ink.sum(axis=1), image.width)
+    left, right = _ink_span(ink.sum(axis=0), image.height)
+    return image.crop((int(left), int(top), int(right), int(bottom)))
+
+
+def _profile_score(mask: Image.Image, angle: float) -> float:
+    # Text lines that run horizontally give alternating full and empty rows
+    rows = np.asarray(mask.rotate(angle, resample=Image.NEAREST), dtype=np.int32).sum(axis=1)
+    return float(np.square(np.diff(rows)).sum())
+
+
+def skew_angle(image: Image.Image, max_skew: float = OCR_MAX_SKEW) -> float:
+    # Degrees to rotate (counter-clockwise) to level the text: a coarse
+    # search in 0.5 degree steps, then 0.1 degree steps around the best.
+    mask = ImageOps.invert(image.convert("L"))
+    if mask.width > _DESKEW_WIDTH:
+        mask = mask.resize((_DESKEW_WIDTH, max(1, mask.height * _DESKEW_WIDTH // mask.width)), Image.BILINEAR)
+    mask = mask.point(lambda v: 1 if v > 128 else 0)
+
+    def best(angles: Iterable[float]) -> float:
+        return max(angles, key=lambda angle: _profile_score(mask, angle))
+
+    coarse = best(np.arange(-max_skew, max_skew + 0.25, 0.5))
+    return float(best(np.arange(coarse - 0.4, coarse + 0.45, 0.1)))
+
+
+def deskew(image: Image.Image) -> Image.Image:
+    if OCR_MAX_SKEW <= 0:
+        return image
+    angle = skew_angle(image)
+    if abs(angle) < 0.2:
+        return image
+    return image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+
+
+_STEPS = {"downscale": downscale, "binarize": binarize, "crop": crop, "deskew": deskew}
+
+
+def preprocess(image: Image.Image, steps: Tuple[str, ...] = OCR_PREPROCESS) -> Image.Image:
+    unknown = [step for step in steps if step not in _STEPS]
+    if unknown:
+        raise ValueError(f"Unknown OCR preprocessing step: {', '.join(unknown)}")
+    # Downscaling comes first so the decoder can skip work, then the EXIF
+    # orientation (phone cameras store it instead of rotating the pixels)
+    if "downscale" in steps:
+        image = downscale(image)
+    image = ImageOps.exif_transpose(image)
+    for step in steps:
+        if step != "downscale":
+            image = _STEPS[step](image)
+    return image
+
+
+def _tesserocr_api(psm: int, whitelist: str):
+    global _api
+    if _api is None:
+        _api = tesserocr.PyTessBaseAPI(lang=OCR_LANG)
+        _api.SetVariable("preserve_interword_spaces", "1")
+    _api.SetPageSegMode(psm)
+    _api.SetVariable("tessedit_char_whitelist", whitelist)
+    return _api
+
+
+def tesseract_config(psm: int = OCR_PSM, whitelist: str = OCR_WHITELIST) -> str:
+    config = f"--psm {psm} -c preserve_interword_spaces=1"
+    if whitelist:
+        # pytesseract splits the config with shlex, so spaces or quotes in the
+        # whitelist must be quoted to stay one argument
+        config += " -c " + shlex.quote(f"tessedit_char_whitelist={whitelist}")
+    return config
+
+
+def recognize(image: Image.Image, psm: int = OCR_PSM, whitelist: str = OCR_WHITELIST,
+              engine: Optional[str] = None) -> str:
+    # engine: "tesserocr" (in-process, reused), "pytesseract" (a tesseract
+    # subprocess per call) or None for tesserocr when it is installed.
+    if engine == "tesserocr" or (engine is None and tesserocr is not None):
+        with _api_lock: # One engine per process; it is not thread-safe
+            api = _tesserocr_api(psm, whitelist)
+            api.SetImage(image)
+            return api.GetUTF8Text()
+    from pytesseract import image_to_string
+    return image_to_string(image, lang=OCR_LANG, config=tesseract_config(psm, whitelist))
+
+
+def ocr_image(image: Image.Image, steps: Tuple[str, ...] = OCR_PREPROCESS) -> str:
+    return recognize(preprocess(image, steps))
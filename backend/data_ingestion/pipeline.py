@@ -0,0 +1,372 @@
+import os
+import asyncio
+import hashlib
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from backend.data_ingestion.file_handler import (
+    extract_text_from_file, extract_text_from_path, decode_base64_file, extract_pdf_text, pdf_page_count,
+    PDF_EARLY_STOP, PdfSource
+)
+from backend.data_ingestion.cache import extraction_cache
+from backend.data_parsing.rule_parser import parse_receipt_data
+from backend.data_parsing.rules import record_rule_match
+from backend.data_storage.database import ReceiptDB
+from backend.metrics import PDF_PAGE_SECONDS, STAGE_ERRORS, STAGE_SECONDS, stage_span
+from backend.models.receipt import ReceiptData
+
+# Number of worker processes used for OCR / PDF extraction and parsing.
+# RECEIPT_WORKERS=0 (the default) means one worker per CPU core.
+MAX_WORKERS = int(os.getenv("RECEIPT_WORKERS", "0")) or os.cpu_count() or 1
+# Upper bound on the number of files accepted in a single batch request.
+MAX_BATCH_SIZE = int(os.getenv("RECEIPT_MAX_BATCH_SIZE", "500"))
+# What to do when a receipt with identical file content already exists:
+# "off" stores it again, "reject" refuses it, "merge" reuses the existing row.
+DEDUP_MODE = os.getenv("RECEIPT_DEDUP_MODE", "off").lower()
+# Largest file accepted by the streaming upload endpoints, in bytes.
+MAX_UPLOAD_BYTES = int(os.getenv("RECEIPT_MAX_UPLOAD_BYTES", str(64 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# PDFs with at least this many pages are split into page ranges extracted by
+# several pool workers at once (0 disables splitting). Smaller files are not
+# worth the extra round trips.
+PDF_SPLIT_PAGES = int(os.getenv("RECEIPT_PDF_SPLIT_PAGES", "8"))
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+class DuplicateReceiptError(Exception):
+    def __init__(self, receipt_id: Optional[int]):
+        if receipt_id is None:
+            message = "Duplicate receipt: identical file appears earlier in this batch"
+        else:
+            message = f"Duplicate receipt: identical file already stored as receipt {receipt_id}"
+        super().__init__(message)
+        self.receipt_id = receipt_id
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+def get_executor() -> ProcessPoolExecutor:
+    # The pool is created lazily so importing this module (e.g. from a worker
+    # process) never spawns processes on its own.
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS)
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+
+def _extract_stage(file_type: str) -> str:
+    # Same checks, in the same order, as extract_text_from_file
+    if "image" in file_type:
+        return "extract_image"
+    if "pdf" in file_type:
+        return "extract_pdf"
+    return "extract_text"
+
+
+def _reset_peak_rss() -> bool:
+    # Linux only: writing 5 to clear_refs resets this process's RSS high-water
+    # mark (VmHWM), so the next _peak_rss_kb() covers just the work in between
+    # rather than everything the pool worker has done since it started.
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_kb() -> Optional[int]:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) # kB
+    except OSError:
+        pass
+    return None
+
+
+def _extract(source: PdfSource, file_type: str) -> Tuple[str, List[Dict]]:
+    # Text of an upload given as bytes or a path, and for PDFs the page timings
+    if _extract_stage(file_type) == "extract_pdf":
+        return extract_pdf_text(source)
+    if isinstance(source, bytes):
+        return extract_text_from_file(source, file_type), []
+    return extract_text_from_path(source, file_type), []
+
+
+def _parse(extracted_text: str, timings: Dict[str, float]) -> Dict[str, Any]:
+    # Metrics live in the parent process, so the worker returns its stage
+    # timings with the result and the parent records them (see _record_timings).
+    started = time.perf_counter()
+    parsed = parse_receipt_data(extracted_text)
+    timings["parse"] = time.perf_counter() - started
+    return {"extracted_text": extracted_text, "parsed": parsed, "timings": timings}
+
+
+# Worker-side entry points. They run inside the process pool, so they must be
+# module-level functions and only take/return picklable values.
+def extract_and_parse(file_content: bytes, file_type: str) -> Dict[str, Any]:
+    started = time.perf_counter()
+    extracted_text, pages = _extract(file_content, file_type)
+    result = _parse(extracted_text, {_extract_stage(file_type): time.perf_counter() - started})
+    if pages:
+        result["pdf_pages"] = pages
+    return result
+
+
+def extract_and_parse_path(file_path: str, file_type: str) -> Dict[str, Any]:
+    measured = _reset_peak_rss()
+    result = extract_and_parse(file_path, file_type)
+    if measured:
+        result["worker_peak_rss_kb"] = _peak_rss_kb()
+    return result
+
+
+def extract_pdf_range(source: PdfSource, start: int, stop: int) -> Tuple[str, List[Dict], Optional[int]]:
+    # One slice of a split PDF: its text, page timings and this worker's peak RSS
+    # while extracting it
+    measured = _reset_peak_rss()
+    text, pages = extract_pdf_text(source, start, stop)
+    return text, pages, _peak_rss_kb() if measured else None
+
+
+def parse_extracted(extracted_text: str, timings: Dict[str, float]) -> Dict[str, Any]:
+    return _parse(extracted_text, timings)
+
+
+def pdf_page_ranges(source: PdfSource, file_type: str, tasks: int = MAX_WORKERS) -> List[Tuple[int, int]]:
+    # Page ranges for a PDF worth splitting across the pool, [] otherwise.
+    # Early stop reads pages in order until it has what it needs, so it
+    # always runs as one task.
+    if _extract_stage(file_type) != "extract_pdf" or not PDF_SPLIT_PAGES or PDF_EARLY_STOP or tasks < 2:
+        return []
+    pages = pdf_page_count(source)
+    if pages < PDF_SPLIT_PAGES:
+        return []
+    tasks = min(tasks, pages)
+    return [(pages * i // tasks, pages * (i + 1) // tasks) for i in range(tasks)]
+
+
+def join_pdf_ranges(parts: List[Tuple[str, List[Dict], Optional[int]]]) -> Tuple[str, List[Dict], Optional[int]]:
+    rss = [part[2] for part in parts if part[2] is not None]
+    return "".join(part[0] for part in parts), [page for part in parts for page in part[1]], max(rss, default=None)
+
+
+def _split_result(result: Dict[str, Any], pages: List[Dict], rss: Optional[int]) -> Dict[str, Any]:
+    result["pdf_pages"] = pages
+    if rss is not None:
+        result["worker_peak_rss_kb"] = rss
+    return result
+
+
+def _record_timings(result: Dict[str, Any]):
+    for stage, seconds in result.get("timings", {}).items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    for page in result.get("pdf_pages", ()):
+        PDF_PAGE_SECONDS.observe(page["seconds"], method=page["method"])
+
+
+async def run_in_pool(func, *args):
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(get_executor(), func, *args)
+    except Exception:
+        STAGE_ERRORS.inc(stage="extract")
+        raise
+
+
+async def extract_in_pool(func, source: PdfSource, file_type: str) -> Dict[str, Any]:
+    # func(source, file_type) in one worker, or a large PDF split into page
+    # ranges across workers, joined in page order and parsed as a whole.
+    ranges = await asyncio.to_thread(pdf_page_ranges, source, file_type) if "pdf" in file_type else []
+    if not ranges:
+        return await run_in_pool(func, source, file_type)
+    started = time.perf_counter()
+    parts = await asyncio.gather(*(run_in_pool(extract_pdf_range, source, start, stop) for start, stop in ranges))
+    text, pages, rss = join_pdf_ranges(parts)
+    result = await run_in_pool(parse_extracted, text, {"extract_pdf": time.perf_counter() - started})
+    return _split_result(result, pages, rss)
+
+
+def extract_in_pool_sync(source: PdfSource, file_type: str) -> Dict[str, Any]:
+    # Blocking variant of extract_in_pool for background threads
+    executor = get_executor()
+    ranges = pdf_page_ranges(source, file_type)
+    if not ranges:
+        return executor.submit(extract_and_parse, source, file_type).result()
+    started = time.perf_counter()
+    futures = [executor.submit(extract_pdf_range, source, start, stop) for start, stop in ranges]
+    text, pages, rss = join_pdf_ranges([future.result() for future in futures])
+    result = executor.submit(parse_extracted, text, {"extract_pdf": time.perf_counter() - started}).result()
+    return _split_result(result, pages, rss)
+
+
+@stage_span("decode")
+def decode_and_hash(file_content_base64: str) -> Tuple[bytes, str]:
+    file_content = decode_base64_file(file_content_base64)
+    return file_content, hashlib.sha256(file_content).hexdigest()
+
+
+def _cache_key(content_hash: str, file_type: str) -> str:
+    # The same bytes declared as a different type may extract differently
+    return f"{content_hash}:{file_type}"
+
+
+def _cache_result(key: str, result: Dict[str, Any]):
+    # Only the extracted text is cached: the parsed fields depend on the
+    # category rules, which may be reloaded before the file comes back.
+    record_rule_match(result["parsed"].get("category_rule"))
+    extraction_cache.put(key, {"extracted_text": result["extracted_text"]})
+
+
+def _parse_cached(key: str) -> Optional[Dict[str, Any]]:
+    # Re-parses cached text with the current rules; parsing is cheap next to
+    # OCR, so it runs here rather than on the pool.
+    cached = extraction_cache.get(key)
+    if cached is None:
+        return None
+    result = _parse(cached["extracted_text"], {})
+    _record_timings(result)
+    record_rule_match(result["parsed"].get("category_rule"))
+    return result
+
+
+async def process_upload(file_content_base64: str, file_type: str) -> Tuple[str, Dict[str, Any]]:
+    # Decode and hash off the event loop, then only hit the pool on a cache miss.
+    file_content, content_hash = await asyncio.to_thread(decode_and_hash, file_content_base64)
+    key = _cache_key(content_hash, file_type)
+    result = await asyncio.to_thread(_parse_cached, key)
+    if result is None:
+        result = await extract_in_pool(extract_and_parse, file_content, file_type)
+        _record_timings(result)
+        _cache_result(key, result)
+    return content_hash, result
+
+
+def process_upload_sync(file_content_base64: str, file_type: str) -> Tuple[str, Dict[str, Any]]:
+    # Blocking variant for background threads (job runner).
+    file_content, content_hash = decode_and_hash(file_content_base64)
+    key = _cache_key(content_hash, file_type)
+    result = _parse_cached(key)
+    if result is None:
+        try:
+            result = extract_in_pool_sync(file_content, file_type)
+        except Exception:
+            STAGE_ERRORS.inc(stage="extract")
+            raise
+        _record_timings(result)
+        _cache_result(key, result)
+    return content_hash, result
+
+
+async def spool_upload(chunks: AsyncIterator[bytes], max_bytes: int = MAX_UPLOAD_BYTES) -> Tuple[str, int, str]:
+    # Writes an incoming upload to a temporary file chunk by chunk, hashing it
+    # on the way, so the API process never holds the whole file in memory.
+    # Returns (path, size, sha256); the caller must delete the file.
+    digest = hashlib.sha256()
+    size = 0
+    tmp = tempfile.NamedTemporaryFile(prefix="receipt-upload-", delete=False)
+    try:
+        # Includes waiting on the client, so slow uploads show up here
+        with tmp, stage_span("spool"):
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(f"File too large: limit is {max_bytes} bytes.")
+                digest.update(chunk)
+                tmp.write(chunk)
+    except BaseException:
+        os.unlink(tmp.name)
+        raise
+    return tmp.name, size, digest.hexdigest()
+
+
+async def process_spooled_upload(file_path: str, content_hash: str, file_type: str) -> Tuple[Dict[str, Any], bool]:
+    # Only the path crosses the process boundary; the worker reads the file itself.
+    # Returns the extraction result and whether it came from the cache.
+    key = _cache_key(content_hash, file_type)
+    result = await asyncio.to_thread(_parse_cached, key)
+    if result is not None:
+        return result, True
+    result = await extract_in_pool(extract_and_parse_path, file_path, file_type)
+    _record_timings(result)
+    _cache_result(key, result)
+    return result, False
+
+
+@stage_span("validate")
+def build_receipt_data(parsed_data: dict) -> ReceiptData:
+    # Ensure all required fields for ReceiptData are present, even if None
+    # Pydantic will validate based on its schema
+    receipt_data_dict = {
+        "vendor": parsed_data.get("vendor"),
+        "transaction_date": parsed_data.get("transaction_date"),
+        "amount": parsed_data.get("amount"),
+        "category": parsed_data.get("category")
+    }
+    return ReceiptData(**receipt_data_dict)
+
+
+def to_db_receipt(validated_data: ReceiptData, content_hash: Optional[str] = None,
+                  raw_text: Optional[str] = None) -> ReceiptDB:
+    return ReceiptDB(
+        vendor=validated_data.vendor,
+        transaction_date=validated_data.transaction_date,
+        amount=validated_data.amount,
+        category=validated_data.category,
+        content_hash=content_hash,
+        raw_text=raw_text
+    )
+
+
+def find_existing_receipts(db: Session, content_hashes: Iterable[str]) -> Dict[str, ReceiptDB]:
+    hashes = set(h for h in content_hashes if h)
+    if DEDUP_MODE == "off" or not hashes:
+        return {}
+    existing = db.query(ReceiptDB).filter(ReceiptDB.content_hash.in_(hashes)).order_by(ReceiptDB.id).all()
+    found: Dict[str, ReceiptDB] = {}
+    for r in existing:
+        found.setdefault(r.content_hash, r)
+    return found
+
+
+def store_receipt(db: Session, validated_data: ReceiptData, content_hash: Optional[str],
+                  existing: Optional[Dict[str, ReceiptDB]] = None,
+                  raw_text: Optional[str] = None) -> Tuple[ReceiptDB, bool]:
+    # Adds the receipt to the session (without committing) unless deduplication
+    # finds an identical upload. Returns the row and whether it is new.
+    if existing is None:
+        existing = find_existing_receipts(db, [content_hash])
+    duplicate = existing.get(content_hash) if content_hash else None
+    if duplicate is not None:
+        if DEDUP_MODE == "reject":
+            raise DuplicateReceiptError(duplicate.id)
+        # Merge: keep the stored row and only fill fields it is missing
+        for key, value in validated_data.dict().items():
+            if getattr(duplicate, key) in (None, "", "Unknown Vendor") and value not in (None, ""):
+                setattr(duplicate, key, value)
+        if duplicate.raw_text is None:
+            duplicate.raw_text = raw_text
+        return duplicate, False
+
+    db_receipt = to_db_receipt(validated_data, content_hash, raw_text)
+    db.add(db_receipt)
+    if content_hash and DEDUP_MODE != "off":
+        # Later files in the same batch should see this one as a duplicate
+        existing[content_hash] = db_receipt
+    return db_receipt, True
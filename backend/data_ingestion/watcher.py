@@ -0,0 +1,284 @@
+import argparse
+import hashlib
+import logging
+import mimetypes
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError: # Optional: inotify/FSEvents wake-ups; without it the folder is only polled
+    Observer = None
+
+from backend.data_ingestion.pipeline import (
+    build_receipt_data, store_receipt, find_existing_receipts, extract_and_parse_path, DuplicateReceiptError,
+    MAX_WORKERS
+)
+from backend.data_parsing.rules import record_rule_match
+from backend.data_storage.database import IngestedFileDB, SessionLocal, init_db
+from backend.metrics import stage_span
+
+# Ingestion from a folder that scanners write into:
+#
+#   python -m backend.data_ingestion.watcher DIR            # watch for new files
+#   python -m backend.data_ingestion.watcher DIR --once     # backfill and exit
+#
+# Each scan lists the folder and picks up supported files (images, PDFs,
+# plain text) that are new or changed since they were last processed and
+# have not been written to for WATCH_SETTLE_SECONDS. Files are extracted and
+# parsed on a process pool, a few per worker in flight so every core stays
+# busy, and committed WATCH_BATCH_SIZE at a time: the receipts and a row per
+# file in ingested_files go into the same transaction, so after a restart
+# (or a crash) every file is either fully recorded or processed again, never
+# both. Failed files are recorded too and only retried once they change; a
+# batch whose transaction fails is logged, counted as failed and left for the
+# next scan (with --once, the exit status is then 1).
+# Run one watcher per folder.
+
+# Seconds between scans. With the optional watchdog package installed, file
+# system events trigger a scan sooner.
+WATCH_POLL_INTERVAL = float(os.getenv("RECEIPT_WATCH_POLL_INTERVAL", "5"))
+# Files changed more recently than this may still be being written.
+WATCH_SETTLE_SECONDS = float(os.getenv("RECEIPT_WATCH_SETTLE_SECONDS", "2"))
+# Files committed per transaction.
+WATCH_BATCH_SIZE = int(os.getenv("RECEIPT_WATCH_BATCH_SIZE", "100"))
+# Files in flight per pool worker.
+WATCH_QUEUE_PER_WORKER = 2
+
+DONE = "done"
+FAILED = "failed"
+
+_IGNORED_SUFFIXES = (".tmp", ".part", ".crdownload", "~") # Still being written or copied
+
+logger = logging.getLogger(__name__)
+
+FileInfo = Tuple[str, int, int, str] # path, size, mtime_ns, file type
+
+
+def supported_type(path: str) -> Optional[str]:
+    file_type = mimetypes.guess_type(path)[0]
+    if file_type and (file_type.startswith("image/") or file_type in ("application/pdf", "text/plain")):
+        return file_type
+    return None
+
+
+def _walk(directory: str, recursive: bool) -> Iterator[Tuple[str, os.stat_result]]:
+    stack = [directory]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or entry.name.endswith(_IGNORED_SUFFIXES):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        stack.append(entry.path)
+                elif entry.is_file():
+                    yield os.path.abspath(entry.path), entry.stat()
+
+
+def scan(directory: str, known: Dict[str, Tuple[int, int]], recursive: bool = True,
+         settle_seconds: float = WATCH_SETTLE_SECONDS) -> List[FileInfo]:
+    # Supported files that are new or changed and have settled, oldest first
+    cutoff = time.time_ns() - int(settle_seconds * 1e9)
+    found = []
+    for path, stat in _walk(directory, recursive):
+        if known.get(path) == (stat.st_size, stat.st_mtime_ns) or stat.st_mtime_ns > cutoff:
+            continue
+        file_type = supported_type(path)
+        if file_type is not None:
+            found.append((path, stat.st_size, stat.st_mtime_ns, file_type))
+    found.sort(key=lambda f: f[2])
+    return found
+
+
+def load_checkpoints(directory: str) -> Dict[str, Tuple[int, int]]:
+    # path -> (size, mtime_ns) of every file already processed under directory
+    prefix = os.path.join(os.path.abspath(directory), "")
+    with SessionLocal() as db:
+        rows = db.query(IngestedFileDB.path, IngestedFileDB.size, IngestedFileDB.mtime_ns) \
+                 .filter(IngestedFileDB.path.startswith(prefix, autoescape=True)).all()
+    return {path: (size, mtime_ns) for path, size, mtime_ns in rows}
+
+
+# Runs in the pool: the file is read there, only the path crosses over.
+def extract_file(path: str, file_type: str) -> Tuple[str, Dict[str, Any]]:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest(), extract_and_parse_path(path, file_type)
+
+
+def commit_batch(results: List[Tuple[FileInfo, Any]]) -> Dict[str, int]:
+    # Stores the receipts of one batch and their checkpoints in one transaction.
+    # Each outcome is (content_hash, extraction result) or the exception.
+    counts = {"ingested": 0, "failed": 0}
+    now = datetime.utcnow()
+    with SessionLocal() as db, stage_span("store"):
+        # Loads the checkpoints of changed files, so merge() below updates them
+        db.query(IngestedFileDB).filter(IngestedFileDB.path.in_([info[0] for info, _ in results])).all()
+        existing = find_existing_receipts(db, [o[0] for _, o in results if not isinstance(o, BaseException)])
+        stored = []
+        for (path, size, mtime_ns, _), outcome in results:
+            checkpoint = db.merge(IngestedFileDB(path=path, size=size, mtime_ns=mtime_ns, ingested_at=now,
+                                                 content_hash=None, receipt_id=None, error=None))
+            if isinstance(outcome, BaseException):
+                checkpoint.status, checkpoint.error = FAILED, f"Failed to process receipt: {outcome}"
+                counts["failed"] += 1
+                continue
+            content_hash, result = outcome
+            checkpoint.content_hash = content_hash
+            try:
+                validated_data = build_receipt_data(result["parsed"])
+                db_receipt, _ = store_receipt(db, validated_data, content_hash, existing,
+                                              raw_text=result["extracted_text"])
+            except (ValueError, DuplicateReceiptError) as e:
+                checkpoint.status, checkpoint.error = FAILED, str(e)
+                counts["failed"] += 1
+                continue
+            checkpoint.status = DONE
+            stored.append((checkpoint, db_receipt, result["parsed"].get("category_rule")))
+        db.flush()
+        for checkpoint, db_receipt, _ in stored:
+            checkpoint.receipt_id = db_receipt.id
+        db.commit()
+    for _, _, rule in stored:
+        record_rule_match(rule)
+    counts["ingested"] = len(stored)
+    return counts
+
+
+def ingest(files: Iterable[FileInfo], executor: ProcessPoolExecutor, workers: int,
+           known: Dict[str, Tuple[int, int]], batch_size: int = WATCH_BATCH_SIZE,
+           stop: Optional[threading.Event] = None) -> Dict[str, Any]:
+    # Processes files with at most WATCH_QUEUE_PER_WORKER per worker in
+    # flight, committing in completion order every batch_size files. After
+    # stop is set no new files are started; those in flight are committed.
+    stats = {"files": 0, "ingested": 0, "failed": 0, "failed_batches": 0, "seconds": 0.0}
+    started = time.perf_counter()
+    remaining = iter(files)
+    in_flight: Dict[Future, FileInfo] = {}
+    finished: List[Tuple[FileInfo, Any]] = []
+
+    def flush():
+        stats["files"] += len(finished)
+        try:
+            counts = commit_batch(finished)
+        except Exception:
+            # The batch is rolled back and its files stay unrecorded, so the
+            # next scan picks them up again
+            logger.exception("Error storing a batch of %d files", len(finished))
+            stats["failed"] += len(finished)
+            stats["failed_batches"] += 1
+            finished.clear()
+            return
+        for info, _ in finished:
+            known[info[0]] = (info[1], info[2])
+        stats["ingested"] += counts["ingested"]
+        stats["failed"] += counts["failed"]
+        stats["seconds"] = time.perf_counter() - started
+        logger.info("%d files: %d receipts stored, %d failed (%.1f files/s)", stats["files"], stats["ingested"],
+                    stats["failed"], stats["files"] / stats["seconds"] if stats["seconds"] else 0.0)
+        finished.clear()
+
+    while True:
+        while len(in_flight) < workers * WATCH_QUEUE_PER_WORKER and not (stop is not None and stop.is_set()):
+            info = next(remaining, None)
+            if info is None:
+                break
+            in_flight[executor.submit(extract_file, info[0], info[3])] = info
+        if not in_flight:
+            break
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            info = in_flight.pop(future)
+            try:
+                finished.append((info, future.result()))
+            except Exception as e:
+                finished.append((info, e))
+        if len(finished) >= batch_size:
+            flush()
+    if finished:
+        flush()
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+
+def _start_observer(directory: str, recursive: bool, wake_up: threading.Event):
+    # File system events only shorten the wait; the scan decides what is new
+    if Observer is None:
+        return None
+    handler = FileSystemEventHandler()
+    handler.on_any_event = lambda event: wake_up.set()
+    observer = Observer()
+    observer.schedule(handler, directory, recursive=recursive)
+    observer.start()
+    return observer
+
+
+def watch(directory: str, workers: int = MAX_WORKERS, once: bool = False, recursive: bool = True,
+          interval: float = WATCH_POLL_INTERVAL, batch_size: int = WATCH_BATCH_SIZE,
+          stop: Optional[threading.Event] = None) -> Dict[str, Any]:
+    # Scans directory until stop is set, or once (a backfill: files are taken
+    # as they are, without waiting for them to settle). Returns the totals.
+    stop = stop or threading.Event()
+    totals = {"files": 0, "ingested": 0, "failed": 0, "failed_batches": 0, "seconds": 0.0}
+    known = load_checkpoints(directory)
+    wake_up = threading.Event()
+    observer = None if once else _start_observer(directory, recursive, wake_up)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while not stop.is_set():
+                files = scan(directory, known, recursive, settle_seconds=0 if once else WATCH_SETTLE_SECONDS)
+                if files:
+                    stats = ingest(files, executor, workers, known, batch_size, stop)
+                    for key in totals:
+                        totals[key] += stats[key]
+                if once:
+                    break
+                wake_up.wait(interval)
+                wake_up.clear()
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()
+    return totals
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Ingest receipts dropped into a folder.")
+    parser.add_argument("directory")
+    parser.add_argument("--once", action="store_true", help="process what is there now and exit (backfill)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help="extraction processes (default: RECEIPT_WORKERS, one per CPU core)")
+    parser.add_argument("--batch-size", type=int, default=WATCH_BATCH_SIZE, help="files per transaction")
+    parser.add_argument("--interval", type=float, default=WATCH_POLL_INTERVAL, help="seconds between scans")
+    parser.add_argument("--no-recursive", action="store_true", help="ignore subdirectories")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.directory):
+        parser.error(f"not a directory: {args.directory}")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    init_db() # Creates or migrates the schema, like starting the API would
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        # Finish and commit the files in flight, then exit
+        signal.signal(signum, lambda *_: stop.set())
+    totals = watch(args.directory, args.workers, args.once, not args.no_recursive, args.interval, args.batch_size, stop)
+    print(f"{args.directory}: {totals['ingested']} receipts stored, {totals['failed']} files failed "
+          f"of {totals['files']} in {totals['seconds']:.2f}s")
+    if totals["failed_batches"]:
+        print(f"{totals['failed_batches']} batches could not be stored; see the log", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,89 +1,128 @@
 import re
 from datetime import datetime
+from typing import Iterable, List
 
-def parse_receipt_data(text: str) -> dict:
-    vendor = "Unknown Vendor"
-    transaction_date = None
-    amount = 0.0
-    category = None
-
-    # Example: Simple regex for vendor (very basic, needs refinement)
-    vendor_patterns = [
-        r"(?:Vendor|Store|Shop):\s*([A-Za-z0-9\s]+)",
-        r"([A-Za-z\s]+)(?:\s+Supermarket|\s+Groceries|\s+Store)",
-        r"Invoice from\s*([A-Za-z0-9\s]+)"
-    ]
-    for pattern in vendor_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            vendor = match.group(1).strip()
-            break
-
-    # Example: Date parsing (flexible patterns)
-    date_patterns = [
-        r"\d{1,2}/\d{1,2}/\d{2,4}",  # DD/MM/YYYY or DD/MM/YY
-        r"\d{1,2}-\d{1,2}-\d{2,4}",  # DD-MM-YYYY or DD-MM-YY
-        r"\d{4}-\d{2}-\d{2}",        # YYYY-MM-DD
-        r"(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{1,2},\s+\d{4}" # Month Day, Year
-    ]
-    for pattern in date_patterns:
-        match = re.search(pattern, text)
+from backend.data_parsing.rules import get_rule_table
+
+# All patterns are compiled once at import time. The order inside each list is
+# the priority order: the first pattern that matches wins.
+
+# Example: Simple regex for vendor (very basic, needs refinement)
+_VENDOR_LABEL = re.compile(r"(?:Vendor|Store|Shop):\s*([A-Za-z0-9\s]+)", re.IGNORECASE)
+_VENDOR_INVOICE = re.compile(r"Invoice from\s*([A-Za-z0-9\s]+)", re.IGNORECASE)
+# The second vendor rule is r"([A-Za-z\s]+)(?:\s+Supermarket|\s+Groceries|\s+Store)".
+# Run as a plain regex it backtracks quadratically on long texts without a
+# match, so it is evaluated in linear time from these two pieces instead.
+_VENDOR_SEGMENT = re.compile(r"[A-Za-z\s]+", re.IGNORECASE)
+_VENDOR_SUFFIX = re.compile(r"\s(?:Supermarket|Groceries|Store)", re.IGNORECASE)
+
+# Example: Date parsing (flexible patterns)
+DATE_PATTERNS = [
+    re.compile(r"\d{1,2}/\d{1,2}/\d{2,4}"),  # DD/MM/YYYY or DD/MM/YY
+    re.compile(r"\d{1,2}-\d{1,2}-\d{2,4}"),  # DD-MM-YYYY or DD-MM-YY
+    re.compile(r"\d{4}-\d{2}-\d{2}"),        # YYYY-MM-DD
+    re.compile(r"(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{1,2},\s+\d{4}") # Month Day, Year
+]
+_ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+_DASHED_DATE = re.compile(r"\d{1,2}-\d{1,2}-\d{2,4}")
+_MONTH_NAME = re.compile(r"(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)", re.IGNORECASE)
+
+# Example: Amount parsing (look for "Total", "Amount Due", etc.)
+AMOUNT_PATTERNS = [
+    re.compile(r"(?:Total|Amount Due|Balance|Sum):\s*[$€£]?\s*(\d+(?:[.,]\d{2})?)", re.IGNORECASE),
+    re.compile(r"[$€£]?\s*(\d+(?:[.,]\d{2}?))\s*(?:Total|Amount Due|Balance|Sum)", re.IGNORECASE),
+    re.compile(r"(\d+(?:[.,]\d{2}?))\s*(?:USD|EUR|GBP)", re.IGNORECASE)
+]
+
+def _vendor_before_suffix(text: str):
+    # Equivalent of re.search(r"([A-Za-z\s]+)(?:\s+Supermarket|...)").group(1):
+    # the match starts at the first letter/space run containing a suffix that
+    # is not at the very start of the run, and extends to the run's last suffix.
+    segment_start = segment_end = -1
+    vendor_end = None
+    for suffix in _VENDOR_SUFFIX.finditer(text):
+        position = suffix.start()
+        if position >= segment_end:
+            if vendor_end is not None:
+                break
+            segment_start = position
+            while segment_start > 0 and _VENDOR_SEGMENT.match(text, segment_start - 1, segment_start):
+                segment_start -= 1
+            segment_end = _VENDOR_SEGMENT.match(text, segment_start).end()
+        if position > segment_start:
+            vendor_end = position
+    if vendor_end is None:
+        return None
+    return text[segment_start:vendor_end]
+
+
+def _parse_vendor(text: str) -> str:
+    match = _VENDOR_LABEL.search(text)
+    if match:
+        return match.group(1).strip()
+    vendor = _vendor_before_suffix(text)
+    if vendor is not None:
+        return vendor.strip()
+    match = _VENDOR_INVOICE.search(text)
+    if match:
+        return match.group(1).strip()
+    return "Unknown Vendor"
+
+
+def _parse_date(text: str):
+    for pattern in DATE_PATTERNS:
+        match = pattern.search(text)
         if match:
             try:
                 date_str = match.group(0)
                 if '/' in date_str:
-                    transaction_date = datetime.strptime(date_str, '%d/%m/%Y').date()
-                elif re.match(r"\d{4}-\d{2}-\d{2}", date_str):
-                    transaction_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                elif re.match(r"\d{1,2}-\d{1,2}-\d{2,4}", date_str):
+                    return datetime.strptime(date_str, '%d/%m/%Y').date()
+                elif _ISO_DATE.match(date_str):
+                    return datetime.strptime(date_str, '%Y-%m-%d').date()
+                elif _DASHED_DATE.match(date_str):
                     # Try a few common formats for DD-MM-YY/YYYY
                     try:
-                        transaction_date = datetime.strptime(date_str, '%d-%m-%Y').date()
+                        return datetime.strptime(date_str, '%d-%m-%Y').date()
                     except ValueError:
-                        transaction_date = datetime.strptime(date_str, '%d-%m-%y').date()
-                elif re.match(r"(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)", date_str, re.IGNORECASE):
+                        return datetime.strptime(date_str, '%d-%m-%y').date()
+                elif _MONTH_NAME.match(date_str):
                     # Attempt different year formats for "Month Day, Year"
                     try:
-                        transaction_date = datetime.strptime(date_str, '%b %d, %Y').date()
+                        return datetime.strptime(date_str, '%b %d, %Y').date()
                     except ValueError:
-                        transaction_date = datetime.strptime(date_str, '%B %d, %Y').date()
-                break
+                        return datetime.strptime(date_str, '%B %d, %Y').date()
             except ValueError:
                 continue
+    return None
 
-    # Example: Amount parsing (look for "Total", "Amount Due", etc.)
-    amount_patterns = [
-        r"(?:Total|Amount Due|Balance|Sum):\s*[$€£]?\s*(\d+(?:[.,]\d{2})?)",
-        r"[$€£]?\s*(\d+(?:[.,]\d{2}?))\s*(?:Total|Amount Due|Balance|Sum)",
-        r"(\d+(?:[.,]\d{2}?))\s*(?:USD|EUR|GBP)"
-    ]
-    for pattern in amount_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
+
+def _parse_amount(text: str) -> float:
+    for pattern in AMOUNT_PATTERNS:
+        match = pattern.search(text)
         if match:
             try:
-                amount = float(match.group(1).replace(',', '.')) # Handle comma as decimal
-                break
+                return float(match.group(1).replace(',', '.')) # Handle comma as decimal
             except ValueError:
                 continue
-
-    # Optional: Basic category mapping
-    if "grocery" in text.lower() or "supermarket" in text.lower() or "food" in text.lower():
-        category = "Groceries"
-    elif "electricity" in text.lower() or "power bill" in text.lower():
-        category = "Utilities (Electricity)"
-    elif "internet" in text.lower() or "broadband" in text.lower():
-        category = "Utilities (Internet)"
-    elif "water" in text.lower() or "utility" in text.lower():
-        category = "Utilities (Water)"
-    elif "restaurant" in text.lower() or "cafe" in text.lower():
-        category = "Dining"
-    elif "transport" in text.lower() or "fuel" in text.lower() or "petrol" in text.lower():
-        category = "Transportation"
+    return 0.0
 
 
+def parse_receipt_data(text: str) -> dict:
+    vendor = _parse_vendor(text)
+    # Category rules come from the (hot-reloaded) rule table; the text is
+    # lowercased once for all keyword rules.
+    category, category_rule = get_rule_table().match(text.lower(), vendor)
     return {
         "vendor": vendor,
-        "transaction_date": transaction_date,
-        "amount": amount,
-        "category": category
-    }
\ No newline at end of file
+        "transaction_date": _parse_date(text),
+        "amount": _parse_amount(text),
+        "category": category,
+        "category_rule": category_rule # Id of the rule that set the category, if any
+    }
+
+
+def parse_many(texts: Iterable[str]) -> List[dict]:
+    # Batch API for callers that already hold many extracted texts (bulk
+    # ingestion, benchmarks); avoids per-call attribute lookups in hot loops.
+    parse = parse_receipt_data
+    return [parse(text) for text in texts]
@@ -0,0 +1,179 @@
+import os
+import re
+import json
+import logging
+import time
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+# Category rules are read from a JSON file (see rules.json next to this module):
+#   "vendors":    exact vendor name -> category, checked first
+#   "categories": [{"category": ..., "keywords": [...]}, ...] in priority order;
+#                 the first category with any keyword in the text wins
+RULES_PATH = os.getenv("RECEIPT_RULES_PATH", os.path.join(os.path.dirname(__file__), "rules.json"))
+# How often (seconds) the rules file is checked for changes.
+RULES_RELOAD_INTERVAL = float(os.getenv("RECEIPT_RULES_RELOAD_SECONDS", "2"))
+
+logger = logging.getLogger(__name__)
+
+
+def _trie_pattern(keywords: List[str]) -> str:
+    # Builds a regex from a character trie, e.g. ["water", "wifi"] becomes
+    # "w(?:ater|ifi)". Unlike a flat "a|b|c" alternation, the cost per text
+    # position grows with keyword length rather than with the number of rules.
+    # Optional groups are greedy, so the longest keyword at a position wins.
+    trie: Dict[str, Any] = {}
+    for keyword in keywords:
+        node = trie
+        for ch in keyword:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def build(node: Dict[str, Any]) -> str:
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch != ""]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return "(?:" + body + ")?" if "" in node else body
+
+    return build(trie)
+
+
+class RuleTable:
+    def __init__(self, data: Dict[str, Any], source: Optional[str] = None):
+        self.source = source
+        self.loaded_at = time.time()
+        self.vendor_rules: Dict[str, str] = {
+            self.normalize_vendor(vendor): category for vendor, category in (data.get("vendors") or {}).items()
+        }
+        self._max_vendor_words = max((len(v.split(" ")) for v in self.vendor_rules), default=0)
+        self.categories: List[str] = []
+        keyword_rules: Dict[str, int] = {}
+        for priority, rule in enumerate(data.get("categories") or []):
+            self.categories.append(rule["category"])
+            for keyword in rule.get("keywords", []):
+                keyword_rules.setdefault(keyword.lower(), priority)
+        self.keyword_rules = keyword_rules
+
+        # The matcher only reports the longest keyword at each position, so for
+        # every keyword precompute the best rule among keywords that are a prefix
+        # of it (those match at the same position too).
+        self._best_rule: Dict[str, Tuple[int, str]] = {}
+        for keyword in keyword_rules:
+            self._best_rule[keyword] = min(
+                (keyword_rules[keyword[:i]], keyword[:i])
+                for i in range(1, len(keyword) + 1) if keyword[:i] in keyword_rules
+            )
+        self._matcher = re.compile(_trie_pattern(list(keyword_rules))) if keyword_rules else None
+
+    @staticmethod
+    def normalize_vendor(vendor: str) -> str:
+        return " ".join(vendor.lower().split())
+
+    @classmethod
+    def from_file(cls, path: str) -> "RuleTable":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f), source=path)
+
+    def match(self, lowered_text: str, vendor: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
+        # Returns (category, rule id); rule ids are "vendor:<name>" or "keyword:<keyword>".
+        if vendor and self.vendor_rules:
+            # Longest word prefix wins, since the parsed vendor often carries
+            # trailing words (e.g. "Acme Fuels Date" still hits "acme fuels").
+            words = self.normalize_vendor(vendor).split(" ")
+            for end in range(min(len(words), self._max_vendor_words), 0, -1):
+                name = " ".join(words[:end])
+                category = self.vendor_rules.get(name)
+                if category is not None:
+                    return category, f"vendor:{name}"
+        if self._matcher is None:
+            return None, None
+
+        best: Optional[Tuple[int, str]] = None
+        position = 0
+        search = self._matcher.search
+        while True:
+            match = search(lowered_text, position)
+            if match is None:
+                break
+            candidate = self._best_rule[match.group(0)]
+            if best is None or candidate < best:
+                best = candidate
+                if best[0] == 0:
+                    break
+            # Restart one character later so overlapping keywords are not skipped
+            position = match.start() + 1
+        if best is None:
+            return None, None
+        return self.categories[best[0]], f"keyword:{best[1]}"
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "source": self.source,
+            "loaded_at": self.loaded_at,
+            "vendor_rules": len(self.vendor_rules),
+            "keyword_rules": len(self.keyword_rules),
+            "categories": list(self.categories)
+        }
+
+
+_table: Optional[RuleTable] = None
+_table_mtime: Optional[float] = None
+_last_check = 0.0
+_lock = threading.Lock()
+_match_counts: Counter = Counter()
+_parse_count = 0
+
+
+def reload_rules(force: bool = False) -> RuleTable:
+    # Recompiles the table if the rules file changed. A broken file keeps the
+    # previous table in place so a bad edit never takes parsing down.
+    global _table, _table_mtime, _last_check
+    with _lock:
+        _last_check = time.monotonic()
+        try:
+            mtime = os.path.getmtime(RULES_PATH)
+        except OSError as e:
+            if _table is None or force:
+                raise
+            logger.warning("Could not stat rules file %s: %s", RULES_PATH, e)
+            return _table
+        if _table is not None and not force and mtime == _table_mtime:
+            return _table
+        try:
+            _table = RuleTable.from_file(RULES_PATH)
+            _table_mtime = mtime
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            if _table is None or force:
+                raise
+            _table_mtime = mtime # Don't retry (and log) until the file changes again
+            logger.error("Failed to reload rules from %s: %s", RULES_PATH, e)
+        return _table
+
+
+def get_rule_table() -> RuleTable:
+    table = _table
+    if table is None or time.monotonic() - _last_check >= RULES_RELOAD_INTERVAL:
+        table = reload_rules()
+    return table
+
+
+def record_rule_match(rule_id: Optional[str]):
+    # Parsing usually happens in worker processes, so callers record matches
+    # here in the API process when the parsed result comes back.
+    global _parse_count
+    with _lock:
+        _parse_count += 1
+        if rule_id:
+            _match_counts[rule_id] += 1
+
+
+def rule_stats() -> Dict[str, Any]:
+    with _lock:
+        unmatched = _parse_count - sum(_match_counts.values())
+        return {
+            "parsed": _parse_count,
+            "unmatched": unmatched,
+            "rules": dict(_match_counts.most_common())
+        }
@@ -0,0 +1,443 @@
+import bisect
+import logging
+import os
+import threading
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from backend.data_storage.database import ReceiptDB, engine, to_minor_units
+from backend.data_storage.summary import data_version
+
+logger = logging.getLogger(__name__)
+
+# In-memory copy of the receipt columns the dashboard filters, sorts and
+# aggregates on, held as NumPy arrays in id order:
+#   id                  int64
+#   date                int64 days since 1970-01-01
+#   cents               int64 amount in minor units (exact sums, like amount_cents)
+#   vendor, category    int32 codes into a dictionary of the distinct values
+# That is 32 bytes per receipt plus the dictionaries, where a loaded ReceiptDB
+# object takes well over a kilobyte. Range filters, sorts and group-bys are
+# then array operations instead of a SQL query that builds a Python object per
+# row. Text search needs raw_text and the FTS5 index, so it stays in SQL.
+#
+# The store remembers the data version (see summary.data_version) it was
+# loaded at and is only used while that is still current. Receipts written
+# through an ORM session of this process are applied to it when the session
+# commits; any other write (a bulk import, another uvicorn worker, the
+# watcher) makes it stale, and it is reloaded in the background while
+# queries go to SQL. RECEIPT_COLUMN_STORE=1 enables it; it is loaded when
+# the API starts.
+COLUMN_STORE = int(os.getenv("RECEIPT_COLUMN_STORE", "0"))
+
+# NULL dates and amounts; below every real value, and safe to negate
+NULL_VALUE = -(2 ** 62)
+_EPOCH = date(1970, 1, 1)
+_EPOCH_ORDINAL = _EPOCH.toordinal()
+_LOAD_BATCH = 65536
+_COLUMNS = {"id": np.int64, "date": np.int64, "cents": np.int64, "vendor": np.int32, "category": np.int32}
+# Session.info keys for changes flushed but not yet committed
+_FLUSHED = "column_store_flushed"
+_PENDING = "column_store_pending"
+
+
+def to_days(value: Optional[date]) -> int:
+    return NULL_VALUE if value is None else value.toordinal() - _EPOCH_ORDINAL
+
+
+def from_days(days: int) -> Optional[date]:
+    return None if days == NULL_VALUE else _EPOCH + timedelta(days=int(days))
+
+
+class Dictionary:
+    # Distinct values of a text column; code 0 is NULL. Codes are assigned
+    # in arrival order, so sorting goes through ranks().
+
+    def __init__(self):
+        self.values: List[Optional[str]] = [None]
+        self.codes: Dict[Optional[str], int] = {None: 0}
+        self._sorted: Optional[List[str]] = None
+        self._ranks: Optional[np.ndarray] = None
+
+    def code(self, value: Optional[str]) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+            self._sorted = self._ranks = None
+        return code
+
+    def ranks(self) -> np.ndarray:
+        # Sort position of each code, NULL (0) before every value like the
+        # SQL ordering puts it. Python and SQLite both compare by code point.
+        if self._ranks is None:
+            order = sorted(range(1, len(self.values)), key=self.values.__getitem__)
+            self._sorted = [self.values[code] for code in order]
+            ranks = np.zeros(len(self.values), dtype=np.int64)
+            ranks[order] = np.arange(1, len(self.values))
+            self._ranks = ranks
+        return self._ranks
+
+    def rank_of(self, value: Optional[str]) -> float:
+        # Rank of any value, halfway between neighbours if it is not stored
+        if value is None:
+            return 0
+        ranks = self.ranks()
+        code = self.codes.get(value)
+        if code is not None:
+            return int(ranks[code])
+        return bisect.bisect_left(self._sorted, value) + 0.5
+
+    def matching(self, value: str) -> List[int]:
+        # Codes equal to value ignoring case (category_lower == lower(value))
+        value = value.lower()
+        return [code for code, stored in enumerate(self.values) if stored is not None and stored.lower() == value]
+
+
+def _first(keys: np.ndarray, count: int) -> np.ndarray:
+    # Indexes of the count smallest keys, in order, ties in index order: a
+    # stable argsort cut to count without sorting everything
+    if count >= len(keys):
+        return np.argsort(keys, kind="stable")
+    kth = np.partition(keys, count - 1)[count - 1]
+    below = np.flatnonzero(keys < kth)
+    chosen = np.concatenate([below, np.flatnonzero(keys == kth)[:count - len(below)]])
+    return chosen[np.argsort(keys[chosen], kind="stable")]
+
+
+class ColumnStore:
+
+    def __init__(self):
+        self.version: Optional[int] = None # Data version the arrays reflect; None until loaded
+        self.vendors = Dictionary()
+        self.categories = Dictionary()
+        self._columns = {name: np.empty(0, dtype) for name, dtype in _COLUMNS.items()}
+        self._size = 0
+        self._lock = threading.RLock()
+        self._loading = False
+
+    def __len__(self) -> int:
+        return self._size
+
+    def nbytes(self) -> int:
+        # Bytes held by the rows in use (the arrays keep spare room for appends)
+        return self._size * sum(np.dtype(dtype).itemsize for dtype in _COLUMNS.values())
+
+    def _encode(self, rows: List[tuple], vendors: Dictionary, categories: Dictionary) -> Dict[str, np.ndarray]:
+        # rows are (id, vendor, transaction_date, amount_cents, category) tuples
+        count = len(rows)
+        return {
+            "id": np.fromiter((r[0] for r in rows), np.int64, count),
+            "vendor": np.fromiter((vendors.code(r[1]) for r in rows), np.int32, count),
+            "date": np.fromiter((to_days(r[2]) for r in rows), np.int64, count),
+            "cents": np.fromiter((NULL_VALUE if r[3] is None else r[3] for r in rows), np.int64, count),
+            "category": np.fromiter((categories.code(r[4]) for r in rows), np.int32, count),
+        }
+
+    def load(self, bind=None):
+        # Reads every receipt. The data version is read first, so a write that
+        # lands during the load can only make the store look older than it is.
+        bind = bind or engine
+        vendors, categories = Dictionary(), Dictionary()
+        parts = []
+        with bind.connect() as conn:
+            version = data_version(conn)
+            result = conn.execution_options(yield_per=_LOAD_BATCH).execute(
+                select(ReceiptDB.id, ReceiptDB.vendor, ReceiptDB.transaction_date, ReceiptDB.amount_cents,
+                       ReceiptDB.category).order_by(ReceiptDB.id)
+            )
+            for rows in result.partitions():
+                parts.append(self._encode(rows, vendors, categories))
+        columns = {name: np.concatenate([part[name] for part in parts]) if parts else np.empty(0, dtype)
+                   for name, dtype in _COLUMNS.items()}
+        with self._lock:
+            self._columns, self._size = columns, len(columns["id"])
+            self.vendors, self.categories = vendors, categories
+            self.version = version
+        logger.info("Column store loaded %d receipts (%.1f MB) at data version %d",
+                    self._size, self.nbytes() / 1e6, version)
+
+    def _reload(self):
+        try:
+            self.load()
+        except Exception:
+            logger.exception("Error loading the column store")
+        finally:
+            self._loading = False
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._loading:
+                return
+            self._loading = True
+        threading.Thread(target=self._reload, name="receipt-column-store", daemon=True).start()
+
+    def apply(self, first_version: int, last_version: int, changes: Dict[int, Optional[tuple]]):
+        # Applies a committed transaction that took the data version from
+        # first_version - 1 to last_version. changes maps receipt ids to
+        # (vendor, transaction_date, amount_cents, category), or None when
+        # deleted. Writing a row again is harmless, so a load that already
+        # saw some of these rows does not matter.
+        with self._lock:
+            if self.version is None or self.version != first_version - 1:
+                return # Missed another write; the next query reloads
+            ids = self._columns["id"][:self._size]
+            positions = np.searchsorted(ids, list(changes))
+            found = {receipt_id: int(position) for receipt_id, position in zip(changes, positions)
+                     if position < self._size and ids[position] == receipt_id}
+            updated = [(found[i], values) for i, values in changes.items() if i in found and values is not None]
+            deleted = [found[i] for i, values in changes.items() if i in found and values is None]
+            added = sorted((i, values) for i, values in changes.items() if i not in found and values is not None)
+            if added and self._size and added[0][0] < ids[-1]:
+                # Only new ids above the current ones keep the arrays in order
+                self.version = -1
+                return
+            if updated:
+                encoded = self._encode([(0,) + values for _, values in updated], self.vendors, self.categories)
+                rows = [position for position, _ in updated]
+                for name in ("vendor", "date", "cents", "category"):
+                    self._columns[name][rows] = encoded[name]
+            if deleted:
+                self._columns = {name: np.delete(column[:self._size], deleted)
+                                 for name, column in self._columns.items()}
+                self._size -= len(deleted)
+            if added:
+                self._append(self._encode([(i,) + values for i, values in added], self.vendors, self.categories))
+            self.version = last_version
+
+    def _append(self, encoded: Dict[str, np.ndarray]):
+        # Arrays grow by doubling, so appending one receipt is not a copy of all of them
+        needed = self._size + len(encoded["id"])
+        if needed > len(self._columns["id"]):
+            capacity = max(needed, 2 * len(self._columns["id"]), 1024)
+            for name, column in self._columns.items():
+                grown = np.empty(capacity, column.dtype)
+                grown[:self._size] = column[:self._size]
+                self._columns[name] = grown
+        for name, values in encoded.items():
+            self._columns[name][self._size:needed] = values
+        self._size = needed
+
+    def _column(self, name: str) -> np.ndarray:
+        return self._columns[name][:self._size]
+
+    def _filter(self, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                min_amount: Optional[float] = None, max_amount: Optional[float] = None,
+                category: Optional[str] = None) -> np.ndarray:
+        # Positions matching the filters, in id order; the same tests as
+        # query.filter_conditions, where a NULL never matches a bound
+        mask = np.ones(self._size, dtype=bool)
+        if start_date:
+            mask &= self._column("date") >= to_days(start_date)
+        if end_date:
+            dates = self._column("date")
+            mask &= (dates <= to_days(end_date)) & (dates != NULL_VALUE)
+        if min_amount:
+            mask &= self._column("cents") >= to_minor_units(min_amount)
+        if max_amount:
+            cents = self._column("cents")
+            mask &= (cents <= to_minor_units(max_amount)) & (cents != NULL_VALUE)
+        if category:
+            mask &= np.isin(self._column("category"), self.categories.matching(category))
+        return np.flatnonzero(mask)
+
+    def _sort_keys(self, sort_by: str) -> np.ndarray:
+        if sort_by == "vendor":
+            return self.vendors.ranks()[self._column("vendor")]
+        if sort_by == "category":
+            return self.categories.ranks()[self._column("category")]
+        return self._column({"id": "id", "date": "date", "amount": "cents"}[sort_by])
+
+    def _key_of(self, sort_by: str, value: Any) -> float:
+        # A cursor's sort value on the scale of _sort_keys
+        if sort_by == "vendor":
+            return self.vendors.rank_of(value)
+        if sort_by == "category":
+            return self.categories.rank_of(value)
+        if sort_by == "date":
+            return to_days(value)
+        return NULL_VALUE if value is None else value
+
+    def _value(self, name: str, position: int) -> Any:
+        # A field as the SQL query returns it
+        if name == "vendor":
+            return self.vendors.values[self._columns["vendor"][position]]
+        if name == "category":
+            return self.categories.values[self._columns["category"][position]]
+        if name == "transaction_date":
+            return from_days(self._columns["date"][position])
+        if name in ("amount", "amount_cents"):
+            cents = int(self._columns["cents"][position])
+            return None if cents == NULL_VALUE else (cents if name == "amount_cents" else cents / 100.0)
+        return int(self._columns["id"][position])
+
+    def _select(self, sort_by: Optional[str], sort_order: str, after: Optional[Tuple[Any, int]],
+                limit: Optional[int], filters: Dict[str, Any]) -> np.ndarray:
+        # Positions in (sort key, id) order with NULLs first ascending, or the
+        # exact reverse descending (see pagination.order_by_clauses), starting
+        # after the cursor's (sort value, id)
+        sort_by = sort_by or "id"
+        positions = self._filter(**filters)
+        keys = self._sort_keys(sort_by)[positions]
+        descending = sort_order == "desc"
+        if after is not None:
+            value, last_id = after
+            ids = self._column("id")[positions]
+            if sort_by == "id":
+                keep = ids < last_id if descending else ids > last_id
+            else:
+                key = self._key_of(sort_by, value)
+                if descending:
+                    keep = (keys < key) | ((keys == key) & (ids < last_id))
+                else:
+                    keep = (keys > key) | ((keys == key) & (ids > last_id))
+            positions, keys = positions[keep], keys[keep]
+        if descending:
+            positions, keys = positions[::-1], -keys[::-1]
+        if sort_by == "id":
+            return positions[:limit] if limit else positions
+        return positions[_first(keys, limit or len(keys))]
+
+    def page(self, field_names: List[str], sort_by: Optional[str] = None, sort_order: str = "asc",
+             after: Optional[Tuple[Any, int]] = None, limit: Optional[int] = None,
+             **filters) -> Tuple[List[dict], Optional[Tuple[Any, int]]]:
+        # Rows of one page and, when more follow, the (sort value, id) of its
+        # last row for the next cursor
+        sort_field = {"amount": "amount_cents", "date": "transaction_date"}.get(sort_by or "id", sort_by or "id")
+        with self._lock:
+            positions = self._select(sort_by, sort_order, after, limit + 1 if limit else None, filters)
+            last = None
+            if limit and len(positions) > limit:
+                positions = positions[:limit]
+                last = (self._value(sort_field, positions[-1]), self._value("id", positions[-1]))
+            rows = [{name: self._value(name, position) for name in field_names} for position in positions]
+        return rows, last
+
+    def ids(self, sort_by: Optional[str] = None, sort_order: str = "asc", limit: Optional[int] = None,
+            **filters) -> List[int]:
+        with self._lock:
+            return self._column("id")[self._select(sort_by, sort_order, None, limit, filters)].tolist()
+
+    def _median_and_mode(self, cents: np.ndarray) -> Tuple[float, List[float]]:
+        cents = cents[cents != NULL_VALUE]
+        if not len(cents):
+            return 0.0, []
+        values, counts = np.unique(cents, return_counts=True)
+        # np.median averages the two middle values, like exact_median
+        return float(np.median(cents)) / 100, [int(c) / 100 for c in values[counts == counts.max()]]
+
+    def median_and_mode(self) -> Tuple[float, List[float]]:
+        with self._lock:
+            return self._median_and_mode(self._column("cents"))
+
+    def aggregates(self, **filters) -> Optional[Dict[str, Any]]:
+        # Same result as aggregate.calculate_filtered_aggregates; None when
+        # nothing matches
+        with self._lock:
+            positions = self._filter(**filters)
+            if not len(positions):
+                return None
+            cents = self._column("cents")[positions]
+            has_amount = cents != NULL_VALUE
+            amount_count = int(np.count_nonzero(has_amount))
+            amounts = np.where(has_amount, cents, 0)
+            total_spend = int(amounts.sum()) / 100.0
+            median_spend, mode_spend = self._median_and_mode(cents)
+
+            # Vendors by count, then name
+            vendor_counts = np.bincount(self._column("vendor")[positions], minlength=len(self.vendors.values))
+            codes = np.flatnonzero(vendor_counts)
+            codes = codes[np.lexsort((self.vendors.ranks()[codes], -vendor_counts[codes]))]
+            vendor_frequency = {self.vendors.values[code]: int(vendor_counts[code]) for code in codes}
+
+            # Months since 1970-01 of the dated receipts
+            dates = self._column("date")[positions]
+            dated = dates != NULL_VALUE
+            months = dates[dated].astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+            monthly_spend_trend = {}
+            if len(months):
+                first = months.min()
+                counts = np.bincount(months - first)
+                totals = np.bincount(months - first, weights=amounts[dated])
+                monthly_spend_trend = {str(np.datetime64(int(first + i), "M")): int(totals[i]) / 100.0
+                                       for i in np.flatnonzero(counts)}
+        return {
+            "total_spend": total_spend,
+            "mean_spend": total_spend / amount_count if amount_count else 0.0,
+            "median_spend": median_spend,
+            "mode_spend": mode_spend,
+            "vendor_frequency": vendor_frequency,
+            "monthly_spend_trend": monthly_spend_trend
+        }
+
+
+store = ColumnStore()
+
+
+def current_store(db) -> Optional[ColumnStore]:
+    # The store if it reflects the latest write, else None (and a reload is
+    # started, so a later query finds it current)
+    if not COLUMN_STORE:
+        return None
+    if store.version is not None and store.version == data_version(db):
+        return store
+    store.refresh_in_background()
+    return None
+
+
+def start_column_store():
+    # Loads in the background; queries use SQL until it is ready
+    if COLUMN_STORE:
+        store.refresh_in_background()
+
+
+# Keeping the store current with this process's own writes. Each flush that
+# writes receipts also increments the data version (see summary.py), so the
+# versions read after the flushes tell whether the store was current when
+# the transaction began. Rows are collected on flush and applied on commit.
+
+@event.listens_for(Session, "after_flush")
+def _collect_changes(session: Session, flush_context):
+    if store.version is None:
+        return # Not loaded (or disabled)
+    changes = {}
+    for obj in session.new:
+        if isinstance(obj, ReceiptDB):
+            changes[obj.id] = (obj.vendor, obj.transaction_date, obj.amount_cents, obj.category)
+    for obj in session.dirty:
+        if isinstance(obj, ReceiptDB) and session.is_modified(obj):
+            changes[obj.id] = (obj.vendor, obj.transaction_date, obj.amount_cents, obj.category)
+    for obj in session.deleted:
+        if isinstance(obj, ReceiptDB):
+            changes[obj.id] = None
+    if changes:
+        session.info[_FLUSHED] = changes
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _record_version(session: Session, flush_context):
+    # After every after_flush listener, so the summary update has run
+    changes = session.info.pop(_FLUSHED, None)
+    if changes is None:
+        return
+    version = data_version(session.connection())
+    pending = session.info.setdefault(_PENDING, {"first": version, "changes": {}})
+    pending["last"] = version
+    pending["changes"].update(changes)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_changes(session: Session):
+    pending = session.info.pop(_PENDING, None)
+    if pending is not None:
+        store.apply(pending["first"], pending["last"], pending["changes"])
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session: Session):
+    session.info.pop(_FLUSHED, None)
+    session.info.pop(_PENDING, None)
@@ -0,0 +1,279 @@
+import argparse
+import io
+import logging
+import os
+import sys
+import threading
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError: # Optional: only needed for Arrow/Parquet output and the snapshot
+    pa = None
+
+from backend.data_storage.database import DATABASE_URL, ReceiptDB, engine
+from backend.data_storage.summary import data_version
+
+logger = logging.getLogger(__name__)
+
+# Columnar copies of the receipts table for analytics tools: Arrow IPC and
+# Parquet export formats, and an on-disk Arrow snapshot that is rewritten in
+# the background whenever the data changes. Dates and amounts keep their
+# types and vendor/category are dictionary-encoded, so pandas/polars/DuckDB
+# read them without parsing JSON.
+
+# Rows per Arrow record batch / Parquet row group in exports.
+ROW_GROUP_SIZE = int(os.getenv("RECEIPT_COLUMNAR_ROW_GROUP_SIZE", "65536"))
+# Seconds between checks whether the snapshot is out of date (0 disables it).
+SNAPSHOT_INTERVAL = float(os.getenv("RECEIPT_SNAPSHOT_INTERVAL", "300"))
+
+
+def _default_snapshot_path() -> str:
+    # Next to the SQLite file (receipts.db -> receipts.arrow), else the project root
+    url = make_url(DATABASE_URL)
+    if url.get_backend_name() == "sqlite" and url.database and url.database != ":memory:":
+        return os.path.splitext(url.database)[0] + ".arrow"
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "receipts.arrow")
+
+
+SNAPSHOT_PATH = os.getenv("RECEIPT_SNAPSHOT_PATH", _default_snapshot_path())
+
+# format -> (media type, file extension)
+COLUMNAR_FORMATS = {
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+COLUMNS = [ReceiptDB.id, ReceiptDB.vendor, ReceiptDB.transaction_date, ReceiptDB.amount_cents, ReceiptDB.category]
+_VERSION_KEY = b"receipts.data_version"
+
+
+def is_available() -> bool:
+    return pa is not None
+
+
+def arrow_schema():
+    # amount is the float the JSON API returns; amount_cents is exact
+    return pa.schema([
+        ("id", pa.int64()),
+        ("vendor", pa.dictionary(pa.int32(), pa.string())),
+        ("transaction_date", pa.date32()),
+        ("amount", pa.float64()),
+        ("amount_cents", pa.int64()),
+        ("category", pa.dictionary(pa.int32(), pa.string())),
+    ])
+
+
+def _dictionary_column(values: tuple, dictionary=None):
+    values = pa.array(values, pa.string())
+    if dictionary is None:
+        return values.dictionary_encode()
+    indices = pc.index_in(values, value_set=dictionary)
+    if indices.null_count != values.null_count:
+        raise RuntimeError("A vendor or category was added while the snapshot was being written")
+    return pa.DictionaryArray.from_arrays(indices, dictionary)
+
+
+def record_batch(rows: List[tuple], vendors=None, categories=None):
+    # rows are (id, vendor, transaction_date, amount_cents, category) tuples.
+    # vendors/categories are fixed dictionaries shared by every batch; without
+    # them each batch builds its own.
+    ids, vendor_values, dates, cents, category_values = zip(*rows) if rows else ([], [], [], [], [])
+    cents = pa.array(cents, pa.int64())
+    return pa.record_batch([
+        pa.array(ids, pa.int64()),
+        _dictionary_column(vendor_values, vendors),
+        pa.array(dates, pa.date32()),
+        pc.divide(cents.cast(pa.float64()), 100.0),
+        cents,
+        _dictionary_column(category_values, categories),
+    ], schema=arrow_schema())
+
+
+async def _row_groups(batches: AsyncIterator[list]) -> AsyncIterator[list]:
+    # Regroups the cursor's fetch batches into ROW_GROUP_SIZE rows
+    pending: list = []
+    async for rows in batches:
+        pending.extend(rows)
+        while len(pending) >= ROW_GROUP_SIZE:
+            yield pending[:ROW_GROUP_SIZE]
+            pending = pending[ROW_GROUP_SIZE:]
+    if pending:
+        yield pending
+
+
+def _drain(sink: io.BytesIO) -> bytes:
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return data
+
+
+async def columnar_chunks(batches: AsyncIterator[list], format: str) -> AsyncIterator[bytes]:
+    # Encodes one row group at a time into an in-memory sink and hands its
+    # bytes on, so memory is bounded by ROW_GROUP_SIZE rows. Each Arrow batch
+    # carries its own dictionaries (the stream format allows replacing them).
+    sink = io.BytesIO()
+    if format == "parquet":
+        writer = pq.ParquetWriter(sink, arrow_schema(), compression="zstd")
+    else:
+        writer = ipc.new_stream(sink, arrow_schema())
+    async for rows in _row_groups(batches):
+        writer.write_batch(record_batch(rows))
+        yield _drain(sink)
+    writer.close() # Parquet footer / end-of-stream marker
+    yield _drain(sink)
+
+
+def _read_rows(conn, batch_size: int = ROW_GROUP_SIZE) -> Iterable[list]:
+    result = conn.execution_options(yield_per=batch_size).execute(select(*COLUMNS).order_by(ReceiptDB.id))
+    for rows in result.partitions():
+        yield rows
+
+
+def _distinct(conn, column):
+    return pa.array(conn.execute(select(column).where(column.isnot(None)).distinct()).scalars().all(), pa.string())
+
+
+def write_snapshot(path: str = SNAPSHOT_PATH, bind=None) -> Tuple[int, int]:
+    # Writes every receipt to an Arrow IPC file (random access, memory-mappable)
+    # and atomically replaces the previous one. The data version is read first,
+    # so a write that lands during the export can only make the snapshot look
+    # older than it is, never newer. The file format needs one dictionary per
+    # column for the whole file, so a first pass reads the distinct vendors
+    # and categories; then rows are written ROW_GROUP_SIZE at a time, and
+    # memory is bounded by one batch plus the dictionaries. Returns
+    # (data version, rows).
+    bind = bind or engine
+    temporary = f"{path}.{os.getpid()}.tmp"
+    rows_written = 0
+    try:
+        with bind.connect() as conn, pa.OSFile(temporary, "wb") as sink:
+            version = data_version(conn)
+            vendors = _distinct(conn, ReceiptDB.vendor)
+            categories = _distinct(conn, ReceiptDB.category)
+            schema = arrow_schema().with_metadata({_VERSION_KEY: str(version).encode()})
+            with ipc.new_file(sink, schema) as writer:
+                for rows in _read_rows(conn):
+                    writer.write_batch(record_batch(rows, vendors, categories))
+                    rows_written += len(rows)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+        raise
+    os.replace(temporary, path)
+    return version, rows_written
+
+
+_snapshot_lock = threading.Lock()
+_snapshot_cache: dict = {} # path -> (mtime, data version, table)
+
+
+def load_snapshot(path: str = SNAPSHOT_PATH):
+    # Memory-maps the snapshot (no copy; pages are read on demand). Returns
+    # (data version, table), or None if there is no snapshot or no pyarrow.
+    if pa is None:
+        return None
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    with _snapshot_lock:
+        cached = _snapshot_cache.get(path)
+        if cached is None or cached[0] != mtime:
+            table = ipc.open_file(pa.memory_map(path)).read_all()
+            version = int((table.schema.metadata or {}).get(_VERSION_KEY, b"-1"))
+            cached = _snapshot_cache[path] = (mtime, version, table)
+        return cached[1], cached[2]
+
+
+def current_snapshot(db, path: str = SNAPSHOT_PATH):
+    # The snapshot table if it reflects the latest write, else None
+    snapshot = load_snapshot(path)
+    if snapshot is None or snapshot[0] != data_version(db):
+        return None
+    return snapshot[1]
+
+
+def snapshot_median(table) -> float:
+    # Midpoint of the two middle values for an even count, like pandas
+    cents = table["amount_cents"]
+    if cents.null_count == len(cents):
+        return 0.0
+    return pc.quantile(cents, q=0.5, interpolation="midpoint")[0].as_py() / 100
+
+
+def snapshot_mode(table) -> List[float]:
+    counts = pc.value_counts(table["amount_cents"].drop_null())
+    if len(counts) == 0:
+        return []
+    top = pc.max(counts.field("counts"))
+    values = pc.filter(counts.field("values"), pc.equal(counts.field("counts"), top))
+    return sorted(cents / 100 for cents in values.to_pylist())
+
+
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def _refresh_loop():
+    while True:
+        refresh_snapshot()
+        if _stop.wait(SNAPSHOT_INTERVAL):
+            return
+
+
+def refresh_snapshot(path: str = SNAPSHOT_PATH) -> bool:
+    # Rewrites the snapshot if the data changed since it was taken
+    try:
+        snapshot = load_snapshot(path)
+        with engine.connect() as conn:
+            if snapshot is not None and snapshot[0] == data_version(conn):
+                return False
+        write_snapshot(path)
+        return True
+    except Exception:
+        logger.exception("Error refreshing columnar snapshot")
+        return False
+
+
+def start_snapshot_refresher():
+    # One background thread per process; with several uvicorn workers each
+    # may rewrite the file, which is harmless since the replace is atomic.
+    global _thread
+    if _thread is not None or pa is None or SNAPSHOT_INTERVAL <= 0:
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_refresh_loop, name="receipt-snapshot", daemon=True)
+    _thread.start()
+
+
+def stop_snapshot_refresher():
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join()
+        _thread = None
+
+
+def main(argv=None) -> int:
+    # python -m backend.data_storage.columnar: write the snapshot now, e.g.
+    # from cron when the API's refresher is disabled.
+    parser = argparse.ArgumentParser(description="Write the columnar receipts snapshot.")
+    parser.add_argument("--output", default=SNAPSHOT_PATH, help=f"snapshot file (default {SNAPSHOT_PATH})")
+    args = parser.parse_args(argv)
+    if pa is None:
+        print("pyarrow is not installed.")
+        return 1
+    version, rows = write_snapshot(args.output)
+    print(f"Wrote {rows} receipts (data version {version}) to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+import csv
+import io
+import json
+import os
+import zlib
+from typing import AsyncIterator, Dict, List
+
+from backend.algorithms.query import ReceiptQuery
+from backend.data_storage import columnar
+from backend.data_storage.database import async_engine
+
+# Streaming export: rows are read through a server-side cursor in batches of
+# EXPORT_BATCH_SIZE and each batch is encoded and sent before the next one is
+# fetched, so memory use does not grow with the table and the first bytes go
+# out as soon as the first batch is read.
+EXPORT_BATCH_SIZE = int(os.getenv("RECEIPT_EXPORT_BATCH_SIZE", "1000"))
+EXPORT_FIELDS = ["id", "vendor", "transaction_date", "amount", "category"]
+
+# format -> (media type, file extension)
+EXPORT_FORMATS: Dict[str, tuple] = {
+    "csv": ("text/csv", "csv"),
+    "json": ("application/json", "json"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    **columnar.COLUMNAR_FORMATS, # Needs pyarrow
+}
+
+
+def export_query(spec: ReceiptQuery) -> ReceiptQuery:
+    # Same filters, every row, in id order (the primary key, so no sort step)
+    return ReceiptQuery(query=spec.query, start_date=spec.start_date, end_date=spec.end_date,
+                        min_amount=spec.min_amount, max_amount=spec.max_amount, category=spec.category,
+                        fields=",".join(EXPORT_FIELDS))
+
+
+async def stream_rows(statement, batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[list]:
+    # Uses its own connection rather than the request's session: the
+    # response body is produced after the endpoint has returned.
+    async with async_engine.connect() as conn:
+        result = await conn.stream(statement.execution_options(yield_per=batch_size))
+        async for rows in result.partitions():
+            yield rows
+
+
+async def stream_batches(spec: ReceiptQuery, batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[List[dict]]:
+    async for rows in stream_rows(export_query(spec).statement(), batch_size):
+        yield [{name: row._mapping[name] for name in EXPORT_FIELDS} for row in rows]
+
+
+async def csv_chunks(batches: AsyncIterator[List[dict]]) -> AsyncIterator[str]:
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    async for rows in batches:
+        writer.writerows(rows)
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+    yield output.getvalue() # Just the header when nothing matched
+
+
+async def json_chunks(batches: AsyncIterator[List[dict]]) -> AsyncIterator[str]:
+    # One JSON array, written one object per line
+    separator = "[\n"
+    async for rows in batches:
+        lines = [json.dumps(row, default=str) for row in rows]
+        yield separator + ",\n".join(lines)
+        separator = ",\n"
+    yield "[]\n" if separator == "[\n" else "\n]\n"
+
+
+async def ndjson_chunks(batches: AsyncIterator[List[dict]]) -> AsyncIterator[str]:
+    async for rows in batches:
+        yield "".join(json.dumps(row, default=str) + "\n" for row in rows)
+
+
+ENCODERS = {"csv": csv_chunks, "json": json_chunks, "ndjson": ndjson_chunks}
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    # wbits=31 writes a gzip header and trailer. The compressor buffers
+    # internally and only emits once it has a full block.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def encoded_chunks(chunks: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    async for chunk in chunks:
+        if chunk:
+            yield chunk.encode("utf-8")
+
+
+def export_stream(spec: ReceiptQuery, format: str, compress: bool = False) -> AsyncIterator[bytes]:
+    # Raises ValueError for an unknown format or invalid filters before
+    # anything is streamed, so the caller can still answer with a 400.
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Invalid format. Choose one of: {', '.join(EXPORT_FORMATS)}.")
+    statement = export_query(spec).statement()
+    if format in columnar.COLUMNAR_FORMATS:
+        if not columnar.is_available():
+            raise ValueError(f"format={format} needs pyarrow, which is not installed on the server.")
+        rows = stream_rows(statement.with_only_columns(*columnar.COLUMNS))
+        chunks = columnar.columnar_chunks(rows, format)
+    else:
+        chunks = encoded_chunks(ENCODERS[format](stream_batches(spec)))
+    return gzip_chunks(chunks) if compress else chunks
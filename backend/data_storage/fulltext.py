@@ -0,0 +1,146 @@
+import logging
+import re
+from typing import Optional
+
+from sqlalchemy import Float, Integer, Text, column, table, text
+from sqlalchemy.exc import OperationalError
+
+# SQLite FTS5 index over vendor, category and the raw extracted text. It is an
+# external-content table: it stores only the index, the text itself stays in
+# the receipts table, and triggers keep the two in sync for every write path
+# (ORM flushes, bulk inserts, raw SQL).
+FTS_TABLE = "receipts_fts"
+# bm25 column weights: a hit on the vendor ranks above one on the category,
+# which ranks above one somewhere in the receipt text.
+RANK_FUNCTION = "bm25(10.0, 5.0, 1.0)"
+
+logger = logging.getLogger(__name__)
+
+# Lightweight handle for building queries; the table is created with raw DDL
+# below because SQLAlchemy has no construct for virtual tables.
+receipts_fts = table(
+    FTS_TABLE,
+    column("rowid", Integer),
+    column("rank", Float),
+    column(FTS_TABLE, Text) # The hidden column MATCH is applied to
+)
+
+_CREATE_TABLE = f"""
+CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+    vendor, category, raw_text,
+    content='receipts', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+)
+"""
+
+_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS receipts_fts_insert AFTER INSERT ON receipts BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, vendor, category, raw_text)
+        VALUES (new.id, new.vendor, new.category, new.raw_text);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS receipts_fts_delete AFTER DELETE ON receipts BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, vendor, category, raw_text)
+        VALUES ('delete', old.id, old.vendor, old.category, old.raw_text);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS receipts_fts_update AFTER UPDATE OF vendor, category, raw_text ON receipts BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, vendor, category, raw_text)
+        VALUES ('delete', old.id, old.vendor, old.category, old.raw_text);
+        INSERT INTO {FTS_TABLE}(rowid, vendor, category, raw_text)
+        VALUES (new.id, new.vendor, new.category, new.raw_text);
+    END
+    """,
+]
+
+_INSERT_TRIGGER = "receipts_fts_insert"
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+_enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def ensure_fulltext(engine) -> bool:
+    # Creates the index and its triggers if needed. The first time, the index
+    # is built from the rows already stored. Returns False (and searches fall
+    # back to LIKE) on databases other than SQLite or builds without FTS5.
+    global _enabled
+    _enabled = False
+    if engine.dialect.name != "sqlite":
+        return False
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+            ).first()
+            if not exists:
+                conn.execute(text(_CREATE_TABLE))
+                conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('rank', :rank)"),
+                             {"rank": RANK_FUNCTION})
+                conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+            for trigger in _TRIGGERS:
+                conn.execute(text(trigger))
+    except OperationalError as e:
+        logger.warning("Full-text search unavailable, falling back to LIKE: %s", e)
+        return False
+    _enabled = True
+    return True
+
+
+def suspend_insert_trigger(connection) -> Optional[int]:
+    # For bulk loads: drops the per-row insert trigger inside the caller's
+    # transaction, and resume_insert_trigger() indexes every row added since
+    # with one INSERT ... SELECT and recreates the trigger before the caller
+    # commits. SQLite DDL is transactional and the write lock is held
+    # throughout, so no other connection ever sees the trigger missing, and a
+    # rollback restores it. Returns the last id before the load, or None if
+    # there is no trigger to suspend.
+    if connection.dialect.name != "sqlite":
+        return None
+    if not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql("BEGIN IMMEDIATE") # pysqlite does not open a transaction for DDL
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = :name"), {"name": _INSERT_TRIGGER}
+    ).first()
+    if not exists:
+        return None
+    connection.execute(text(f"DROP TRIGGER {_INSERT_TRIGGER}"))
+    return connection.execute(text("SELECT coalesce(max(id), 0) FROM receipts")).scalar()
+
+
+def resume_insert_trigger(connection, last_id: Optional[int], rebuild: bool = False):
+    # rebuild=True rebuilds the whole index from the receipts table instead of
+    # indexing the new rows; cheaper once they outnumber the existing ones.
+    if last_id is None:
+        return
+    if rebuild:
+        connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    else:
+        connection.execute(
+            text(f"INSERT INTO {FTS_TABLE}(rowid, vendor, category, raw_text) "
+                 "SELECT id, vendor, category, raw_text FROM receipts WHERE id > :last"),
+            {"last": last_id}
+        )
+    connection.execute(text(_TRIGGERS[0]))
+
+
+def match_expression(query: str) -> Optional[str]:
+    # Turns free text typed by a user into an FTS5 query: every word must
+    # match as a prefix of some word ("fresh sup" finds "FreshFoods Supermarket").
+    # Words are quoted so FTS5 operators in the input are taken literally.
+    # Returns None when the input has no searchable words.
+    tokens = _TOKEN.findall(query.lower())
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+def match_clause(expression: str):
+    return receipts_fts.c[FTS_TABLE].op("MATCH")(expression)
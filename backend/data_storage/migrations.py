@@ -0,0 +1,241 @@
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+from typing import List
+
+from sqlalchemy import func, insert, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateColumn
+
+from backend.data_storage.database import (
+    AmountHistogramDB, ReceiptDB, ReceiptStatsDB, SchemaMigrationDB, engine, init_db
+)
+from backend.data_storage.summary import NON_POSITIVE_BUCKET
+
+# Versioned schema changes for databases created by older releases. Each step
+# only adds columns and indexes (the legacy float amount column is left in
+# place, and triggers copy writes between it and amount_cents in both
+# directions), so a running older process keeps working while a newer one
+# migrates. Steps check what already exists before changing
+# anything, which makes an interrupted migration safe to run again.
+
+# Rows updated per transaction when backfilling a new column; the write lock
+# is released between batches so the API keeps serving during the backfill.
+BACKFILL_BATCH_SIZE = int(os.getenv("RECEIPT_MIGRATION_BATCH_SIZE", "10000"))
+
+logger = logging.getLogger(__name__)
+
+_receipts = ReceiptDB.__table__
+
+
+def _existing_columns(conn, table_name: str) -> set:
+    return {c["name"] for c in inspect(conn).get_columns(table_name)}
+
+
+def _add_columns(conn, table, names: List[str]):
+    existing = _existing_columns(conn, table.name)
+    for name in names:
+        if name not in existing:
+            # CreateColumn renders the type plus clauses such as GENERATED ALWAYS AS
+            ddl = CreateColumn(table.c[name]).compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+
+
+def _create_indexes(conn, table, names: List[str]):
+    for index in table.indexes:
+        if index.name in names:
+            index.create(conn, checkfirst=True)
+
+
+def _drop_indexes(conn, names: List[str]):
+    for name in names:
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+def _backfill(engine, table_name: str, assignment: str, where: str = "1 = 1"):
+    # UPDATE in id ranges of BACKFILL_BATCH_SIZE rows, one transaction each
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            upper = conn.execute(
+                text(f"SELECT max(id) FROM (SELECT id FROM {table_name} WHERE id > :last ORDER BY id LIMIT :size) AS batch"),
+                {"last": last_id, "size": BACKFILL_BATCH_SIZE}
+            ).scalar()
+            if upper is None:
+                return
+            conn.execute(
+                text(f"UPDATE {table_name} SET {assignment} WHERE id > :last AND id <= :upper AND {where}"),
+                {"last": last_id, "upper": upper}
+            )
+        last_id = upper
+
+
+def _ingestion_columns(engine):
+    # content_hash and raw_text, added before migrations were versioned
+    with engine.begin() as conn:
+        _add_columns(conn, _receipts, ["content_hash", "raw_text"])
+        _create_indexes(conn, _receipts, ["ix_receipts_content_hash"])
+
+
+# While the legacy amount column exists, an older process writes only amount
+# and a newer one only amount_cents; these fill in the other column on insert
+# and follow an update of either. Drop them before dropping the column.
+_SQLITE_AMOUNT_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS receipts_amount_insert AFTER INSERT ON receipts
+    WHEN (NEW.amount IS NULL) <> (NEW.amount_cents IS NULL) BEGIN
+        UPDATE receipts SET amount = coalesce(amount, amount_cents / 100.0),
+                            amount_cents = coalesce(amount_cents, CAST(ROUND(amount * 100) AS INTEGER))
+        WHERE id = NEW.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS receipts_amount_update AFTER UPDATE OF amount ON receipts
+    WHEN NEW.amount IS NOT OLD.amount AND NEW.amount_cents IS OLD.amount_cents BEGIN
+        UPDATE receipts SET amount_cents = CAST(ROUND(NEW.amount * 100) AS INTEGER) WHERE id = NEW.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS receipts_amount_cents_update AFTER UPDATE OF amount_cents ON receipts
+    WHEN NEW.amount_cents IS NOT OLD.amount_cents AND NEW.amount IS OLD.amount BEGIN
+        UPDATE receipts SET amount = NEW.amount_cents / 100.0 WHERE id = NEW.id;
+    END""",
+]
+_POSTGRESQL_AMOUNT_TRIGGER = [
+    """CREATE OR REPLACE FUNCTION receipts_sync_amount() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            NEW.amount := coalesce(NEW.amount, NEW.amount_cents / 100.0);
+            NEW.amount_cents := coalesce(NEW.amount_cents, ROUND(NEW.amount * 100));
+        ELSIF NEW.amount IS DISTINCT FROM OLD.amount AND NEW.amount_cents IS NOT DISTINCT FROM OLD.amount_cents THEN
+            NEW.amount_cents := ROUND(NEW.amount * 100);
+        ELSIF NEW.amount_cents IS DISTINCT FROM OLD.amount_cents AND NEW.amount IS NOT DISTINCT FROM OLD.amount THEN
+            NEW.amount := NEW.amount_cents / 100.0;
+        END IF;
+        RETURN NEW;
+    END $$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS receipts_sync_amount ON receipts",
+    """CREATE TRIGGER receipts_sync_amount BEFORE INSERT OR UPDATE OF amount, amount_cents ON receipts
+    FOR EACH ROW EXECUTE FUNCTION receipts_sync_amount()""",
+]
+
+
+def _create_amount_triggers(conn):
+    statements = _POSTGRESQL_AMOUNT_TRIGGER if conn.dialect.name == "postgresql" else _SQLITE_AMOUNT_TRIGGERS
+    for statement in statements:
+        conn.execute(text(statement))
+
+
+def _amount_minor_units(engine):
+    with engine.begin() as conn:
+        legacy = "amount" in _existing_columns(conn, _receipts.name)
+        _add_columns(conn, _receipts, ["amount_cents"])
+        if legacy:
+            # In the same transaction, so no write falls between the column and the triggers
+            _create_amount_triggers(conn)
+    if legacy:
+        _backfill(engine, _receipts.name, "amount_cents = CAST(ROUND(amount * 100) AS INTEGER)",
+                  "amount IS NOT NULL AND amount_cents IS NULL")
+    with engine.begin() as conn:
+        _create_indexes(conn, _receipts, ["ix_receipts_amount_cents", "ix_receipts_transaction_date_amount_cents"])
+
+
+def _lowercase_columns(engine):
+    # Generated columns: the database fills them, including for existing rows
+    with engine.begin() as conn:
+        _add_columns(conn, _receipts, ["vendor_lower", "category_lower"])
+        _create_indexes(conn, _receipts, ["ix_receipts_vendor_lower", "ix_receipts_category_lower",
+                                          "ix_receipts_category_lower_amount_cents"])
+
+
+def _data_version(engine):
+    with engine.begin() as conn:
+        _add_columns(conn, ReceiptStatsDB.__table__, ["data_version"])
+
+
+def _redundant_indexes(engine):
+    # Each of these duplicates the primary key or the leading column of a
+    # composite index, and only added work to every insert.
+    with engine.begin() as conn:
+        _drop_indexes(conn, ["ix_receipts_id", "ix_receipts_transaction_date", "ix_receipts_category_lower",
+                             "ix_receipt_jobs_id"])
+
+
+def _histogram_without_missing_amounts(engine):
+    # Receipts without an amount used to be counted in the zero/negative
+    # bucket; recount it from the receipts that actually have such amounts.
+    with engine.begin() as conn:
+        conn.execute(
+            AmountHistogramDB.__table__.update()
+            .where(AmountHistogramDB.bucket == NON_POSITIVE_BUCKET)
+            .values(receipt_count=select(func.count()).where(ReceiptDB.amount_cents <= 0).scalar_subquery())
+        )
+
+
+def _legacy_amount_sync(engine):
+    # Databases migrated before the amount triggers existed: add them, then
+    # fill in whichever column the other release left empty since.
+    with engine.begin() as conn:
+        if "amount" not in _existing_columns(conn, _receipts.name):
+            return
+        _create_amount_triggers(conn)
+    _backfill(engine, _receipts.name, "amount_cents = CAST(ROUND(amount * 100) AS INTEGER)",
+              "amount IS NOT NULL AND amount_cents IS NULL")
+    _backfill(engine, _receipts.name, "amount = amount_cents / 100.0", "amount IS NULL AND amount_cents IS NOT NULL")
+
+
+# (version, name, step) in the order they must be applied. Append only.
+MIGRATIONS = [
+    (1, "content hash and raw text columns", _ingestion_columns),
+    (2, "amounts in integer minor units", _amount_minor_units),
+    (3, "lowercase vendor/category columns", _lowercase_columns),
+    (4, "receipt data version counter", _data_version),
+    (5, "drop redundant receipt indexes", _redundant_indexes),
+    (6, "amount histogram without missing amounts", _histogram_without_missing_amounts),
+    (7, "keep the legacy amount column in sync", _legacy_amount_sync),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(engine) -> int:
+    with engine.connect() as conn:
+        return conn.execute(select(func.max(SchemaMigrationDB.version))).scalar() or 0
+
+
+def _record(engine, version: int, name: str):
+    try:
+        with engine.begin() as conn:
+            conn.execute(insert(SchemaMigrationDB.__table__).values(
+                version=version, name=name, applied_at=datetime.utcnow()
+            ))
+    except IntegrityError:
+        pass # Another process recorded it first
+
+
+def run_migrations(engine, fresh: bool = False) -> List[int]:
+    # Applies every step newer than the recorded version. A database that
+    # create_all() has just built is already current and is only stamped.
+    # Returns the versions applied.
+    current = schema_version(engine)
+    applied = []
+    for version, name, step in MIGRATIONS:
+        if version <= current:
+            continue
+        if not fresh:
+            started = time.perf_counter()
+            step(engine)
+            logger.info("Applied migration %d (%s) in %.2fs", version, name, time.perf_counter() - started)
+        _record(engine, version, name)
+        applied.append(version)
+    return applied
+
+
+def main() -> int:
+    # python -m backend.data_storage.migrations: migrate the configured
+    # database ahead of starting the API.
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    before = schema_version(engine) if inspect(engine).has_table(SchemaMigrationDB.__tablename__) else 0
+    init_db()
+    print(f"Schema version {before} -> {schema_version(engine)} (latest {LATEST_VERSION})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+import math
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from backend.data_storage.database import (
+    ReceiptDB, ReceiptStatsDB, VendorStatsDB, MonthlyStatsDB, AmountHistogramDB
+)
+
+# Amount histogram: bucket i holds amounts in (GAMMA**(i-1), GAMMA**i], so any
+# quantile read from it is within HISTOGRAM_ACCURACY (relative) of the truth.
+HISTOGRAM_ACCURACY = 0.01
+GAMMA = (1 + HISTOGRAM_ACCURACY) / (1 - HISTOGRAM_ACCURACY)
+_LOG_GAMMA = math.log(GAMMA)
+NON_POSITIVE_BUCKET = -(2 ** 31) # Zero/negative amounts all land here; missing ones are left out
+
+TRACKED_FIELDS = ("vendor", "transaction_date", "amount_cents")
+
+
+def amount_bucket(amount: float) -> int:
+    if amount <= 0:
+        return NON_POSITIVE_BUCKET
+    return math.ceil(math.log(amount) / _LOG_GAMMA)
+
+
+def bucket_value(bucket: int) -> float:
+    # Representative amount of a bucket (minimises the relative error)
+    if bucket == NON_POSITIVE_BUCKET:
+        return 0.0
+    return 2 * GAMMA ** bucket / (GAMMA + 1)
+
+
+def month_key(transaction_date) -> Optional[str]:
+    return transaction_date.strftime("%Y-%m") if transaction_date else None
+
+
+class SummaryDelta:
+    # Accumulates +/- contributions of receipts, then writes them to the
+    # summary tables with one upsert per touched row.
+
+    def __init__(self):
+        self.changed = False # Any receipt written, even outside TRACKED_FIELDS
+        self.count = 0
+        self.total = 0.0
+        self.vendors: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+        self.months: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+        self.buckets: Dict[int, int] = defaultdict(int)
+
+    def add(self, vendor, transaction_date, amount, sign: int = 1):
+        # Receipts without an amount are counted but not in the histogram,
+        # whose counts sum to the number of amounts (see histogram_median).
+        if amount is not None:
+            self.buckets[amount_bucket(amount)] += sign
+        amount = amount or 0.0
+        self.count += sign
+        self.total += sign * amount
+        if vendor is not None:
+            entry = self.vendors[vendor]
+            entry[0] += sign
+            entry[1] += sign * amount
+        month = month_key(transaction_date)
+        if month is not None:
+            entry = self.months[month]
+            entry[0] += sign
+            entry[1] += sign * amount
+
+    def is_empty(self) -> bool:
+        return (self.count == 0 and self.total == 0.0 and not self.vendors
+                and not self.months and not any(self.buckets.values()))
+
+    def apply(self, connection):
+        insert = _insert_for(connection)
+        if self.count or self.total or self.changed:
+            _upsert(connection, insert, ReceiptStatsDB, {"id": 1}, receipt_count=self.count, total_amount=self.total,
+                    data_version=1 if self.changed else 0)
+        for vendor, (count, total) in self.vendors.items():
+            if count or total:
+                _upsert(connection, insert, VendorStatsDB, {"vendor": vendor}, receipt_count=count, total_amount=total)
+        for month, (count, total) in self.months.items():
+            if count or total:
+                _upsert(connection, insert, MonthlyStatsDB, {"month": month}, receipt_count=count, total_amount=total)
+        for bucket, count in self.buckets.items():
+            if count:
+                _upsert(connection, insert, AmountHistogramDB, {"bucket": bucket}, receipt_count=count)
+
+
+def _insert_for(connection):
+    # Both SQLite and PostgreSQL support INSERT ... ON CONFLICT DO UPDATE
+    if connection.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def _upsert(connection, insert, model, key: Dict[str, Any], **increments):
+    table = model.__table__
+    stmt = insert(table).values(**key, **increments)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(key),
+        set_={name: table.c[name] + stmt.excluded[name] for name in increments}
+    )
+    connection.execute(stmt)
+
+
+def _field_values(obj: ReceiptDB, previous: bool) -> Tuple:
+    state = inspect(obj)
+    values = []
+    for name in TRACKED_FIELDS:
+        history = state.attrs[name].history
+        current = history.deleted if previous else history.added
+        current = current or history.unchanged
+        values.append(current[0] if current else None)
+    vendor, transaction_date, amount_cents = values
+    return vendor, transaction_date, None if amount_cents is None else amount_cents / 100
+
+
+@event.listens_for(Session, "after_flush")
+def _update_summaries(session: Session, flush_context):
+    # Runs inside the flush's transaction, so receipts and their summaries are
+    # committed (or rolled back) together.
+    delta = SummaryDelta()
+    for obj in session.new:
+        if isinstance(obj, ReceiptDB):
+            delta.changed = True
+            delta.add(*_field_values(obj, previous=False))
+    for obj in session.dirty:
+        if isinstance(obj, ReceiptDB) and session.is_modified(obj):
+            delta.changed = True
+            state = inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in TRACKED_FIELDS):
+                delta.add(*_field_values(obj, previous=True), sign=-1)
+                delta.add(*_field_values(obj, previous=False))
+    for obj in session.deleted:
+        if isinstance(obj, ReceiptDB):
+            delta.changed = True
+            delta.add(*_field_values(obj, previous=True), sign=-1)
+    if delta.changed:
+        delta.apply(session.connection())
+
+
+def apply_bulk_insert(connection, rows: Iterable[Dict[str, Any]]):
+    # Core bulk inserts bypass the ORM flush, so they update summaries here.
+    delta = SummaryDelta()
+    for row in rows:
+        delta.changed = True
+        delta.add(row.get("vendor"), row.get("transaction_date"), row.get("amount"))
+    if not delta.is_empty():
+        delta.apply(connection)
+
+
+def apply_inserted_since(connection, last_id: int):
+    # For bulk loads: the summary changes for every receipt with id > last_id,
+    # grouped by the database instead of added up one row at a time.
+    delta = SummaryDelta()
+    delta.changed = True
+    new = ReceiptDB.id > last_id
+    cents = func.coalesce(func.sum(ReceiptDB.amount_cents), 0)
+    delta.count, total = connection.execute(select(func.count(), cents).where(new)).one()
+    delta.total = total / 100
+    for vendor, count, total in connection.execute(
+        select(ReceiptDB.vendor, func.count(), cents).where(new, ReceiptDB.vendor.isnot(None)).group_by(ReceiptDB.vendor)
+    ):
+        delta.vendors[vendor] = [count, total / 100]
+    if connection.dialect.name == "postgresql":
+        month = func.to_char(ReceiptDB.transaction_date, "YYYY-MM")
+    else:
+        month = func.strftime("%Y-%m", ReceiptDB.transaction_date)
+    for key, count, total in connection.execute(
+        select(month, func.count(), cents).where(new, ReceiptDB.transaction_date.isnot(None)).group_by(month)
+    ):
+        delta.months[key] = [count, total / 100]
+    for amount_cents, count in connection.execute(
+        select(ReceiptDB.amount_cents, func.count()).where(new, ReceiptDB.amount_cents.isnot(None))
+        .group_by(ReceiptDB.amount_cents)
+    ):
+        delta.buckets[amount_bucket(amount_cents / 100)] += count
+    delta.apply(connection)
+
+
+def ensure_summaries(db: Session):
+    # Builds the summary tables from the receipts table the first time (e.g.
+    # for a database created before they existed). Later writes keep them current.
+    if db.get(ReceiptStatsDB, 1) is not None:
+        return
+    connection = db.connection()
+    insert = _insert_for(connection)
+    count, total = connection.execute(
+        select(func.count(ReceiptDB.id), func.coalesce(func.sum(ReceiptDB.amount_cents), 0) / 100.0)
+    ).one()
+    # The stats row doubles as the "already built" marker; if another process
+    # got here first this insert is a no-op and we stop.
+    result = connection.execute(
+        insert(ReceiptStatsDB.__table__)
+        .values(id=1, receipt_count=count, total_amount=total)
+        .on_conflict_do_nothing(index_elements=["id"])
+    )
+    if result.rowcount != 1:
+        db.rollback()
+        return
+
+    delta = SummaryDelta()
+    rows = db.execute(select(ReceiptDB.vendor, ReceiptDB.transaction_date, ReceiptDB.amount)).yield_per(10000)
+    for vendor, transaction_date, amount in rows:
+        delta.add(vendor, transaction_date, amount)
+    delta.count = delta.total = 0 # Already written above
+    delta.apply(connection)
+    db.commit()
+
+
+def read_summaries(db: Session) -> Dict[str, Any]:
+    stats = db.get(ReceiptStatsDB, 1)
+    vendors = db.execute(
+        select(VendorStatsDB.vendor, VendorStatsDB.receipt_count)
+        .where(VendorStatsDB.receipt_count > 0)
+        .order_by(VendorStatsDB.receipt_count.desc(), VendorStatsDB.vendor)
+    ).all()
+    months = db.execute(
+        select(MonthlyStatsDB.month, MonthlyStatsDB.total_amount)
+        .where(MonthlyStatsDB.receipt_count > 0)
+        .order_by(MonthlyStatsDB.month)
+    ).all()
+    histogram = db.execute(
+        select(AmountHistogramDB.bucket, AmountHistogramDB.receipt_count)
+        .where(AmountHistogramDB.receipt_count > 0)
+        .order_by(AmountHistogramDB.bucket)
+    ).all()
+    # Totals are accumulated in floating point; amounts are whole cents, so
+    # rounding to two places removes the drift.
+    return {
+        "receipt_count": stats.receipt_count if stats else 0,
+        "data_version": stats.data_version if stats else 0,
+        "total_amount": round(stats.total_amount, 2) if stats else 0.0,
+        "vendor_frequency": {vendor: count for vendor, count in vendors},
+        "monthly_spend_trend": {month: round(total, 2) for month, total in months},
+        "histogram": [(bucket, count) for bucket, count in histogram]
+    }
+
+
+def data_version(db: Session) -> int:
+    version = db.execute(select(ReceiptStatsDB.data_version).where(ReceiptStatsDB.id == 1)).scalar()
+    return version or 0
+
+
+def histogram_median(histogram: List[Tuple[int, int]]) -> float:
+    # Walks the cumulative bucket counts; averages the two middle ranks for an
+    # even count like pandas' median does.
+    total_count = sum(count for _, count in histogram)
+    if total_count <= 0:
+        return 0.0
+    ranks = [(total_count + 1) // 2, total_count // 2 + 1]
+    values = []
+    seen = 0
+    for bucket, count in histogram:
+        seen += count
+        while ranks and ranks[0] <= seen:
+            ranks.pop(0)
+            values.append(bucket_value(bucket))
+        if not ranks:
+            break
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return (values[0] + values[1]) / 2
+
+
+def histogram_mode(histogram: List[Tuple[int, int]]) -> List[float]:
+    if not histogram:
+        return []
+    top = max(count for _, count in histogram)
+    return [round(bucket_value(bucket), 2) for bucket, count in histogram if count == top]
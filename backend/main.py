@@ -1,7 +1,21 @@
-from fastapi import FastAPI
+import logging
+import os
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from backend.data_storage.database import init_db
 from backend.api.routes import router as receipt_router
+from backend.data_ingestion.pipeline import shutdown_executor
+from backend.data_ingestion.job_queue import start_job_workers, stop_job_workers
+from backend.data_storage.columnar import start_snapshot_refresher, stop_snapshot_refresher
+from backend.data_storage.column_store import start_column_store
+from backend.data_ingestion.cache import extraction_cache
+from backend.api.response_cache import response_cache
+from backend.metrics import CACHE_BYTES, CACHE_EVENTS, HTTPMetricsMiddleware, render
+
+# Log level for the application's own loggers (slow queries, OCR/PDF errors,
+# job runner failures, ...); libraries only log warnings and up.
+logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logging.getLogger("backend").setLevel(os.getenv("RECEIPT_LOG_LEVEL", "INFO").upper())
 
 app = FastAPI(
     title="Receipt Processing API",
@@ -25,14 +39,35 @@ app.add_middleware(
     allow_credentials=True,         # Allow cookies to be included in cross-origin requests
     allow_methods=["*"],            # Allow all HTTP methods (GET, POST, PUT, DELETE, etc.)
     allow_headers=["*"],            # Allow all HTTP headers in the request
+    expose_headers=["X-Next-Cursor"], # Pagination cursor returned by GET /api/receipts/
 )
+# Request latency and in-flight requests per route, served by GET /metrics
+app.add_middleware(HTTPMetricsMiddleware)
 
 @app.on_event("startup")
 def on_startup():
     init_db()
+    start_job_workers()
+    start_snapshot_refresher()
+    start_column_store()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    stop_job_workers()
+    stop_snapshot_refresher()
+    shutdown_executor()
 
 app.include_router(receipt_router, prefix="/api")
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    # Prometheus text format; the caches keep their own counters
+    for name, stats in [("extraction", extraction_cache.stats()), ("response", response_cache.stats())]:
+        CACHE_EVENTS.set(stats["hits"], cache=name, result="hit")
+        CACHE_EVENTS.set(stats["misses"], cache=name, result="miss")
+        CACHE_BYTES.set(stats["bytes"], cache=name)
+    return Response(render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
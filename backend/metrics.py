@@ -0,0 +1,276 @@
+import bisect
+import threading
+import time
+from contextlib import ContextDecorator
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# In-process metrics in the Prometheus text format, served by GET /metrics.
+# Each observation is a dict lookup and a few additions under a lock, cheap
+# enough to leave on. Values are per process: with several uvicorn workers
+# each scrape sees the worker that answered it, and work done in the
+# extraction pool is timed there and recorded by the parent (see pipeline.py).
+
+# Seconds; from a cached page (~1 ms) to OCR of a large scan
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry: List["_Metric"] = []
+
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return "\n".join([f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self.samples())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels):
+        # For totals counted elsewhere (e.g. by a cache) and copied in at
+        # scrape time; on a counter they must never go down
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def track(self, **labels) -> "_InFlight":
+        return _InFlight(self, labels)
+
+
+class _InFlight(ContextDecorator):
+    def __init__(self, gauge: Gauge, labels: Dict[str, str]):
+        self.gauge = gauge
+        self.labels = labels
+
+    def __enter__(self):
+        self.gauge.inc(**self.labels)
+        return self
+
+    def __exit__(self, *exc):
+        self.gauge.dec(**self.labels)
+        return False
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket (+Inf last), sum]
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def time(self, **labels) -> "_Timer":
+        return _Timer(self, labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class _Timer(ContextDecorator):
+    # Context manager / decorator that observes the elapsed wall time
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+        self.started: Optional[float] = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+    def _recreate_cm(self):
+        # A fresh timer per decorated call, so concurrent calls don't share one
+        return _Timer(self.histogram, self.labels)
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+# Upload pipeline: decode, spool, extract_text/extract_pdf/extract_image,
+# parse, validate, store
+STAGE_SECONDS = Histogram("receipt_stage_seconds", "Time spent in each stage of receipt ingestion.", ["stage"])
+STAGE_ERRORS = Counter("receipt_stage_errors_total", "Receipt ingestion failures by stage.", ["stage"])
+UPLOADS_IN_FLIGHT = Gauge("receipt_uploads_in_flight", "Uploads currently being processed.")
+PDF_PAGE_SECONDS = Histogram("receipt_pdf_page_seconds", "Time to extract one PDF page, by text layer or OCR.",
+                             ["method"])
+
+# Receipt queries: search, sort, page, aggregate
+QUERY_SECONDS = Histogram("receipt_query_seconds", "Time per receipt query operation.", ["operation"])
+QUERIES_IN_FLIGHT = Gauge("receipt_queries_in_flight", "Receipt query operations currently running.", ["operation"])
+
+# Every SQL statement, by verb (SELECT, INSERT, ...)
+DB_STATEMENT_SECONDS = Histogram("receipt_db_statement_seconds", "Time per SQL statement.", ["statement"])
+DB_SLOW_STATEMENTS = Counter("receipt_db_slow_statements_total", "SQL statements slower than the slow-query threshold.",
+                             ["statement"])
+
+HTTP_REQUEST_SECONDS = Histogram("receipt_http_request_seconds", "HTTP request latency by route.",
+                                 ["method", "route", "status"])
+HTTP_REQUESTS_IN_FLIGHT = Gauge("receipt_http_requests_in_flight", "HTTP requests currently being served.")
+
+# Filled in at scrape time from the caches' own counters
+CACHE_EVENTS = Counter("receipt_cache_events_total", "Cache hits and misses since startup.", ["cache", "result"])
+CACHE_BYTES = Gauge("receipt_cache_bytes", "Bytes held by each cache.", ["cache"])
+
+
+def stage_span(stage: str) -> ContextDecorator:
+    # Times an ingestion stage and counts it as failed if it raises
+    return _StageSpan(stage)
+
+
+class _StageSpan(ContextDecorator):
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.started: Optional[float] = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        STAGE_SECONDS.observe(time.perf_counter() - self.started, stage=self.stage)
+        if exc_type is not None:
+            STAGE_ERRORS.inc(stage=self.stage)
+        return False
+
+    def _recreate_cm(self):
+        return _StageSpan(self.stage)
+
+
+def query_span(operation: str) -> ContextDecorator:
+    # Times a query operation and counts it as in flight while it runs
+    return _QuerySpan(operation)
+
+
+class _QuerySpan(ContextDecorator):
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.started: Optional[float] = None
+
+    def __enter__(self):
+        QUERIES_IN_FLIGHT.inc(operation=self.operation)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        QUERY_SECONDS.observe(time.perf_counter() - self.started, operation=self.operation)
+        QUERIES_IN_FLIGHT.dec(operation=self.operation)
+        return False
+
+    def _recreate_cm(self):
+        return _QuerySpan(self.operation)
+
+
+class HTTPMetricsMiddleware:
+    # Plain ASGI middleware (no per-request task like BaseHTTPMiddleware).
+    # Requests are labelled by route template (/api/receipts/{receipt_id}/),
+    # not the raw path, so the number of series stays bounded.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method=scope["method"],
+                                         route=_route_template(scope), status=str(status[0]))
+
+
+def _route_template(scope) -> str:
+    # The matched route's path with its parameters put back, e.g.
+    # /api/receipts/42/ -> /api/receipts/{receipt_id}/. Built from the request
+    # path because route.path leaves out the prefix of an included router.
+    if "route" not in scope:
+        return "unmatched"
+    params = {str(value): name for name, value in scope.get("path_params", {}).items()}
+    return "/".join("{" + params[part] + "}" if part in params else part for part in scope["path"].split("/"))
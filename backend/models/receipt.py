@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from datetime import date
+from datetime import date, datetime
 from typing import Optional
 
 class ReceiptData(BaseModel):
@@ -11,4 +11,24 @@ class ReceiptData(BaseModel):
 class ReceiptInput(BaseModel):
     file_name: str
     file_content_base64: str # Base64 encoded file content
-    file_type: str # e.g., 'image/jpeg', 'application/pdf', 'text/plain'
\ No newline at end of file
+    file_type: str # e.g., 'image/jpeg', 'application/pdf', 'text/plain'
+
+class BatchReceiptResult(BaseModel):
+    file_name: str
+    success: bool
+    receipt_id: Optional[int] = None
+    duplicate: bool = False # True when the file matched an existing receipt (dedup "merge" mode)
+    data: Optional[ReceiptData] = None
+    error: Optional[str] = None
+
+
+class JobStatus(BaseModel):
+    job_id: int
+    status: str # pending, running, done or failed
+    file_name: str
+    attempts: int
+    error: Optional[str] = None
+    receipt_id: Optional[int] = None
+    data: Optional[ReceiptData] = None
+    created_at: datetime
+    updated_at: datetime
@@ -0,0 +1,110 @@
+# Latency under many in-flight requests against a single uvicorn worker.
+#
+#   python -m benchmarks.bench_async_load [--concurrency 50,200] [--duration 10] [--app-dir DIR]
+#
+# Opens N concurrent connections that page through receipts, read filtered
+# aggregates and edit receipts with PUT, and reports p50/p99 latency per
+# request type. To compare against an older version, check it out next to
+# this one and point --app-dir at it:
+#
+#   git worktree add /tmp/receipts-before <commit>
+#   python -m benchmarks.bench_async_load --app-dir /tmp/receipts-before
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.bench_concurrency import CATEGORIES, VENDORS, free_port, percentile, prepare_database, wait_until_up
+
+REQUEST_MIX = [("page", 0.6), ("aggregates", 0.2), ("update", 0.2)]
+
+
+def pick(rng: random.Random) -> str:
+    roll = rng.random()
+    for name, share in REQUEST_MIX:
+        if roll < share:
+            return name
+        roll -= share
+    return REQUEST_MIX[-1][0]
+
+
+async def client_loop(client: httpx.AsyncClient, rows: int, deadline: float, seed: int, latencies: dict, errors: list):
+    rng = random.Random(seed)
+    while time.monotonic() < deadline:
+        kind = pick(rng)
+        started = time.perf_counter()
+        try:
+            if kind == "page":
+                response = await client.get("/api/receipts/", params={"limit": 50, "sort_by": rng.choice(["id", "amount"])})
+            elif kind == "aggregates":
+                response = await client.get("/api/receipts/aggregates/", params={"category": rng.choice(CATEGORIES)})
+            else:
+                response = await client.put(f"/api/receipts/{rng.randint(1, rows)}/", json={
+                    "vendor": rng.choice(VENDORS), "transaction_date": "2024-01-15",
+                    "amount": rng.randint(100, 50000) / 100, "category": rng.choice(CATEGORIES)
+                })
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+                continue
+            latencies[kind].append(time.perf_counter() - started)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+
+
+async def load(base_url: str, concurrency: int, rows: int, duration: float) -> tuple:
+    latencies = {name: [] for name, _ in REQUEST_MIX}
+    errors: list = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*(client_loop(client, rows, deadline, i, latencies, errors) for i in range(concurrency)))
+    return latencies, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test one uvicorn worker with many concurrent requests.")
+    parser.add_argument("--concurrency", default="50,200", help="comma-separated numbers of concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load per run")
+    parser.add_argument("--rows", type=int, default=20000, help="receipts in the database")
+    parser.add_argument("--app-dir", default=None, help="checkout of the app to run (default: this one)")
+    args = parser.parse_args(argv)
+
+    app_dir = os.path.abspath(args.app_dir) if args.app_dir else None
+    workdir = tempfile.mkdtemp(prefix="receipt-bench-")
+    path = os.path.join(workdir, "load.db")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}", RECEIPT_WORKERS="1", RECEIPT_JOB_WORKERS="0")
+    process = None
+    try:
+        prepare_database(env, path, args.rows, cwd=app_dir)
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port), "--log-level", "warning"],
+            env=env, cwd=app_dir
+        )
+        wait_until_up(base_url, process)
+        print(f"app: {app_dir or 'this checkout'}")
+        print(f"{'clients':>7} {'request':<11} {'count':>7} {'p50':>9} {'p99':>9}   errors")
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            latencies, errors = asyncio.run(load(base_url, concurrency, args.rows, args.duration))
+            total = sum(len(v) for v in latencies.values())
+            for kind, values in latencies.items():
+                print(f"{concurrency:>7} {kind:<11} {len(values):>7} {percentile(values, 0.5) * 1e3:>7.1f}ms "
+                      f"{percentile(values, 0.99) * 1e3:>7.1f}ms")
+            print(f"{concurrency:>7} {'total':<11} {total:>7} {total / args.duration:>7.1f}/s {'':>9}   {len(errors)}")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+# Watch-folder backfill throughput.
+#
+#   python -m benchmarks.bench_backfill [--files N] [--workers 1,2,4] [--pdf-share 0.3]
+#
+# Writes N synthetic receipts (text files and PDFs, plus PNGs when Tesseract
+# is installed) into a folder and runs `watcher DIR --once` on it against a
+# fresh SQLite database per case, reporting files/s. "one at a time" is one
+# worker and one commit per file, the way the upload endpoint stores them;
+# the other cases commit batches of --batch-size over N workers. A second run
+# over the same folder shows the cost of a restart that finds every file
+# checkpointed.
+import argparse
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.corpus import receipt_text, render_pdf, render_png
+from benchmarks.suite import tesseract_missing
+
+
+def write_folder(directory: str, files: int, pdf_share: float, png_share: float):
+    rng = random.Random(files)
+    for i in range(files):
+        text, _ = receipt_text(rng)
+        kind = rng.random()
+        if kind < png_share:
+            with open(os.path.join(directory, f"receipt{i}.png"), "wb") as f:
+                f.write(render_png(text))
+        elif kind < png_share + pdf_share:
+            with open(os.path.join(directory, f"receipt{i}.pdf"), "wb") as f:
+                f.write(render_pdf(text))
+        else:
+            with open(os.path.join(directory, f"receipt{i}.txt"), "w") as f:
+                f.write(text)
+
+
+def backfill(directory: str, database: str, workers: int, batch_size: int) -> float:
+    # Seconds the watcher reports for its work (process start-up excluded)
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{database}")
+    command = [sys.executable, "-m", "backend.data_ingestion.watcher", directory, "--once",
+               "--workers", str(workers), "--batch-size", str(batch_size)]
+    output = subprocess.run(command, env=env, capture_output=True, text=True, check=True).stdout
+    return float(re.search(r"in ([\d.]+)s", output).group(1))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark watch-folder backfill throughput.")
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--workers", default=f"1,{os.cpu_count() or 1}", help="pool sizes to compare")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--pdf-share", type=float, default=0.3, help="fraction of the files that are PDFs")
+    parser.add_argument("--png-share", type=float, default=0.1, help="fraction that are PNGs (needs Tesseract)")
+    args = parser.parse_args(argv)
+
+    missing = tesseract_missing()
+    work_dir = tempfile.mkdtemp(prefix="receipt-backfill-")
+    try:
+        folder = os.path.join(work_dir, "inbox")
+        os.makedirs(folder)
+        write_folder(folder, args.files, args.pdf_share, 0.0 if missing else args.png_share)
+        print(f"{args.files} files, {os.cpu_count()} CPUs" + (f" (no PNGs: {missing})" if missing else ""))
+
+        cases = [("one at a time", 1, 1)]
+        cases += [(f"{w} workers", w, args.batch_size) for w in sorted({int(w) for w in args.workers.split(",") if w})]
+        for n, (label, workers, batch_size) in enumerate(cases):
+            database = os.path.join(work_dir, f"case{n}.db")
+            seconds = backfill(folder, database, workers, batch_size)
+            print(f"  {label:<14} {args.files / seconds:8.1f} files/s  ({seconds:.2f}s)")
+        seconds = backfill(folder, database, workers, batch_size)
+        print(f"  {'restart':<14} {seconds:8.2f}s to find all {args.files} files checkpointed")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
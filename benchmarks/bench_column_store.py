@@ -0,0 +1,110 @@
+# In-memory column store vs. SQL for the dashboard's queries.
+#
+#   python -m benchmarks.bench_column_store [--rows N] [--repeat N]
+#
+# Opens a cached synthetic database (see corpus.fixture), loads the column
+# store and reports its load time and bytes per receipt next to what loaded
+# ReceiptDB objects take (tracemalloc). Then times each query with the store
+# disabled (SQL) and enabled: sorted/filtered pages, filtered aggregates,
+# exact median/mode and search_receipts with a date range (ORM objects); the
+# results of both paths are compared before timing. Also times
+# sort_receipts_in_memory by amount on loaded objects.
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+
+from benchmarks.corpus import fixture, parse_count
+
+
+def best_of(repeat: int, func) -> float:
+    timings = []
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the in-memory column store against SQL.")
+    parser.add_argument("--rows", type=parse_count, default=parse_count("200k"))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--orm-rows", type=parse_count, default=parse_count("20k"),
+                        help="ReceiptDB objects loaded to measure their memory")
+    parser.add_argument("--fixture-dir", default=os.path.join(tempfile.gettempdir(), "receipt-bench-fixtures"))
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        return measure(args)
+
+    # The backend reads DATABASE_URL once on import, so the measurements run
+    # in a child process pointed at the fixture
+    path = fixture(args.fixture_dir, args.rows)
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}", RECEIPT_COLUMN_STORE="1", RECEIPT_SNAPSHOT_INTERVAL="0")
+    command = [sys.executable, "-m", "benchmarks.bench_column_store", "--child", "--repeat", str(args.repeat),
+               "--orm-rows", str(args.orm_rows)]
+    return subprocess.run(command, env=env).returncode
+
+
+def measure(args):
+    from backend.algorithms.aggregate import calculate_aggregates
+    from backend.algorithms.query import ReceiptQuery
+    from backend.algorithms.search import search_receipts
+    from backend.algorithms.sort import sort_receipts_in_memory
+    from backend.data_storage import column_store
+    from backend.data_storage.database import ReceiptDB, SessionLocal, init_db
+
+    init_db()
+    started = time.perf_counter()
+    column_store.store.load()
+    load_seconds = time.perf_counter() - started
+    store_bytes = column_store.store.nbytes() / len(column_store.store)
+    with SessionLocal() as db:
+        tracemalloc.start()
+        receipts = db.query(ReceiptDB).limit(args.orm_rows).all()
+        orm_bytes = tracemalloc.get_traced_memory()[0] / len(receipts)
+        tracemalloc.stop()
+    print(f"{len(column_store.store)} receipts, store loaded in {load_seconds:.2f}s")
+    print(f"  bytes/receipt: store {store_bytes:.0f}, ReceiptDB objects {orm_bytes:.0f} "
+          f"({orm_bytes / store_bytes:.0f}x)")
+
+    cases = [
+        ("page of 50 by amount desc, date range", lambda db: ReceiptQuery(
+            sort_by="amount", sort_order="desc", start_date=date(2021, 1, 1), end_date=date(2022, 12, 31),
+            limit=50).fetch_page(db)),
+        ("page of 50 by vendor, category filter", lambda db: ReceiptQuery(
+            sort_by="vendor", category="Dining", limit=50).fetch_page(db)),
+        ("aggregates, category and date filter", lambda db: calculate_aggregates(
+            db, spec=ReceiptQuery(category="Groceries", start_date=date(2021, 1, 1)))),
+        ("aggregates, amount range", lambda db: calculate_aggregates(
+            db, spec=ReceiptQuery(min_amount=100, max_amount=200))),
+        ("exact median/mode", lambda db: calculate_aggregates(db, exact=True)),
+        ("search_receipts, date range and max amount", lambda db: [r.id for r in search_receipts(
+            db, start_date=date(2023, 1, 1), max_amount=50)]),
+    ]
+    print(f"  {'':<44} {'SQL':>10} {'store':>10}")
+    with SessionLocal() as db:
+        for label, func in cases:
+            column_store.COLUMN_STORE = 0
+            expected = func(db)
+            sql = best_of(args.repeat, lambda: func(db))
+            column_store.COLUMN_STORE = 1
+            assert func(db) == expected, f"{label}: results differ"
+            store = best_of(args.repeat, lambda: func(db))
+            print(f"  {label:<44} {sql * 1e3:8.2f}ms {store * 1e3:8.2f}ms")
+
+    # Keyed on the amount property, as sort_receipts_in_memory used to be
+    old = best_of(args.repeat, lambda: sorted(receipts, key=lambda x: x.amount or 0.0, reverse=True))
+    new = best_of(args.repeat, lambda: sort_receipts_in_memory(receipts, "amount", "desc"))
+    assert sort_receipts_in_memory(receipts, "amount", "desc") == sorted(receipts, key=lambda x: x.amount or 0.0,
+                                                                         reverse=True)
+    print(f"  sort_receipts_in_memory, {len(receipts)} objects by amount {old * 1e3:8.2f}ms -> {new * 1e3:.2f}ms")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
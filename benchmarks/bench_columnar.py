@@ -0,0 +1,105 @@
+# Columnar export and snapshot vs. JSON and SQL.
+#
+#   python -m benchmarks.bench_columnar [--rows N] [--repeat N]
+#
+# Starts one uvicorn worker on a synthetic database and measures, from the
+# client side, how long it takes to get the receipts into a pandas DataFrame
+# from format=json versus format=arrow/parquet, and how long
+# /aggregates/?exact=true takes computed in SQL versus from the columnar
+# snapshot. Needs pyarrow and pandas.
+import argparse
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+from benchmarks.bench_concurrency import free_port, prepare_database, wait_until_up
+
+LOADERS = {
+    "json": lambda content: pd.DataFrame(json.loads(content)),
+    "arrow": lambda content: ipc.open_stream(pa.BufferReader(content)).read_all().to_pandas(),
+    "parquet": lambda content: pq.read_table(io.BytesIO(content)).to_pandas(),
+}
+
+
+def best_of(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def start_server(env: dict) -> tuple:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port), "--log-level", "warning"], env=env
+    )
+    wait_until_up(base_url, process)
+    return base_url, process
+
+
+def stop_server(process: subprocess.Popen):
+    process.terminate()
+    process.wait(timeout=30)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark columnar export and the analytics snapshot.")
+    parser.add_argument("--rows", type=int, default=200000, help="receipts in the database")
+    parser.add_argument("--repeat", type=int, default=3, help="iterations per measurement")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="receipt-bench-")
+    path = os.path.join(workdir, "columnar.db")
+    snapshot = os.path.join(workdir, "columnar.arrow")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}", RECEIPT_WORKERS="1", RECEIPT_JOB_WORKERS="0",
+               RECEIPT_SNAPSHOT_INTERVAL="0")
+    process = None
+    try:
+        prepare_database(env, path, args.rows)
+        print(f"{args.rows} receipts")
+        base_url, process = start_server(env)
+        with httpx.Client(base_url=base_url, timeout=600) as client:
+            for format, load in LOADERS.items():
+                def download_and_load():
+                    response = client.get("/api/export_receipts/", params={"format": format})
+                    response.raise_for_status()
+                    download_and_load.size = len(response.content)
+                    return load(response.content)
+                seconds = best_of(download_and_load, args.repeat)
+                print(f"  export {format:<8} -> DataFrame {seconds:8.2f} s  ({download_and_load.size / 1e6:.1f} MB)")
+            exact_sql = best_of(lambda: client.get("/api/receipts/aggregates/", params={"exact": "true"}), args.repeat)
+        stop_server(process)
+
+        # Same database, now with the snapshot refresher on
+        base_url, process = start_server(dict(env, RECEIPT_SNAPSHOT_INTERVAL="3600"))
+        deadline = time.monotonic() + 600
+        while not os.path.exists(snapshot) and time.monotonic() < deadline:
+            time.sleep(0.2)
+        print(f"  snapshot {os.path.getsize(snapshot) / 1e6:.1f} MB")
+        with httpx.Client(base_url=base_url, timeout=600) as client:
+            exact_snapshot = best_of(lambda: client.get("/api/receipts/aggregates/", params={"exact": "true"}),
+                                     args.repeat)
+        print(f"  aggregates exact=true, SQL      {exact_sql * 1e3:8.1f} ms")
+        print(f"  aggregates exact=true, snapshot {exact_snapshot * 1e3:8.1f} ms")
+    finally:
+        if process is not None:
+            stop_server(process)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
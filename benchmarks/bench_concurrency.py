@@ -0,0 +1,171 @@
+# Mixed read/write throughput against real uvicorn workers.
+#
+#   python -m benchmarks.bench_concurrency [--workers 1,2,4] [--clients 16] [--duration 10]
+#
+# For each SQLite configuration and worker count this creates a database of
+# synthetic receipts, starts `uvicorn backend.main:app --workers N` on it and
+# runs client threads that page through receipts (reads) and edit receipts
+# with PUT (writes, which also update the summary tables and search index).
+# "legacy" approximates the old engine (rollback journal, synchronous=FULL,
+# default busy timeout and cache); "tuned" uses the current defaults.
+import argparse
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from typing import Optional
+
+import httpx
+
+CONFIGS = {
+    "legacy": {"RECEIPT_SQLITE_JOURNAL_MODE": "DELETE", "RECEIPT_SQLITE_SYNCHRONOUS": "FULL",
+               "RECEIPT_SQLITE_BUSY_TIMEOUT": "5", "RECEIPT_SQLITE_MMAP_SIZE": "0",
+               "RECEIPT_SQLITE_CACHE_SIZE_KB": "2000"},
+    "tuned": {},
+}
+VENDORS = ["FreshFoods Supermarket", "City Power Co", "Shell Station", "Corner Cafe", "Metro Transit"]
+CATEGORIES = ["Groceries", "Utilities (Electricity)", "Transportation", "Dining", "Transportation"]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def prepare_database(env: dict, path: str, rows: int, cwd: Optional[str] = None):
+    # cwd selects which checkout of the app creates the schema
+    migrate = [sys.executable, "-m", "backend.data_storage.migrations"]
+    subprocess.run(migrate, env=env, cwd=cwd, check=True, stdout=subprocess.DEVNULL)
+    rng = random.Random(rows)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO receipts (vendor, transaction_date, amount_cents, category, raw_text) VALUES (?, ?, ?, ?, ?)",
+        [(VENDORS[v], (date(2023, 1, 1) + timedelta(days=rng.randrange(700))).isoformat(),
+          rng.randint(100, 50000), CATEGORIES[v], f"{VENDORS[v]} receipt {i}")
+         for i, v in ((i, rng.randrange(len(VENDORS))) for i in range(rows))]
+    )
+    conn.execute("DELETE FROM receipt_stats") # Makes the next startup rebuild the summaries
+    conn.commit()
+    conn.close()
+    subprocess.run(migrate, env=env, cwd=cwd, check=True, stdout=subprocess.DEVNULL)
+
+
+def wait_until_up(base_url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("uvicorn exited during startup")
+        try:
+            if httpx.get(f"{base_url}/api/receipts/?limit=1", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("uvicorn did not start in time")
+
+
+def client_loop(base_url: str, rows: int, write_ratio: float, deadline: float, seed: int, results: list):
+    rng = random.Random(seed)
+    reads, writes, errors = [], [], 0
+    with httpx.Client(base_url=base_url, timeout=60) as client:
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                if rng.random() < write_ratio:
+                    receipt_id = rng.randint(1, rows)
+                    response = client.put(f"/api/receipts/{receipt_id}/", json={
+                        "vendor": rng.choice(VENDORS), "transaction_date": "2024-01-15",
+                        "amount": rng.randint(100, 50000) / 100, "category": rng.choice(CATEGORIES)
+                    })
+                    latencies = writes
+                else:
+                    params = {"limit": 50, "sort_by": rng.choice(["id", "amount", "date"]),
+                              "category": rng.choice(CATEGORIES + [None] * 3)}
+                    response = client.get("/api/receipts/", params={k: v for k, v in params.items() if v})
+                    latencies = reads
+                if response.status_code >= 400:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+            except httpx.HTTPError:
+                errors += 1
+    results.append((reads, writes, errors))
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run(config: str, workers: int, args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="receipt-bench-")
+    path = os.path.join(workdir, "bench.db")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}", RECEIPT_WORKERS="1", RECEIPT_JOB_WORKERS="0",
+               **CONFIGS[config])
+    process = None
+    try:
+        prepare_database(env, path, args.rows)
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port),
+             "--workers", str(workers), "--log-level", "warning"],
+            env=env
+        )
+        wait_until_up(base_url, process)
+        results: list = []
+        deadline = time.monotonic() + args.duration
+        threads = [threading.Thread(target=client_loop, args=(base_url, args.rows, args.write_ratio, deadline, i, results))
+                   for i in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    reads = [r for result in results for r in result[0]]
+    writes = [w for result in results for w in result[1]]
+    return {
+        "config": config, "workers": workers,
+        "requests_per_second": (len(reads) + len(writes)) / args.duration,
+        "read_p50_ms": percentile(reads, 0.5) * 1e3, "read_p99_ms": percentile(reads, 0.99) * 1e3,
+        "write_p50_ms": percentile(writes, 0.5) * 1e3, "write_p99_ms": percentile(writes, 0.99) * 1e3,
+        "errors": sum(result[2] for result in results),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark mixed read/write load with N uvicorn workers.")
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated uvicorn worker counts")
+    parser.add_argument("--configs", default="legacy,tuned", help="comma-separated: " + ", ".join(CONFIGS))
+    parser.add_argument("--clients", type=int, default=16, help="concurrent client threads")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load per run")
+    parser.add_argument("--write-ratio", type=float, default=0.2, help="fraction of requests that are writes")
+    parser.add_argument("--rows", type=int, default=20000, help="receipts in the database")
+    args = parser.parse_args(argv)
+
+    print(f"{'config':<8} {'workers':>7} {'req/s':>8} {'read p50':>9} {'read p99':>9} "
+          f"{'write p50':>10} {'write p99':>10} {'errors':>7}")
+    for config in args.configs.split(","):
+        for workers in (int(w) for w in args.workers.split(",")):
+            r = run(config, workers, args)
+            print(f"{r['config']:<8} {r['workers']:>7} {r['requests_per_second']:>8.1f} {r['read_p50_ms']:>8.1f}ms "
+                  f"{r['read_p99_ms']:>8.1f}ms {r['write_p50_ms']:>9.1f}ms {r['write_p99_ms']:>9.1f}ms {r['errors']:>7}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
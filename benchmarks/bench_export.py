@@ -0,0 +1,112 @@
+# Export time-to-first-byte, total time and server memory.
+#
+#   python -m benchmarks.bench_export [--rows 100000,1000000] [--app-dir DIR]
+#
+# Creates a database of synthetic receipts, starts one uvicorn worker on it
+# and downloads /api/export_receipts/ in each format, reporting the time to
+# the first body byte, the full download time and the server's peak
+# anonymous memory during the download (RssAnon sampled from /proc, Linux
+# only; file-backed pages such as SQLite's mmap are not counted). Point
+# --app-dir at another checkout to compare.
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+from benchmarks.bench_concurrency import free_port, prepare_database, wait_until_up
+
+FORMATS = [("csv", False), ("json", False), ("ndjson", False), ("csv", True)]
+
+
+def anon_rss_mb(pid: int) -> float:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float("nan")
+
+
+def sample_peak(pid: int, stop: threading.Event, peak: list):
+    while not stop.is_set():
+        peak[0] = max(peak[0], anon_rss_mb(pid))
+        time.sleep(0.01)
+
+
+def download(base_url: str, format: str, compress: bool, pid: int) -> tuple:
+    idle = anon_rss_mb(pid)
+    peak = [idle]
+    stop = threading.Event()
+    sampler = threading.Thread(target=sample_peak, args=(pid, stop, peak))
+    sampler.start()
+    params = {"format": format}
+    if compress:
+        params["gzip"] = "true"
+    started = time.perf_counter()
+    first_byte = None
+    size = 0
+    with httpx.stream("GET", f"{base_url}/api/export_receipts/", params=params, timeout=600) as response:
+        response.raise_for_status()
+        for chunk in response.iter_raw():
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+            size += len(chunk)
+    total = time.perf_counter() - started
+    stop.set()
+    sampler.join()
+    return first_byte, total, size, peak[0] - idle
+
+
+def run(rows: int, app_dir, formats) -> list:
+    workdir = tempfile.mkdtemp(prefix="receipt-bench-")
+    path = os.path.join(workdir, "export.db")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}", RECEIPT_WORKERS="1", RECEIPT_JOB_WORKERS="0")
+    process = None
+    results = []
+    try:
+        prepare_database(env, path, rows, cwd=app_dir)
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port), "--log-level", "warning"],
+            env=env, cwd=app_dir
+        )
+        wait_until_up(base_url, process)
+        for format, compress in formats:
+            first_byte, total, size, memory = download(base_url, format, compress, process.pid)
+            results.append((format + (".gz" if compress else ""), first_byte, total, size, memory))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark streaming export.")
+    parser.add_argument("--rows", default="100000,1000000", help="comma-separated database sizes")
+    parser.add_argument("--app-dir", default=None, help="checkout of the app to run (default: this one)")
+    parser.add_argument("--formats", default=",".join(f + (".gz" if z else "") for f, z in FORMATS),
+                        help="comma-separated formats; append .gz for gzip")
+    args = parser.parse_args(argv)
+
+    app_dir = os.path.abspath(args.app_dir) if args.app_dir else None
+    formats = [(f[:-3], True) if f.endswith(".gz") else (f, False) for f in args.formats.split(",")]
+    print(f"app: {app_dir or 'this checkout'}")
+    print(f"{'rows':>9} {'format':<9} {'first byte':>11} {'total':>9} {'size':>9} {'peak mem +':>11}")
+    for rows in (int(r) for r in args.rows.split(",")):
+        for name, first_byte, total, size, rss in run(rows, app_dir, formats):
+            print(f"{rows:>9} {name:<9} {first_byte * 1e3:>9.1f}ms {total:>8.2f}s {size / 1e6:>7.1f}MB {rss:>9.0f}MB")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
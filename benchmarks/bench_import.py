@@ -0,0 +1,108 @@
+# Bulk import throughput.
+#
+#   python -m benchmarks.bench_import [--rows N] [--formats csv,ndjson,json]
+#
+# Writes N synthetic receipts in the export layout, imports each file into a
+# fresh SQLite database with bulk_import.import_file() and reports rows/s,
+# once per format as committed every IMPORT_COMMIT_ROWS and once with
+# bulk=True (indexes dropped, recreated and the search index rebuilt at the end).
+# For comparison, --orm-rows receipts are inserted one ORM object at a time
+# (session.add + a commit per 1000), the way a naive loader would do it.
+import argparse
+import csv
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from sqlalchemy.orm import sessionmaker
+
+from backend.data_ingestion.bulk_import import import_file
+from backend.data_storage import fulltext
+from backend.data_storage.database import Base, ReceiptDB, build_engine
+from backend.data_storage.summary import ensure_summaries
+
+VENDORS = ["FreshFoods Supermarket", "City Power Co", "Shell Station", "Corner Cafe", "Metro Transit",
+           "Aqua Water Board", "FastNet Internet", "Green Grocer", "Pizza Palace", "Urban Outfitters"]
+CATEGORIES = ["Groceries", "Utilities (Electricity)", "Transportation", "Dining", "Transportation",
+              "Utilities (Water)", "Utilities (Internet)", "Groceries", "Dining", None]
+FIELDS = ["id", "vendor", "transaction_date", "amount", "category"]
+
+
+def synthetic_rows(rows: int):
+    rng = random.Random(rows)
+    for i in range(rows):
+        v = rng.randrange(len(VENDORS))
+        yield {"id": i + 1, "vendor": VENDORS[v], "category": CATEGORIES[v],
+               "transaction_date": (date(2020, 1, 1) + timedelta(days=rng.randrange(1500))).isoformat(),
+               "amount": rng.randint(100, 50000) / 100}
+
+
+def write_file(path: str, file_format: str, rows: int):
+    with open(path, "w", newline="") as f:
+        if file_format == "csv":
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(synthetic_rows(rows))
+        elif file_format == "ndjson":
+            f.writelines(json.dumps(row) + "\n" for row in synthetic_rows(rows))
+        else:
+            f.write("[\n" + ",\n".join(json.dumps(row) for row in synthetic_rows(rows)) + "\n]\n")
+
+
+def fresh_database(path: str):
+    engine = build_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    fulltext.ensure_fulltext(engine)
+    with sessionmaker(bind=engine)() as db:
+        ensure_summaries(db)
+    return engine
+
+
+def orm_insert(engine, rows: int) -> float:
+    started = time.perf_counter()
+    with sessionmaker(bind=engine)() as db:
+        for i, row in enumerate(synthetic_rows(rows)):
+            db.add(ReceiptDB(vendor=row["vendor"], transaction_date=date.fromisoformat(row["transaction_date"]),
+                             amount=row["amount"], category=row["category"]))
+            if i % 1000 == 999:
+                db.commit()
+        db.commit()
+    return time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark bulk import.")
+    parser.add_argument("--rows", type=int, default=1000000, help="rows per file")
+    parser.add_argument("--formats", default="csv,ndjson,json", help="comma-separated formats")
+    parser.add_argument("--orm-rows", type=int, default=20000, help="rows for the one-object-at-a-time baseline")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="receipt-bench-")
+    try:
+        if args.orm_rows:
+            engine = fresh_database(os.path.join(workdir, "orm.db"))
+            seconds = orm_insert(engine, args.orm_rows)
+            engine.dispose()
+            print(f"ORM add/commit   {args.orm_rows:>9} rows {seconds:7.2f}s {args.orm_rows / seconds:>10.0f} rows/s")
+        for file_format in args.formats.split(","):
+            source = os.path.join(workdir, f"receipts.{file_format}")
+            write_file(source, file_format, args.rows)
+            for bulk in (False, True):
+                engine = fresh_database(os.path.join(workdir, f"{file_format}{'-bulk' if bulk else ''}.db"))
+                stats = import_file(source, file_format, bind=engine, bulk=bulk)
+                engine.dispose()
+                assert stats["imported"] == args.rows and not stats["error"], stats
+                label = f"{file_format}{' bulk' if bulk else ''}"
+                print(f"import {label:<9} {args.rows:>9} rows {stats['seconds']:7.2f}s "
+                      f"{args.rows / stats['seconds']:>10.0f} rows/s ({os.path.getsize(source) / 1e6:.0f} MB file)")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
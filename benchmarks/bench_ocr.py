@@ -0,0 +1,105 @@
+# OCR preprocessing: latency and accuracy per preprocessing variant.
+#
+#   python -m benchmarks.bench_ocr [--files N] [--width PX] [--psm 3,4,6] [--repeat N]
+#
+# Renders synthetic receipts as phone photos (12 MP JPEGs, tilted, unevenly
+# lit, noisy; see corpus.render_photo) and runs each preprocessing variant
+# over them. Every variant reports the preprocessing time and the pixels
+# handed to Tesseract; "full" also reports how far the detected skew is from
+# the tilt that was applied. When Tesseract is installed, each variant is
+# then OCRed with every page segmentation mode and engine (pytesseract,
+# plus tesserocr if installed), reporting OCR time, the share of receipts
+# whose vendor/date/total parse correctly and the character similarity of
+# the OCR text to the rendered text.
+import argparse
+import difflib
+import io
+import random
+import statistics
+import sys
+import time
+
+from PIL import Image
+
+from backend.data_ingestion import ocr
+from backend.data_parsing.rule_parser import parse_receipt_data
+from benchmarks.corpus import receipt_text, render_photo
+from benchmarks.suite import tesseract_missing
+
+VARIANTS = [
+    ("none", ()),
+    ("downscale", ("downscale",)),
+    ("downscale+binarize", ("downscale", "binarize")),
+    ("full", ocr.PREPROCESS_STEPS),
+]
+
+
+def fields_correct(text: str, expected: dict) -> bool:
+    parsed = parse_receipt_data(text)
+    return (parsed["vendor"] == expected["vendor"] and str(parsed["transaction_date"]) == expected["transaction_date"]
+            and abs((parsed["amount"] or 0) - expected["amount"]) < 0.005)
+
+
+def preprocess_all(photos: list, steps: tuple, repeat: int):
+    # Best of repeat runs; the images are reopened every time since decoding
+    # (and JPEG draft decoding) is part of the cost
+    best = None
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        images = [ocr.preprocess(Image.open(io.BytesIO(p["content"])), steps) for p in photos]
+        for image in images:
+            image.load()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return images, best / len(photos)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark OCR preprocessing on synthetic receipt photos.")
+    parser.add_argument("--files", type=int, default=10, help="receipt photos")
+    parser.add_argument("--width", type=int, default=3024, help="photo width in pixels (3024 is 12 MP)")
+    parser.add_argument("--psm", default="3,4,6", help="page segmentation modes to compare")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    photos = []
+    for _ in range(args.files):
+        text, expected = receipt_text(rng)
+        content, angle = render_photo(text, rng, args.width)
+        photos.append({"text": text, "expected": expected, "content": content, "angle": angle})
+    print(f"{len(photos)} photos, {args.width} px wide, "
+          f"{statistics.mean(len(p['content']) for p in photos) / 1e6:.1f} MB JPEG on average")
+
+    missing = tesseract_missing()
+    engines = ["pytesseract"] + (["tesserocr"] if ocr.tesserocr is not None else [])
+    for name, steps in VARIANTS:
+        images, seconds = preprocess_all(photos, steps, args.repeat)
+        megapixels = statistics.mean(i.width * i.height for i in images) / 1e6
+        line = f"{name:<20} preprocess {seconds * 1e3:8.1f} ms/photo  {megapixels:5.1f} MP to OCR"
+        if "deskew" in steps:
+            # Detected on the image before it is rotated back
+            unrotated = [ocr.preprocess(Image.open(io.BytesIO(p["content"])), ("downscale", "binarize", "crop"))
+                         for p in photos]
+            errors = [abs(ocr.skew_angle(image) + p["angle"]) for image, p in zip(unrotated, photos)]
+            line += f"  skew error mean {statistics.mean(errors):.2f} max {max(errors):.2f} deg"
+        print(line)
+        if missing:
+            continue
+        for psm in (int(p) for p in args.psm.split(",") if p):
+            for engine in engines:
+                started = time.perf_counter()
+                texts = [ocr.recognize(image, psm=psm, engine=engine) for image in images]
+                seconds = (time.perf_counter() - started) / len(images)
+                correct = sum(fields_correct(t, p["expected"]) for t, p in zip(texts, photos))
+                similarity = statistics.mean(difflib.SequenceMatcher(None, t, p["text"]).ratio()
+                                             for t, p in zip(texts, photos))
+                print(f"  psm {psm} {engine:<12} OCR {seconds * 1e3:8.1f} ms/photo  "
+                      f"fields {correct}/{len(photos)}  chars {similarity:.1%}")
+    if missing:
+        print(f"OCR timings skipped: {missing}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
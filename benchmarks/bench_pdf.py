@@ -0,0 +1,106 @@
+# PDF extraction: one task vs. page ranges across workers, and early stop.
+#
+#   python -m benchmarks.bench_pdf [--pages N] [--files N] [--workers 1,2,4] [--repeat N]
+#
+# Builds multi-page bills from the synthetic corpus and extracts them the way
+# the upload pipeline does: the whole file in one pool task, or split into
+# page ranges over N workers (see pipeline.extract_in_pool). Early stop is
+# timed on bills whose vendor, date and total are on the first page, like
+# most utility bills with pages of line items after the summary. Also prints
+# per-page timing percentiles, and the OCR fallback on an image-only page
+# when Tesseract is available.
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz
+
+from backend.data_ingestion.file_handler import extract_pdf_pages, track_fields
+from backend.data_ingestion.pipeline import (
+    extract_and_parse, extract_pdf_range, join_pdf_ranges, parse_extracted, pdf_page_ranges
+)
+from benchmarks.bench_concurrency import percentile
+from benchmarks.corpus import receipt_text, render_pdf, render_png, statement_text
+from benchmarks.suite import tesseract_missing
+
+
+def summary_first(rng: random.Random, pages: int) -> bytes:
+    # A bill with the receipt-style summary on page 1 and line items after it
+    head, _ = receipt_text(rng, items=3)
+    items, _ = statement_text(rng, pages)
+    return render_pdf(head + "\n" * 60 + items.replace("Amount Due:", "Balance carried"))
+
+
+def extract_split(pool: ProcessPoolExecutor, content: bytes, tasks: int) -> dict:
+    ranges = pdf_page_ranges(content, "application/pdf", tasks)
+    if not ranges:
+        return pool.submit(extract_and_parse, content, "application/pdf").result()
+    started = time.perf_counter()
+    futures = [pool.submit(extract_pdf_range, content, start, stop) for start, stop in ranges]
+    text, pages, _ = join_pdf_ranges([f.result() for f in futures])
+    result = pool.submit(parse_extracted, text, {"extract_pdf": time.perf_counter() - started}).result()
+    result["pdf_pages"] = pages
+    return result
+
+
+def best_of(repeat: int, func) -> float:
+    timings = []
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark page-parallel PDF extraction and early stop.")
+    parser.add_argument("--pages", type=int, default=40, help="pages of line items per bill")
+    parser.add_argument("--files", type=int, default=4, help="bills per case")
+    parser.add_argument("--workers", default=f"1,2,{os.cpu_count() or 1}", help="pool sizes to compare")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(0)
+    bills = [render_pdf(statement_text(rng, args.pages)[0]) for _ in range(args.files)]
+    page_count = fitz.open(stream=bills[0], filetype="pdf").page_count
+    print(f"{args.files} bills of {page_count} pages, {os.cpu_count()} CPUs")
+
+    reference = None
+    for workers in sorted({int(w) for w in args.workers.split(",") if w}):
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = [extract_split(pool, b, workers) for b in bills] # Warm-up: starts the workers
+            reference = reference or [r["extracted_text"] for r in results]
+            assert [r["extracted_text"] for r in results] == reference, "split extraction changed the text"
+            seconds = best_of(args.repeat, lambda: [extract_split(pool, b, workers) for b in bills])
+        label = "one task" if workers == 1 else f"{workers} workers"
+        print(f"  {label:<12} {seconds / len(bills) * 1e3:8.1f} ms/bill")
+    pages = [page["seconds"] for r in results for page in r["pdf_pages"]]
+    print(f"  per page     p50 {percentile(pages, 0.5) * 1e3:.2f} ms  p95 {percentile(pages, 0.95) * 1e3:.2f} ms"
+          f"  max {max(pages) * 1e3:.2f} ms")
+
+    early = [summary_first(rng, args.pages) for _ in range(args.files)]
+    full = best_of(args.repeat, lambda: [extract_pdf_pages(b) for b in early])
+    stopped = best_of(args.repeat, lambda: [extract_pdf_pages(b, stop_when=track_fields()) for b in early])
+    read = statistics.mean(len(extract_pdf_pages(b, stop_when=track_fields())[0]) for b in early)
+    print(f"  early stop   {full / len(early) * 1e3:8.1f} -> {stopped / len(early) * 1e3:.1f} ms/bill "
+          f"({read:.0f} of {fitz.open(stream=early[0], filetype='pdf').page_count} pages read)")
+
+    missing = tesseract_missing()
+    if missing:
+        print(f"  OCR fallback skipped: {missing}")
+        return
+    document = fitz.open()
+    page = document.new_page()
+    page.insert_image(page.rect, stream=render_png(receipt_text(rng)[0]))
+    scanned = document.tobytes()
+    seconds = best_of(args.repeat, lambda: extract_pdf_pages(scanned))
+    texts, timings = extract_pdf_pages(scanned)
+    print(f"  OCR fallback {seconds * 1e3:8.1f} ms/page ({timings[0]['method']}, {len(texts[0])} chars)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+# Query paths before and after the schema migrations (indexes, lowercase
+# columns, amounts in cents).
+#
+#   python -m benchmarks.bench_queries [--rows N] [--repeat N]
+#
+# Builds a throwaway database with the original receipts schema, times the
+# SQL the API used to issue, migrates it in place with run_migrations() and
+# times the same requests through ReceiptQuery.
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import timeit
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.orm import sessionmaker
+
+from backend.algorithms.query import ReceiptQuery
+from backend.data_storage.database import Base, ReceiptDB
+from backend.data_storage.migrations import run_migrations
+
+LEGACY_SCHEMA = [
+    """CREATE TABLE receipts (
+        id INTEGER NOT NULL, vendor VARCHAR, transaction_date DATE, amount FLOAT, category VARCHAR,
+        PRIMARY KEY (id)
+    )""",
+    "CREATE INDEX ix_receipts_vendor ON receipts (vendor)",
+    "CREATE INDEX ix_receipts_transaction_date ON receipts (transaction_date)",
+    "CREATE INDEX ix_receipts_id ON receipts (id)",
+]
+VENDORS = ["FreshFoods Supermarket", "City Power Co", "Shell Station", "Corner Cafe", "Metro Transit",
+           "Aqua Water Board", "FastNet Internet", "Green Grocer", "Pizza Palace", "Urban Outfitters"]
+CATEGORIES = ["Groceries", "Utilities (Electricity)", "Transportation", "Dining", "Transportation",
+              "Utilities (Water)", "Utilities (Internet)", "Groceries", "Dining", "Other"]
+FIRST_DAY = date(2020, 1, 1)
+
+COLUMNS = "id, vendor, transaction_date, amount, category"
+# (name, SQL the original code issued, equivalent ReceiptQuery)
+PATHS = [
+    ("category filter, first page",
+     f"SELECT {COLUMNS} FROM receipts WHERE lower(category) = lower('other') ORDER BY id LIMIT 51",
+     ReceiptQuery(category="Other", limit=50)),
+    ("amount range sorted by amount",
+     f"SELECT {COLUMNS} FROM receipts WHERE amount >= 10 AND amount <= 12 ORDER BY amount, id LIMIT 51",
+     ReceiptQuery(min_amount=10, max_amount=12, sort_by="amount", limit=50)),
+    ("one week, sorted by amount desc",
+     f"SELECT {COLUMNS} FROM receipts WHERE transaction_date >= '2023-03-01' AND transaction_date <= '2023-03-07' "
+     "ORDER BY amount DESC, id DESC LIMIT 51",
+     ReceiptQuery(start_date=date(2023, 3, 1), end_date=date(2023, 3, 7), sort_by="amount", sort_order="desc", limit=50)),
+    ("category sorted by amount",
+     f"SELECT {COLUMNS} FROM receipts WHERE lower(category) = lower('dining') ORDER BY amount, id LIMIT 51",
+     ReceiptQuery(category="dining", sort_by="amount", limit=50)),
+]
+TOTALS_SQL = "SELECT count(id), sum(amount) FROM receipts WHERE lower(category) = lower('groceries')"
+
+
+def build_legacy_database(path: str, rows: int):
+    engine = create_engine(f"sqlite:///{path}")
+    rng = random.Random(rows)
+    with engine.begin() as conn:
+        for ddl in LEGACY_SCHEMA:
+            conn.execute(text(ddl))
+        batch = []
+        for i in range(rows):
+            v = rng.randrange(len(VENDORS))
+            batch.append({"vendor": VENDORS[v], "category": CATEGORIES[v],
+                          "transaction_date": FIRST_DAY + timedelta(days=rng.randrange(1500)),
+                          "amount": round(rng.uniform(1, 500), 2)})
+            if len(batch) == 10000 or i == rows - 1:
+                conn.execute(text("INSERT INTO receipts (vendor, category, transaction_date, amount) "
+                                  "VALUES (:vendor, :category, :transaction_date, :amount)"), batch)
+                batch = []
+    return engine
+
+
+def bench(label: str, func, number: int) -> float:
+    seconds = min(timeit.repeat(func, number=number, repeat=3)) / number
+    print(f"{label:<40} {seconds * 1e3:10.3f} ms")
+    return seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark query paths before and after the migrations.")
+    parser.add_argument("--rows", type=int, default=200000, help="receipts in the synthetic database")
+    parser.add_argument("--repeat", type=int, default=20, help="iterations per measurement")
+    args = parser.parse_args(argv)
+
+    path = os.path.join(tempfile.mkdtemp(prefix="receipt-bench-"), "queries.db")
+    try:
+        engine = build_legacy_database(path, args.rows)
+        print(f"{args.rows} receipts")
+        before = {}
+        with engine.connect() as conn:
+            for name, sql, _ in PATHS:
+                before[name] = bench(f"  before: {name}", lambda: conn.execute(text(sql)).all(), args.repeat)
+            before["category totals"] = bench("  before: category totals", lambda: conn.execute(text(TOTALS_SQL)).one(),
+                                              args.repeat)
+
+        started = time.perf_counter()
+        Base.metadata.create_all(bind=engine)
+        run_migrations(engine)
+        print(f"  migration took {time.perf_counter() - started:.2f}s")
+
+        db = sessionmaker(bind=engine)()
+        for name, _, spec in PATHS:
+            # Same rows as the SQL above; fetch_page() would add building the dicts
+            statement = spec.statement()
+            after = bench(f"  after:  {name}", lambda: db.execute(statement).all(), args.repeat)
+            print(f"  speedup: {before[name] / after:.1f}x")
+        conditions = ReceiptQuery(category="groceries").filter_conditions()
+        totals = select(func.count(ReceiptDB.id), func.sum(ReceiptDB.amount_cents)).where(*conditions)
+        after = bench("  after:  category totals", lambda: db.execute(totals).one(), args.repeat)
+        print(f"  speedup: {before['category totals'] / after:.1f}x")
+        db.close()
+        engine.dispose()
+    finally:
+        os.unlink(path)
+        os.rmdir(os.path.dirname(path))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
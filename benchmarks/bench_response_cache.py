@@ -0,0 +1,74 @@
+# Dashboard reruns with and without the response cache.
+#
+#   python -m benchmarks.bench_response_cache [--rows N] [--reruns N]
+#
+# Replays what one Streamlit rerun asks for (the full receipt list and the
+# aggregates, unfiltered and filtered by category) against one uvicorn
+# worker, first with the cache disabled (RECEIPT_RESPONSE_CACHE_TTL=0), then
+# enabled, then enabled with the client revalidating via If-None-Match.
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.bench_columnar import start_server, stop_server
+from benchmarks.bench_concurrency import prepare_database, percentile
+
+RERUN = [
+    ("/api/receipts/", {}),
+    ("/api/receipts/aggregates/", {}),
+    ("/api/receipts/", {"category": "Groceries"}),
+    ("/api/receipts/aggregates/", {"category": "Groceries"}),
+]
+
+
+def replay(base_url: str, reruns: int, revalidate: bool) -> list:
+    etags = {}
+    timings = []
+    with httpx.Client(base_url=base_url, timeout=600) as client:
+        for _ in range(reruns):
+            started = time.perf_counter()
+            for path, params in RERUN:
+                key = (path, tuple(params.items()))
+                headers = {"If-None-Match": etags[key]} if revalidate and key in etags else {}
+                response = client.get(path, params=params, headers=headers)
+                assert response.status_code in (200, 304), response.text
+                etags[key] = response.headers.get("etag")
+            timings.append(time.perf_counter() - started)
+    return timings[1:] or timings # The first rerun fills the cache
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the list/aggregate response cache.")
+    parser.add_argument("--rows", type=int, default=50000, help="receipts in the database")
+    parser.add_argument("--reruns", type=int, default=20, help="dashboard reruns to replay")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="receipt-bench-")
+    path = os.path.join(workdir, "cache.db")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}", RECEIPT_WORKERS="1", RECEIPT_JOB_WORKERS="0",
+               RECEIPT_SNAPSHOT_INTERVAL="0")
+    process = None
+    try:
+        prepare_database(env, path, args.rows)
+        print(f"{args.rows} receipts, {args.reruns} reruns of {len(RERUN)} requests")
+        for name, ttl, revalidate in [("no cache", "0", False), ("cache", "60", False),
+                                      ("cache + If-None-Match", "60", True)]:
+            base_url, process = start_server(dict(env, RECEIPT_RESPONSE_CACHE_TTL=ttl))
+            timings = replay(base_url, args.reruns, revalidate)
+            stop_server(process)
+            process = None
+            print(f"  {name:<22} p50 {percentile(timings, 0.5) * 1e3:8.1f} ms  p95 {percentile(timings, 0.95) * 1e3:8.1f} ms"
+                  " per rerun")
+    finally:
+        if process is not None:
+            stop_server(process)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
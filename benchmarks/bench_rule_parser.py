@@ -0,0 +1,174 @@
+# Micro-benchmark: compiled rule parser vs. the original implementation.
+#
+#   python -m benchmarks.bench_rule_parser [--repeat N]
+#
+# The original parse_receipt_data is kept below verbatim as the reference; the
+# script checks both return identical results before timing them.
+import argparse
+import random
+import re
+import sys
+import timeit
+from datetime import datetime
+
+from backend.data_parsing.rule_parser import parse_receipt_data, parse_many
+from backend.data_parsing.rules import RuleTable
+
+
+def legacy_parse_receipt_data(text: str) -> dict:
+    vendor = "Unknown Vendor"
+    transaction_date = None
+    amount = 0.0
+    category = None
+
+    # Example: Simple regex for vendor (very basic, needs refinement)
+    vendor_patterns = [
+        r"(?:Vendor|Store|Shop):\s*([A-Za-z0-9\s]+)",
+        r"([A-Za-z\s]+)(?:\s+Supermarket|\s+Groceries|\s+Store)",
+        r"Invoice from\s*([A-Za-z0-9\s]+)"
+    ]
+    for pattern in vendor_patterns:
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            vendor = match.group(1).strip()
+            break
+
+    # Example: Date parsing (flexible patterns)
+    date_patterns = [
+        r"\d{1,2}/\d{1,2}/\d{2,4}",  # DD/MM/YYYY or DD/MM/YY
+        r"\d{1,2}-\d{1,2}-\d{2,4}",  # DD-MM-YYYY or DD-MM-YY
+        r"\d{4}-\d{2}-\d{2}",        # YYYY-MM-DD
+        r"(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{1,2},\s+\d{4}" # Month Day, Year
+    ]
+    for pattern in date_patterns:
+        match = re.search(pattern, text)
+        if match:
+            try:
+                date_str = match.group(0)
+                if '/' in date_str:
+                    transaction_date = datetime.strptime(date_str, '%d/%m/%Y').date()
+                elif re.match(r"\d{4}-\d{2}-\d{2}", date_str):
+                    transaction_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+                elif re.match(r"\d{1,2}-\d{1,2}-\d{2,4}", date_str):
+                    # Try a few common formats for DD-MM-YY/YYYY
+                    try:
+                        transaction_date = datetime.strptime(date_str, '%d-%m-%Y').date()
+                    except ValueError:
+                        transaction_date = datetime.strptime(date_str, '%d-%m-%y').date()
+                elif re.match(r"(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)", date_str, re.IGNORECASE):
+                    # Attempt different year formats for "Month Day, Year"
+                    try:
+                        transaction_date = datetime.strptime(date_str, '%b %d, %Y').date()
+                    except ValueError:
+                        transaction_date = datetime.strptime(date_str, '%B %d, %Y').date()
+                break
+            except ValueError:
+                continue
+
+    # Example: Amount parsing (look for "Total", "Amount Due", etc.)
+    amount_patterns = [
+        r"(?:Total|Amount Due|Balance|Sum):\s*[$€£]?\s*(\d+(?:[.,]\d{2})?)",
+        r"[$€£]?\s*(\d+(?:[.,]\d{2}?))\s*(?:Total|Amount Due|Balance|Sum)",
+        r"(\d+(?:[.,]\d{2}?))\s*(?:USD|EUR|GBP)"
+    ]
+    for pattern in amount_patterns:
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            try:
+                amount = float(match.group(1).replace(',', '.')) # Handle comma as decimal
+                break
+            except ValueError:
+                continue
+
+    # Optional: Basic category mapping
+    if "grocery" in text.lower() or "supermarket" in text.lower() or "food" in text.lower():
+        category = "Groceries"
+    elif "electricity" in text.lower() or "power bill" in text.lower():
+        category = "Utilities (Electricity)"
+    elif "internet" in text.lower() or "broadband" in text.lower():
+        category = "Utilities (Internet)"
+    elif "water" in text.lower() or "utility" in text.lower():
+        category = "Utilities (Water)"
+    elif "restaurant" in text.lower() or "cafe" in text.lower():
+        category = "Dining"
+    elif "transport" in text.lower() or "fuel" in text.lower() or "petrol" in text.lower():
+        category = "Transportation"
+
+
+    return {
+        "vendor": vendor,
+        "transaction_date": transaction_date,
+        "amount": amount,
+        "category": category
+    }
+
+
+SHORT_RECEIPT = (
+    "FreshFoods Supermarket\nStore: FreshFoods Supermarket\nDate: 12/07/2024\n"
+    "Milk 2.49\nBread 1.99\nTotal: $15.83\nThank you for shopping!\n"
+)
+LINE_ITEM = "Item {0:05d}  Metered usage charge, period {1}  {2}.{3:02d}\n"
+
+
+def long_statement(pages: int = 40, lines_per_page: int = 100) -> str:
+    # Shaped like a multi-page utility bill: a header, many line items, a total.
+    rng = random.Random(42)
+    lines = ["Invoice from City Power Co\nAccount 448812\nDate: 05-03-2024\n"]
+    for i in range(pages * lines_per_page):
+        lines.append(LINE_ITEM.format(i, rng.randint(1, 12), rng.randint(1, 500), rng.randint(0, 99)))
+    lines.append("Amount Due: 1234.50\nelectricity\n")
+    return "".join(lines)
+
+
+def same_fields(new: dict, old: dict) -> bool:
+    return all(new[key] == old[key] for key in old)
+
+
+def synthetic_rules(count: int) -> dict:
+    rng = random.Random(count)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    categories = []
+    for i in range(0, count, 5):
+        keywords = ["".join(rng.choice(letters) for _ in range(rng.randint(5, 12))) for _ in range(5)]
+        categories.append({"category": f"Category {i // 5}", "keywords": keywords})
+    return {"vendors": {}, "categories": categories}
+
+
+def bench(label: str, func, number: int) -> float:
+    seconds = min(timeit.repeat(func, number=number, repeat=3)) / number
+    print(f"{label:<40} {seconds * 1e3:10.3f} ms")
+    return seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the receipt rule parser.")
+    parser.add_argument("--repeat", type=int, default=20, help="iterations per measurement")
+    args = parser.parse_args(argv)
+
+    corpus = {"short receipt": SHORT_RECEIPT, "40-page statement": long_statement()}
+    for name, text in corpus.items():
+        assert same_fields(parse_receipt_data(text), legacy_parse_receipt_data(text)), name
+        number = args.repeat * (100 if len(text) < 1000 else 1)
+        print(f"{name} ({len(text)} chars)")
+        old = bench("  legacy parse_receipt_data", lambda: legacy_parse_receipt_data(text), number)
+        new = bench("  compiled parse_receipt_data", lambda: parse_receipt_data(text), number)
+        print(f"  speedup: {old / new:.1f}x")
+
+    texts = [SHORT_RECEIPT] * 1000
+    print("batch of 1000 short receipts")
+    old = bench("  legacy, one call per text", lambda: [legacy_parse_receipt_data(t) for t in texts], args.repeat)
+    new = bench("  parse_many", lambda: parse_many(texts), args.repeat)
+    print(f"  speedup: {old / new:.1f}x")
+
+    # Category matching should stay flat as the rule table grows
+    lowered = long_statement().lower()
+    print("category rules on the 40-page statement")
+    for count in (10, 100, 500, 2000):
+        table = RuleTable(synthetic_rules(count))
+        keywords = list(table.keyword_rules)
+        bench(f"  {count:>5} rules, rule table", lambda: table.match(lowered), args.repeat)
+        bench(f"  {count:>5} rules, 'in' per keyword", lambda: [k in lowered for k in keywords], args.repeat)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
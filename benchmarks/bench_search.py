@@ -0,0 +1,93 @@
+# Search latency: FTS5 index vs. the LIKE '%x%' scan it replaced.
+#
+#   python -m benchmarks.bench_search [--rows N] [--repeat N]
+#
+# Builds a throwaway SQLite database of synthetic receipts (vendor, category
+# and a few lines of receipt text), then times one dashboard page (50 rows)
+# for a few typical search box inputs.
+import argparse
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from backend.algorithms.query import ReceiptQuery
+from backend.data_storage import fulltext
+from backend.data_storage.database import Base, ReceiptDB
+
+VENDORS = ["FreshFoods Supermarket", "City Power Co", "Shell Station", "Corner Cafe", "Metro Transit",
+           "Aqua Water Board", "FastNet Internet", "Green Grocer", "Pizza Palace", "Urban Outfitters"]
+CATEGORIES = ["Groceries", "Utilities (Electricity)", "Transportation", "Dining", "Transportation",
+              "Utilities (Water)", "Utilities (Internet)", "Groceries", "Dining", "Other"]
+ITEMS = ["milk", "bread", "unleaded fuel", "cappuccino", "croissant", "monthly pass", "kwh usage",
+         "broadband plan", "apples", "margherita", "denim jacket", "service fee", "bottle deposit"]
+
+
+def build_database(path: str, rows: int):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine, tables=[ReceiptDB.__table__])
+    rng = random.Random(rows)
+    batch = []
+    with engine.begin() as conn:
+        for i in range(rows):
+            v = rng.randrange(len(VENDORS))
+            items = "\n".join(f"{rng.choice(ITEMS)} {rng.randint(1, 99)}.{rng.randint(0, 99):02d}" for _ in range(5))
+            batch.append({"vendor": VENDORS[v], "category": CATEGORIES[v], "amount_cents": rng.randint(100, 50000),
+                          "raw_text": f"{VENDORS[v]}\nStore #{rng.randint(1, 9999)}\n{items}\n"})
+            if len(batch) == 10000:
+                conn.execute(insert(ReceiptDB.__table__), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(ReceiptDB.__table__), batch)
+    # Created after the load so the index is built in one 'rebuild' pass
+    assert fulltext.ensure_fulltext(engine), "this SQLite build has no FTS5"
+    return engine
+
+
+def like_page(db, query: str):
+    condition = (
+        (func.lower(ReceiptDB.vendor).contains(func.lower(query))) |
+        (func.lower(ReceiptDB.category).contains(func.lower(query)))
+    )
+    return db.execute(select(ReceiptDB.id, ReceiptDB.vendor).where(condition).order_by(ReceiptDB.id).limit(50)).all()
+
+
+def bench(label: str, func, number: int) -> float:
+    seconds = min(timeit.repeat(func, number=number, repeat=3)) / number
+    print(f"{label:<40} {seconds * 1e3:10.3f} ms")
+    return seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark receipt search.")
+    parser.add_argument("--rows", type=int, default=200000, help="receipts in the synthetic database")
+    parser.add_argument("--repeat", type=int, default=20, help="iterations per measurement")
+    args = parser.parse_args(argv)
+
+    path = os.path.join(tempfile.mkdtemp(prefix="receipt-bench-"), "search.db")
+    try:
+        engine = build_database(path, args.rows)
+        db = sessionmaker(bind=engine)()
+        print(f"{args.rows} receipts")
+        for query in ["pizza", "cor", "fresh sup", "croissant"]:
+            print(f"query {query!r}")
+            if " " not in query:
+                # The old search only looked at vendor/category substrings
+                bench("  LIKE scan, first page", lambda: like_page(db, query), args.repeat)
+            spec = ReceiptQuery(query=query, limit=50, fields="id,vendor")
+            bench("  FTS5, first page", lambda: spec.fetch_page(db), args.repeat)
+            ranked = ReceiptQuery(query=query, limit=50, fields="id,vendor", sort_by="relevance")
+            bench("  FTS5 ranked, first page", lambda: ranked.fetch_page(db), args.repeat)
+        db.close()
+        engine.dispose()
+    finally:
+        os.unlink(path)
+        os.rmdir(os.path.dirname(path))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
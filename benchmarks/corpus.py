@@ -0,0 +1,236 @@
+# Synthetic receipt corpus and database fixtures for the benchmarks.
+#
+#   python -m benchmarks.corpus --out DIR [--files N] [--rows 10k,1m] [--seed N]
+#
+# Everything is generated from a seed, so two runs (or two commits) see the
+# same bytes. Receipts come as plain text in the layouts the rule parser
+# handles, rendered to PNG (a scanned/photographed receipt) and to PDF (one
+# or several pages), with the fields they should parse to. Database fixtures
+# are SQLite files of N receipts at the current schema, with raw text for
+# the full-text index and summary tables filled in; they are cached by row
+# count and seed because the large ones take minutes to build.
+import argparse
+import io
+import json
+import os
+import random
+import sys
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, Tuple
+
+import fitz
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from sqlalchemy.orm import sessionmaker
+
+from backend.data_storage import fulltext
+from backend.data_storage.database import Base, build_engine
+from backend.data_storage.migrations import run_migrations
+from backend.data_storage.summary import apply_bulk_insert, ensure_summaries
+from benchmarks.bench_search import CATEGORIES, ITEMS, VENDORS
+
+# Bump when the fixture contents change so cached files are rebuilt.
+FIXTURE_VERSION = 1
+FIXTURE_COMMIT_ROWS = 500000
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+
+def parse_count(value: str) -> int:
+    # "10k" / "1m" / "10M" / "2500"
+    value = value.strip().lower()
+    scale = {"k": 1000, "m": 1000000}.get(value[-1:], 1)
+    return int(float(value[:-1] if scale > 1 else value) * scale)
+
+
+def _date_line(rng: random.Random, day: date) -> str:
+    # The formats the parser recognizes, in rough proportion to real receipts
+    style = rng.randrange(4)
+    if style == 0:
+        return f"Date: {day.day:02d}/{day.month:02d}/{day.year}"
+    if style == 1:
+        return f"Date: {day.isoformat()}"
+    if style == 2:
+        return f"Date: {day.day:02d}-{day.month:02d}-{day.year}"
+    return f"{MONTHS[day.month - 1]} {day.day}, {day.year}"
+
+
+def receipt_text(rng: random.Random, items: int = 8) -> Tuple[str, Dict]:
+    # One receipt and the fields it should parse to
+    v = rng.randrange(len(VENDORS))
+    day = date(2022, 1, 1) + timedelta(days=rng.randrange(1000))
+    prices = [rng.randint(50, 5000) for _ in range(items)]
+    total = sum(prices)
+    header = rng.choice([f"Store: {VENDORS[v]}", f"Invoice from {VENDORS[v]}", f"Vendor: {VENDORS[v]}"])
+    lines = [VENDORS[v], header, f"Store #{rng.randint(1, 9999)}", _date_line(rng, day), ""]
+    lines += [f"{rng.choice(ITEMS):<24}{cents // 100:>6}.{cents % 100:02d}" for cents in prices]
+    lines += ["", f"Total: ${total // 100}.{total % 100:02d}", CATEGORIES[v].lower(), "Thank you!"]
+    expected = {"vendor": VENDORS[v], "transaction_date": day.isoformat(), "amount": total / 100}
+    return "\n".join(lines) + "\n", expected
+
+
+def statement_text(rng: random.Random, pages: int, lines_per_page: int = 60) -> Tuple[str, Dict]:
+    # A multi-page bill: header, many line items, the total at the end
+    day = date(2022, 1, 1) + timedelta(days=rng.randrange(1000))
+    lines = ["Invoice from City Power Co", f"Account {rng.randint(100000, 999999)}", _date_line(rng, day), ""]
+    total = 0
+    for i in range(pages * lines_per_page):
+        cents = rng.randint(1, 50000)
+        total += cents
+        lines.append(f"Item {i:05d}  Metered usage charge, period {rng.randint(1, 12)}  {cents // 100}.{cents % 100:02d}")
+    lines += ["", f"Amount Due: {total // 100}.{total % 100:02d}", "electricity"]
+    expected = {"vendor": "City Power Co", "transaction_date": day.isoformat(), "amount": total / 100}
+    return "\n".join(lines) + "\n", expected
+
+
+def render_png(text: str, width: int = 1240) -> bytes:
+    # Black text on white at roughly 150 dpi for an 8 cm wide receipt scaled
+    # up to width pixels, like a photo or scan of one.
+    lines = text.splitlines()
+    font_size = max(12, width // 40)
+    font = ImageFont.load_default(size=font_size)
+    line_height = int(font_size * 1.4)
+    image = Image.new("L", (width, line_height * (len(lines) + 4)), 255)
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(lines):
+        draw.text((font_size * 2, line_height * (i + 2)), line, fill=0, font=font)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def render_photo(text: str, rng: random.Random, width: int = 3024, max_skew: float = 3.0) -> Tuple[bytes, float]:
+    # A phone photo of the receipt: a 4:3 JPEG (12 MP at the default width)
+    # with the receipt filling ~60% of the frame, tilted by up to max_skew
+    # degrees, on a darker background under uneven light, with sensor noise.
+    # Returns the JPEG and the tilt (counter-clockwise degrees).
+    receipt = Image.open(io.BytesIO(render_png(text, int(width * 0.6))))
+    angle = rng.uniform(-max_skew, max_skew)
+    mask = Image.new("L", receipt.size, 255).rotate(angle, expand=True)
+    receipt = receipt.rotate(angle, resample=Image.BICUBIC, expand=True)
+    height = max(width * 4 // 3, receipt.height + width // 10)
+    frame = Image.new("L", (width, height), 90)
+    frame.paste(receipt, ((width - receipt.width) // 2, (height - receipt.height) // 2), mask)
+    pixels = np.asarray(frame, dtype=np.float32)
+    light = np.linspace(0.7, 1.05, width, dtype=np.float32)[None, :] # Brighter towards the window
+    noise = np.random.default_rng(rng.randrange(2 ** 32)).normal(0, 6, pixels.shape).astype(np.float32)
+    photo = Image.fromarray(np.clip(pixels * light + noise, 0, 255).astype(np.uint8)).convert("RGB")
+    buffer = io.BytesIO()
+    photo.save(buffer, format="JPEG", quality=90, dpi=(72, 72))
+    return buffer.getvalue(), angle
+
+
+def render_pdf(text: str, lines_per_page: int = 60) -> bytes:
+    # A text layer (not an image) on as many A4 pages as the text needs
+    lines = text.splitlines()
+    document = fitz.open()
+    for start in range(0, max(len(lines), 1), lines_per_page):
+        page = document.new_page()
+        page.insert_text((50, 60), "\n".join(lines[start:start + lines_per_page]), fontsize=9)
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+def generate_files(count: int, seed: int = 0, image_width: int = 1240) -> List[Dict]:
+    # count receipts of each kind: text, PNG, one-page PDF, and a tenth as
+    # many (at least one) 20-page PDF statements
+    rng = random.Random(seed)
+    files = []
+    for i in range(count):
+        text, expected = receipt_text(rng)
+        files.append({"name": f"receipt-{i:05d}.txt", "file_type": "text/plain", "content": text.encode(),
+                      "expected": expected})
+        text, expected = receipt_text(rng)
+        files.append({"name": f"receipt-{i:05d}.png", "file_type": "image/png",
+                      "content": render_png(text, image_width), "expected": expected})
+        text, expected = receipt_text(rng)
+        files.append({"name": f"receipt-{i:05d}.pdf", "file_type": "application/pdf", "content": render_pdf(text),
+                      "expected": expected})
+    for i in range(max(1, count // 10)):
+        text, expected = statement_text(rng, pages=20)
+        files.append({"name": f"statement-{i:05d}.pdf", "file_type": "application/pdf",
+                      "content": render_pdf(text), "expected": expected})
+    return files
+
+
+def write_files(files: List[Dict], out_dir: str):
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = []
+    for f in files:
+        with open(os.path.join(out_dir, f["name"]), "wb") as out:
+            out.write(f["content"])
+        manifest.append({"name": f["name"], "file_type": f["file_type"], "expected": f["expected"]})
+    with open(os.path.join(out_dir, "manifest.json"), "w") as out:
+        json.dump(manifest, out, indent=2)
+
+
+def fixture_rows(rows: int, seed: int = 0) -> Iterator[tuple]:
+    # (vendor, transaction_date, amount_cents, category, raw_text) tuples
+    rng = random.Random(f"{seed}:{rows}")
+    for _ in range(rows):
+        v = rng.randrange(len(VENDORS))
+        items = "\n".join(f"{rng.choice(ITEMS)} {rng.randint(1, 99)}.{rng.randint(0, 99):02d}" for _ in range(5))
+        yield (VENDORS[v], (date(2020, 1, 1) + timedelta(days=rng.randrange(2000))).isoformat(),
+               rng.randint(100, 50000), CATEGORIES[v], f"{VENDORS[v]}\nStore #{rng.randint(1, 9999)}\n{items}\n")
+
+
+def build_fixture(path: str, rows: int, seed: int = 0):
+    # Same schema as init_db() creates; rows go in with one executemany per
+    # transaction and the search index/summaries updated once per transaction,
+    # like a bulk import (see bulk_import.py).
+    engine = build_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine, fresh=True)
+    fulltext.ensure_fulltext(engine)
+    with sessionmaker(bind=engine)() as db:
+        ensure_summaries(db)
+    source = fixture_rows(rows, seed)
+    remaining = rows
+    with engine.connect() as connection:
+        while remaining:
+            batch = [row for _, row in zip(range(min(remaining, FIXTURE_COMMIT_ROWS)), source)]
+            remaining -= len(batch)
+            with connection.begin():
+                last_id = fulltext.suspend_insert_trigger(connection)
+                connection.exec_driver_sql(
+                    "INSERT INTO receipts (vendor, transaction_date, amount_cents, category, raw_text) "
+                    "VALUES (?, ?, ?, ?, ?)", batch
+                )
+                fulltext.resume_insert_trigger(connection, last_id)
+                apply_bulk_insert(connection, ({"vendor": r[0], "transaction_date": date.fromisoformat(r[1]),
+                                                "amount": r[2] / 100} for r in batch))
+    engine.dispose()
+
+
+def fixture(fixture_dir: str, rows: int, seed: int = 0) -> str:
+    # Path of the cached fixture for (rows, seed), built on first use
+    os.makedirs(fixture_dir, exist_ok=True)
+    path = os.path.join(fixture_dir, f"receipts-{rows}-seed{seed}-v{FIXTURE_VERSION}.db")
+    if not os.path.exists(path):
+        temporary = f"{path}.{os.getpid()}.tmp"
+        build_fixture(temporary, rows, seed)
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(temporary + suffix):
+                os.remove(temporary + suffix)
+        os.replace(temporary, path)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the synthetic receipt corpus and database fixtures.")
+    parser.add_argument("--out", required=True, help="directory for the files and fixtures")
+    parser.add_argument("--files", type=int, default=50, help="receipts of each kind (text, PNG, PDF)")
+    parser.add_argument("--rows", default="", help="comma-separated fixture sizes, e.g. 10k,1m,10m")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--image-width", type=int, default=1240, help="PNG width in pixels")
+    args = parser.parse_args(argv)
+
+    files = generate_files(args.files, args.seed, args.image_width)
+    write_files(files, os.path.join(args.out, "files"))
+    print(f"{len(files)} files in {os.path.join(args.out, 'files')}")
+    for rows in (parse_count(r) for r in args.rows.split(",") if r):
+        print(f"fixture {fixture(os.path.join(args.out, 'fixtures'), rows, args.seed)}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
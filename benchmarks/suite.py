@@ -0,0 +1,333 @@
+# End-to-end benchmark suite with machine-readable results.
+#
+#   python -m benchmarks.suite [--rows 10k,1m,10m] [--files N] [--repeat N]
+#                              [--stages decode,extract,...] [--output results.json]
+#                              [--compare baseline.json] [--threshold 0.25]
+#
+# Times every stage a receipt goes through, on the synthetic corpus from
+# benchmarks/corpus.py (same seed, same bytes on every run):
+#   decode     base64 decode + SHA-256 of each upload (decode_and_hash)
+#   extract    extract_text_from_file per file type (images need Tesseract)
+#   parse      parse_receipt_data on receipts and on long statements
+#   insert     store_receipt + commit per receipt, and bulk import_records
+#   search     search_receipts and one full-text results page
+#   sort       sort_receipts and one sorted dashboard page
+#   aggregate  calculate_aggregates from the summaries, exact, and filtered
+#   export     export_stream consumed to the end (CSV, NDJSON)
+# The database stages run once per fixture size (--rows), each in a child
+# process whose DATABASE_URL points at the fixture, since the app's engines
+# are configured at import. Cases that load every row as ORM objects are
+# skipped above --full-result-max rows.
+#
+# Results go to --output as JSON (commit, machine, and one record per stage,
+# case and fixture size with min/median seconds per call). --compare matches them
+# against an earlier results file and exits with status 1 if any case got
+# slower than --threshold, so two commits can be compared with:
+#   git checkout A && python -m benchmarks.suite --output a.json
+#   git checkout B && python -m benchmarks.suite --compare a.json
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import sessionmaker
+
+from backend.data_ingestion.bulk_import import import_records
+from backend.data_ingestion.file_handler import extract_text_from_file
+from backend.data_ingestion.pipeline import build_receipt_data, decode_and_hash, store_receipt
+from backend.data_parsing.rule_parser import parse_receipt_data
+from benchmarks.bench_import import fresh_database
+from benchmarks.corpus import fixture, fixture_rows, generate_files, parse_count, statement_text
+
+STAGES = ["decode", "extract", "parse", "insert", "search", "sort", "aggregate", "export"]
+DATABASE_STAGES = ["search", "sort", "aggregate", "export"]
+SUITE_VERSION = 1
+MIN_RUN_SECONDS = 0.2
+
+
+def _time(func, number: int) -> float:
+    started = time.perf_counter()
+    for _ in range(number):
+        func()
+    return time.perf_counter() - started
+
+
+def measure(stage: str, case: str, func, repeat: int, items: int = 1, rows: Optional[int] = None,
+            autorange: bool = True) -> Dict:
+    # Seconds per call of func. Cheap cases are called several times per run
+    # (like timeit's autorange, with the calibration doubling as a warm-up)
+    # so each run lasts at least MIN_RUN_SECONDS and timer noise stays small.
+    number = 1
+    while autorange and number < 1000000:
+        if _time(func, number) >= MIN_RUN_SECONDS:
+            break
+        number *= 10
+    timings = [_time(func, number) / number for _ in range(max(1, repeat))]
+    median = statistics.median(timings)
+    return {"stage": stage, "case": case, "rows": rows, "items": items, "runs": len(timings), "calls_per_run": number,
+            "min_s": min(timings), "median_s": median, "per_item_s": median / items}
+
+
+def skipped(stage: str, case: str, reason: str, rows: Optional[int] = None) -> Dict:
+    return {"stage": stage, "case": case, "rows": rows, "skipped": reason}
+
+
+def tesseract_missing() -> Optional[str]:
+    try:
+        import pytesseract
+        pytesseract.get_tesseract_version()
+    except Exception as e:
+        return f"Tesseract not available: {e}"
+    return None
+
+
+def file_stages(stages: List[str], files: List[Dict], repeat: int) -> List[Dict]:
+    results = []
+    kinds = {"text": [f for f in files if f["file_type"] == "text/plain"],
+             "png": [f for f in files if f["file_type"] == "image/png"],
+             "pdf": [f for f in files if f["name"].startswith("receipt-") and f["file_type"] == "application/pdf"],
+             "pdf 20 pages": [f for f in files if f["name"].startswith("statement-")]}
+    if "decode" in stages:
+        for kind, group in kinds.items():
+            encoded = [base64.b64encode(f["content"]).decode() for f in group]
+            results.append(measure("decode", kind, lambda: [decode_and_hash(e) for e in encoded], repeat, len(group)))
+    if "extract" in stages:
+        for kind, group in kinds.items():
+            reason = tesseract_missing() if kind == "png" else None
+            if reason:
+                results.append(skipped("extract", kind, reason))
+                continue
+            results.append(measure("extract", kind,
+                                   lambda: [extract_text_from_file(f["content"], f["file_type"]) for f in group],
+                                   repeat, len(group)))
+    if "parse" in stages:
+        texts = [f["content"].decode() for f in kinds["text"]]
+        statements = [statement_text(random.Random(i), pages=20)[0] for i in range(len(kinds["pdf 20 pages"]))]
+        results.append(measure("parse", "receipt", lambda: [parse_receipt_data(t) for t in texts], repeat, len(texts)))
+        results.append(measure("parse", "statement 20 pages", lambda: [parse_receipt_data(t) for t in statements],
+                               repeat, len(statements)))
+    return results
+
+
+def insert_stage(workdir: str, files: List[Dict], insert_rows: int, repeat: int) -> List[Dict]:
+    # Into a fresh database each run (created outside the timing), through the
+    # upload path (one ORM object and commit per receipt) and bulk import
+    receipts = [(build_receipt_data(parse_receipt_data(f["content"].decode())), f["content"].decode())
+                for f in files if f["file_type"] == "text/plain"]
+    engines = [fresh_database(os.path.join(workdir, f"insert-{i}.db")) for i in range(2 * max(1, repeat))]
+    unused = list(engines)
+
+    def upload_path():
+        with sessionmaker(bind=unused.pop())() as db:
+            for validated, text in receipts:
+                store_receipt(db, validated, None, raw_text=text)
+                db.commit()
+
+    def bulk_path():
+        stats = import_records((records(r) for r in fixture_rows(insert_rows)), bind=unused.pop())
+        assert stats["imported"] == insert_rows, stats
+
+    def records(row):
+        return {"vendor": row[0], "transaction_date": row[1], "amount": row[2] / 100, "category": row[3]}, None
+
+    try:
+        # Each run needs its own empty database, so no autorange here
+        results = [measure("insert", "store_receipt, commit each", upload_path, repeat, len(receipts), autorange=False),
+                   measure("insert", "bulk import_records", bulk_path, repeat, insert_rows, autorange=False)]
+    finally:
+        for engine in engines:
+            engine.dispose()
+    return results
+
+
+def database_stages(stages: List[str], rows: int, repeat: int, full_result_max: int) -> List[Dict]:
+    # Runs in the child process, where DATABASE_URL is the fixture. The
+    # imports are here so the parent never opens the configured database.
+    from backend.algorithms.aggregate import calculate_aggregates
+    from backend.algorithms.query import ReceiptQuery
+    from backend.algorithms.search import search_receipts
+    from backend.algorithms.sort import sort_receipts
+    from backend.data_storage.database import SessionLocal, init_db
+    from backend.data_storage.export import export_stream
+
+    init_db()
+    results = []
+    full = rows <= full_result_max
+    too_big = f"more than --full-result-max={full_result_max} rows"
+
+    def run(stage, case, func, items=1, needs_full=False):
+        if needs_full and not full:
+            results.append(skipped(stage, case, too_big, rows))
+            return
+        with SessionLocal() as db:
+            results.append(measure(stage, case, lambda: func(db), repeat, items, rows))
+
+    if "search" in stages:
+        run("search", "search_receipts 'pizza'", lambda db: search_receipts(db, query="pizza"), needs_full=True)
+        run("search", "search_receipts 'store 4821'", lambda db: search_receipts(db, query="4821"))
+        run("search", "page of 50 'pizza' by date", lambda db: ReceiptQuery(
+            query="pizza", sort_by="date", limit=50).fetch_page(db))
+    if "sort" in stages:
+        run("sort", "sort_receipts amount desc", lambda db: sort_receipts(db, "amount", "desc"), needs_full=True)
+        run("sort", "page of 50 by amount desc", lambda db: ReceiptQuery(
+            sort_by="amount", sort_order="desc", limit=50).fetch_page(db))
+        run("sort", "page of 50 by vendor, category filter", lambda db: ReceiptQuery(
+            sort_by="vendor", category="Dining", limit=50).fetch_page(db))
+    if "aggregate" in stages:
+        run("aggregate", "summaries", lambda db: calculate_aggregates(db))
+        run("aggregate", "exact", lambda db: calculate_aggregates(db, exact=True))
+        run("aggregate", "filtered by category and date", lambda db: calculate_aggregates(
+            db, conditions=ReceiptQuery(category="Groceries", start_date=date(2021, 1, 1)).filter_conditions()))
+    if "export" in stages:
+        async def consume(format):
+            async for _ in export_stream(ReceiptQuery(), format):
+                pass
+        for format in ("csv", "ndjson"):
+            results.append(measure("export", format, lambda: asyncio.run(consume(format)), repeat, rows, rows,
+                                   autorange=rows < 100000))
+    return results
+
+
+def run_database_stages(path: str, rows: int, args, workdir: str) -> List[Dict]:
+    results_file = os.path.join(workdir, f"results-{rows}.json")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}", RECEIPT_SNAPSHOT_INTERVAL="0",
+               RECEIPT_SNAPSHOT_PATH=os.path.join(workdir, "no-snapshot.arrow"))
+    command = [sys.executable, "-m", "benchmarks.suite", "--child-database", path, "--child-rows", str(rows),
+               "--child-results", results_file, "--stages", ",".join(args.stages), "--repeat", str(args.repeat),
+               "--full-result-max", str(args.full_result_max)]
+    subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+    with open(results_file) as f:
+        return json.load(f)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                               text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-dirty" if dirty else commit
+
+
+def result_key(result: Dict) -> tuple:
+    return result["stage"], result["case"], result["rows"]
+
+
+def compare(results: List[Dict], baseline: List[Dict], threshold: float) -> int:
+    # Prints old/new times side by side; returns the number of regressions.
+    # Compares the fastest run of each, the figure least affected by noise.
+    old = {result_key(r): r for r in baseline if "min_s" in r}
+    regressions = 0
+    print(f"\n{'stage':<10} {'case':<40} {'rows':>9} {'before':>10} {'after':>10} {'ratio':>7}")
+    for result in results:
+        before = old.get(result_key(result))
+        if before is None or "min_s" not in result:
+            continue
+        ratio = result["min_s"] / before["min_s"] if before["min_s"] else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif ratio < 1 / (1 + threshold):
+            flag = "  faster"
+        print(f"{result['stage']:<10} {result['case']:<40} {result['rows'] or '':>9} "
+              f"{before['min_s'] * 1e3:>8.2f}ms {result['min_s'] * 1e3:>8.2f}ms {ratio:>6.2f}x{flag}")
+    return regressions
+
+
+def print_result(result: Dict):
+    rows = result["rows"] or ""
+    if "skipped" in result:
+        print(f"{result['stage']:<10} {result['case']:<40} {rows:>9}  skipped: {result['skipped']}")
+        return
+    print(f"{result['stage']:<10} {result['case']:<40} {rows:>9} {result['median_s'] * 1e3:>10.2f}ms "
+          f"{result['per_item_s'] * 1e6:>12.1f}us/item")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the benchmark suite.")
+    parser.add_argument("--rows", default="10k", help="comma-separated fixture sizes, e.g. 10k,1m,10m")
+    parser.add_argument("--files", type=int, default=20, help="corpus receipts of each kind")
+    parser.add_argument("--insert-rows", type=int, default=100000, help="rows for the bulk insert case")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case (median and min are reported)")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma-separated subset of: " + ",".join(STAGES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fixture-dir", default=os.path.join(tempfile.gettempdir(), "receipt-bench-fixtures"),
+                        help="where database fixtures are cached between runs")
+    parser.add_argument("--full-result-max", type=int, default=100000,
+                        help="largest fixture for cases that load every matching row")
+    parser.add_argument("--output", default=None, help="write results as JSON to this file")
+    parser.add_argument("--compare", default=None, help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="slowdown that counts as a regression")
+    parser.add_argument("--child-database", help=argparse.SUPPRESS)
+    parser.add_argument("--child-rows", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--child-results", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    args.stages = [s for s in args.stages.split(",") if s]
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    if args.child_database:
+        results = database_stages(args.stages, args.child_rows, args.repeat, args.full_result_max)
+        with open(args.child_results, "w") as f:
+            json.dump(results, f)
+        return 0
+
+    workdir = tempfile.mkdtemp(prefix="receipt-bench-")
+    results: List[Dict] = []
+    try:
+        files = generate_files(args.files, args.seed)
+        results += file_stages(args.stages, files, args.repeat)
+        for result in results:
+            print_result(result)
+        if "insert" in args.stages:
+            for result in insert_stage(workdir, files, args.insert_rows, args.repeat):
+                print_result(result)
+                results.append(result)
+        if set(args.stages) & set(DATABASE_STAGES):
+            for rows in (parse_count(r) for r in args.rows.split(",") if r):
+                path = fixture(args.fixture_dir, rows, args.seed)
+                for result in run_database_stages(path, rows, args, workdir):
+                    print_result(result)
+                    results.append(result)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "suite_version": SUITE_VERSION,
+        "commit": git_commit(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": {"rows": args.rows, "files": args.files, "insert_rows": args.insert_rows, "repeat": args.repeat,
+                 "seed": args.seed, "stages": args.stages},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f)["results"], args.threshold)
+        if regressions:
+            print(f"{regressions} case(s) slower than the baseline by more than {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,40 +3,85 @@ import streamlit as st
 import requests
 import pandas as pd
 import json
-import base64
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
+from requests.adapters import HTTPAdapter
 
 # Backend API URL (adjust if your backend is on a different port/host)
 BACKEND_URL = "http://localhost:8000/api"
+# Seconds a fetched page/aggregates result is reused across reruns. Uploads
+# and edits made here clear it at once; this bounds staleness for changes
+# made elsewhere (other users, jobs, imports).
+CACHE_TTL = 30
+PAGE_SIZES = [50, 100, 250, 500, 1000] # The API returns at most 1000 rows per page
 
 st.set_page_config(layout="wide", page_title="Receipt Dashboard")
 st.title("Receipt and Bill Processing Dashboard")
 
+
+class BackendError(Exception):
+    pass
+
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    # One pooled session per server process: reruns and users reuse its
+    # keep-alive connections instead of opening a new one per request.
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_json(path, params):
+    response = get_session().get(f"{BACKEND_URL}{path}", params=params)
+    if response.status_code != 200:
+        try:
+            detail = response.json().get('detail', 'Unknown error')
+        except ValueError:
+            detail = response.text or 'Unknown error'
+        raise BackendError(f"{response.status_code} - {detail}")
+    return response
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def load_dashboard(filters, sort_by, sort_order, page_size, after):
+    # One page of receipts (as a DataFrame) and the aggregates for the same
+    # filters, fetched in parallel so a rerun waits for one round-trip. The
+    # result is cached per filter/sort/page; errors are raised, not cached.
+    list_params = dict(filters, sort_by=sort_by, sort_order=sort_order, limit=page_size)
+    if after:
+        list_params["after"] = after
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        receipts_future = pool.submit(get_json, "/receipts/", list_params)
+        aggregates_future = pool.submit(get_json, "/receipts/aggregates/", dict(filters))
+        receipts_response = receipts_future.result()
+        aggregates = aggregates_future.result().json()
+    df_receipts = pd.DataFrame(receipts_response.json())
+    if not df_receipts.empty:
+        # Convert transaction_date to datetime objects for better display/sorting
+        df_receipts['transaction_date'] = pd.to_datetime(df_receipts['transaction_date'])
+    return df_receipts, receipts_response.headers.get("X-Next-Cursor"), aggregates
+
+
 # --- Sidebar for Upload and Filters ---
 st.sidebar.header("Upload New Receipt")
 uploaded_file = st.sidebar.file_uploader("Choose a file (JPG, PNG, PDF, TXT)", type=["jpg", "png", "pdf", "txt"])
 
 if uploaded_file is not None:
-    file_bytes = uploaded_file.read()
-    file_type = uploaded_file.type
-    file_name = uploaded_file.name
-    
-    # Encode file content to Base64 for sending to API
-    encoded_content = base64.b64encode(file_bytes).decode('utf-8')
-
-    upload_payload = {
-        "file_name": file_name,
-        "file_content_base64": encoded_content,
-        "file_type": file_type
-    }
-
     if st.sidebar.button("Upload and Process"):
         with st.spinner("Processing receipt..."):
             try:
-                response = requests.post(f"{BACKEND_URL}/upload_receipt/", json=upload_payload)
+                # Send the raw file as multipart form data; the backend streams it
+                # to disk, so there is no base64 inflation or extra in-memory copy.
+                uploaded_file.seek(0)
+                files = {"file": (uploaded_file.name, uploaded_file, uploaded_file.type)}
+                response = get_session().post(f"{BACKEND_URL}/upload_receipt/file/", files=files)
                 if response.status_code == 200:
                     st.sidebar.success("Receipt processed successfully!")
                     st.sidebar.json(response.json()['data'])
+                    load_dashboard.clear()
                     st.rerun() # Refresh the page to show new data
                 else:
                     st.sidebar.error(f"Error: {response.status_code} - {response.json().get('detail', 'Unknown error')}")
@@ -46,7 +91,7 @@ if uploaded_file is not None:
                 st.sidebar.error(f"An unexpected error occurred: {e}")
 
 st.sidebar.header("Filter Receipts")
-search_query = st.sidebar.text_input("Search (Vendor/Category)")
+search_query = st.sidebar.text_input("Search (Vendor/Category/Receipt Text)")
 start_date_filter = st.sidebar.date_input("Start Date", value=date(2023, 1, 1))
 end_date_filter = st.sidebar.date_input("End Date", value=date.today())
 min_amount_filter = st.sidebar.number_input("Minimum Amount", value=None, min_value=0.0, format="%.2f")
@@ -60,148 +105,155 @@ st.sidebar.header("Sort Receipts")
 sort_by_options = ["id", "vendor", "date", "amount", "category"]
 sort_by = st.sidebar.selectbox("Sort By", sort_by_options)
 sort_order = st.sidebar.radio("Sort Order", ["asc", "desc"])
+page_size = st.sidebar.selectbox("Rows per Page", PAGE_SIZES, index=1)
+if st.sidebar.button("Refresh Data"):
+    load_dashboard.clear()
 
 # --- Main Content Area ---
 
-# Fetch and display receipts
-st.header("Uploaded Receipts")
-
 params = {
     "query": search_query if search_query else None,
     "start_date": start_date_filter.isoformat() if start_date_filter else None,
     "end_date": end_date_filter.isoformat() if end_date_filter else None,
     "min_amount": min_amount_filter if min_amount_filter is not None else None,
     "max_amount": max_amount_filter if max_amount_filter is not None else None,
-    "category": category_filter,
-    "sort_by": sort_by,
-    "sort_order": sort_order
+    "category": category_filter
 }
 
-# Filter out None values from params for cleaner API requests
-params = {k: v for k, v in params.items() if v is not None}
-
-receipts_data = []
-try:
-    response = requests.get(f"{BACKEND_URL}/receipts/", params=params)
-    if response.status_code == 200:
-        receipts_data = response.json()
-        if receipts_data:
-            df_receipts = pd.DataFrame(receipts_data)
-            # Convert transaction_date to datetime objects for better display/sorting
-            df_receipts['transaction_date'] = pd.to_datetime(df_receipts['transaction_date'])
-            st.subheader("Tabular View of Records")
-            st.dataframe(df_receipts)
-
-            # Bonus Feature: Manual Correction (Select a row to edit)
-            st.subheader("Manual Correction (Select a row to edit)")
-            # Create a dictionary for easier lookup by ID
-            receipts_dict = {r['id']: r for r in receipts_data}
-            
-            # Use receipt ID as key for selection
-            selected_id = st.selectbox(
-                "Select Receipt ID to Edit",
-                options=[r['id'] for r in receipts_data],
-                format_func=lambda x: f"ID: {x} - {receipts_dict[x]['vendor']}"
-            )
+# Filter out None values from params for cleaner API requests; sorted so the
+# same filters always hit the same cache entry
+filters = tuple(sorted((k, v) for k, v in params.items() if v is not None))
 
-            if selected_id:
-                selected_receipt = receipts_dict[selected_id]
-                with st.form(key=f"edit_form_{selected_id}"):
-                    # Ensure date is a datetime.date object for st.date_input
-                    initial_date = datetime.fromisoformat(selected_receipt['transaction_date']).date() if isinstance(selected_receipt['transaction_date'], str) else selected_receipt['transaction_date']
-
-                    edited_vendor = st.text_input("Vendor", value=selected_receipt.get('vendor', ''))
-                    edited_date = st.date_input("Date", value=initial_date)
-                    edited_amount = st.number_input("Amount", value=selected_receipt.get('amount', 0.0), format="%.2f")
-                    edited_category = st.text_input("Category", value=selected_receipt.get('category', ''))
-                    
-                    submit_edit = st.form_submit_button("Update Receipt")
-
-                    if submit_edit:
-                        update_payload = {
-                            "vendor": edited_vendor,
-                            "transaction_date": edited_date.isoformat(),
-                            "amount": edited_amount,
-                            "category": edited_category
-                        }
-                        update_response = requests.put(f"{BACKEND_URL}/receipts/{selected_id}/", json=update_payload)
-                        if update_response.status_code == 200:
-                            st.success("Receipt updated successfully!")
-                            st.rerun() # Refresh
-                        else:
-                            st.error(f"Failed to update: {update_response.json().get('detail', 'Unknown error')}")
+# Keyset paging: the cursors of the pages visited so far, reset whenever the
+# filters, sort or page size change
+view = (filters, sort_by, sort_order, page_size)
+if st.session_state.get("view") != view:
+    st.session_state["view"] = view
+    st.session_state["cursors"] = [None]
+cursors = st.session_state["cursors"]
 
-        else:
-            st.info("No receipts found matching the criteria.")
-    else:
-        st.error(f"Error fetching receipts: {response.status_code} - {response.json().get('detail', 'Unknown error')}")
+df_receipts, next_cursor, aggregates, fetch_error = None, None, None, None
+try:
+    df_receipts, next_cursor, aggregates = load_dashboard(filters, sort_by, sort_order, page_size, cursors[-1])
 except requests.exceptions.ConnectionError:
-    st.error("Could not connect to backend. Please ensure the backend server is running.")
+    fetch_error = "Could not connect to backend. Please ensure the backend server is running."
+except BackendError as e:
+    fetch_error = f"Error fetching receipts: {e}"
 except Exception as e:
-    st.error(f"An unexpected error occurred while fetching receipts: {e}")
+    fetch_error = f"An unexpected error occurred while fetching receipts: {e}"
+
+# Display receipts
+st.header("Uploaded Receipts")
+
+if fetch_error:
+    st.error(fetch_error)
+elif df_receipts.empty:
+    st.info("No receipts found matching the criteria.")
+else:
+    receipts_data = df_receipts.to_dict("records")
+    st.subheader("Tabular View of Records")
+    st.dataframe(df_receipts)
+
+    page_number = len(cursors)
+    previous_column, page_column, next_column = st.columns([1, 2, 1])
+    if previous_column.button("Previous Page", disabled=page_number == 1):
+        cursors.pop()
+        st.rerun()
+    page_column.write(f"Page {page_number} ({len(df_receipts)} receipts, {page_size} per page)")
+    if next_column.button("Next Page", disabled=next_cursor is None):
+        cursors.append(next_cursor)
+        st.rerun()
+
+    # Bonus Feature: Manual Correction (Select a row to edit)
+    st.subheader("Manual Correction (Select a row to edit)")
+    # Create a dictionary for easier lookup by ID
+    receipts_dict = {r['id']: r for r in receipts_data}
+    
+    # Use receipt ID as key for selection
+    selected_id = st.selectbox(
+        "Select Receipt ID to Edit",
+        options=[r['id'] for r in receipts_data],
+        format_func=lambda x: f"ID: {x} - {receipts_dict[x]['vendor']}"
+    )
+
+    if selected_id:
+        selected_receipt = receipts_dict[selected_id]
+        with st.form(key=f"edit_form_{selected_id}"):
+            # Ensure date is a datetime.date object for st.date_input
+            transaction_date = selected_receipt['transaction_date']
+            initial_date = datetime.fromisoformat(transaction_date).date() if isinstance(transaction_date, str) else pd.Timestamp(transaction_date).date()
+
+            edited_vendor = st.text_input("Vendor", value=selected_receipt.get('vendor', ''))
+            edited_date = st.date_input("Date", value=initial_date)
+            edited_amount = st.number_input("Amount", value=float(selected_receipt.get('amount', 0.0)), format="%.2f")
+            edited_category = st.text_input("Category", value=selected_receipt.get('category', ''))
+            
+            submit_edit = st.form_submit_button("Update Receipt")
+
+            if submit_edit:
+                update_payload = {
+                    "vendor": edited_vendor,
+                    "transaction_date": edited_date.isoformat(),
+                    "amount": edited_amount,
+                    "category": edited_category
+                }
+                update_response = get_session().put(f"{BACKEND_URL}/receipts/{selected_id}/", json=update_payload)
+                if update_response.status_code == 200:
+                    st.success("Receipt updated successfully!")
+                    load_dashboard.clear()
+                    st.rerun() # Refresh
+                else:
+                    st.error(f"Failed to update: {update_response.json().get('detail', 'Unknown error')}")
 
 
-# Fetch and display statistical visualizations
+# Display statistical visualizations (fetched together with the page above)
 st.header("Summarized Insights")
 
-try:
-    response = requests.get(f"{BACKEND_URL}/receipts/aggregates/")
-    if response.status_code == 200:
-        aggregates = response.json()
-        st.subheader("Overall Expenditure")
-        st.write(f"**Total Spend:** ${aggregates['total_spend']:.2f}")
-        st.write(f"**Average Spend:** ${aggregates['mean_spend']:.2f}")
-        st.write(f"**Median Spend:** ${aggregates['median_spend']:.2f}")
-        st.write(f"**Mode Spend:** {', '.join([f'${s:.2f}' for s in aggregates['mode_spend']]) if aggregates['mode_spend'] else 'N/A'}")
-
-
-        st.subheader("Vendor Distribution")
-        if aggregates['vendor_frequency']:
-            vendor_df = pd.DataFrame.from_dict(aggregates['vendor_frequency'], orient='index', columns=['Count'])
-            vendor_df.index.name = 'Vendor'
-            st.bar_chart(vendor_df)
-        else:
-            st.info("No vendor data for distribution.")
+if aggregates is not None:
+    # Same filters as the table above, so the insights match what is displayed
+    st.subheader("Overall Expenditure")
+    st.write(f"**Total Spend:** ${aggregates['total_spend']:.2f}")
+    st.write(f"**Average Spend:** ${aggregates['mean_spend']:.2f}")
+    st.write(f"**Median Spend:** ${aggregates['median_spend']:.2f}")
+    st.write(f"**Mode Spend:** {', '.join([f'${s:.2f}' for s in aggregates['mode_spend']]) if aggregates['mode_spend'] else 'N/A'}")
 
 
-        st.subheader("Monthly Spend Trend")
-        if aggregates['monthly_spend_trend']:
-            trend_df = pd.DataFrame(list(aggregates['monthly_spend_trend'].items()), columns=['Month', 'Amount'])
-            trend_df['Month'] = pd.to_datetime(trend_df['Month'])
-            trend_df = trend_df.sort_values('Month')
-            st.line_chart(trend_df.set_index('Month'))
-        else:
-            st.info("No monthly spend data available.")
+    st.subheader("Vendor Distribution")
+    if aggregates['vendor_frequency']:
+        vendor_df = pd.DataFrame.from_dict(aggregates['vendor_frequency'], orient='index', columns=['Count'])
+        vendor_df.index.name = 'Vendor'
+        st.bar_chart(vendor_df)
+    else:
+        st.info("No vendor data for distribution.")
+
 
+    st.subheader("Monthly Spend Trend")
+    if aggregates['monthly_spend_trend']:
+        trend_df = pd.DataFrame(list(aggregates['monthly_spend_trend'].items()), columns=['Month', 'Amount'])
+        trend_df['Month'] = pd.to_datetime(trend_df['Month'])
+        trend_df = trend_df.sort_values('Month')
+        st.line_chart(trend_df.set_index('Month'))
     else:
-        st.error(f"Error fetching aggregates: {response.status_code} - {response.json().get('detail', 'Unknown error')}")
-except requests.exceptions.ConnectionError:
-    st.error("Could not connect to backend. Please ensure the backend server is running.")
-except Exception as e:
-    st.error(f"An unexpected error occurred while fetching aggregates: {e}")
+        st.info("No monthly spend data available.")
 
 
 # Bonus Feature: Export Data
 st.sidebar.header("Export Data")
-export_format = st.sidebar.radio("Export Format", ["CSV", "JSON"])
+export_format = st.sidebar.radio("Export Format", ["CSV", "JSON", "NDJSON"])
+export_mime = {"CSV": "text/csv", "JSON": "application/json", "NDJSON": "application/x-ndjson"}
 if st.sidebar.button("Download Data"):
     try:
-        export_response = requests.get(f"{BACKEND_URL}/export_receipts/?format={export_format.lower()}")
+        # Exports what the table shows: same search and filters
+        export_params = dict(filters)
+        export_params["format"] = export_format.lower()
+        export_response = get_session().get(f"{BACKEND_URL}/export_receipts/", params=export_params)
         if export_response.status_code == 200:
-            if export_format == "CSV":
-                st.sidebar.download_button(
-                    label=f"Click to Download {export_format}",
-                    data=export_response.content,
-                    file_name="receipts.csv",
-                    mime="text/csv"
-                )
-            elif export_format == "JSON":
-                st.sidebar.download_button(
-                    label=f"Click to Download {export_format}",
-                    data=export_response.content,
-                    file_name="receipts.json",
-                    mime="application/json"
-                )
+            st.sidebar.download_button(
+                label=f"Click to Download {export_format}",
+                data=export_response.content,
+                file_name=f"receipts.{export_format.lower()}",
+                mime=export_mime[export_format]
+            )
         else:
             st.sidebar.error(f"Failed to export: {export_response.status_code} - {export_response.json().get('detail', 'Unknown error')}")
     except requests.exceptions.ConnectionError:
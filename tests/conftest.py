@@ -0,0 +1,7 @@
+import os
+import tempfile
+
+# The backend reads DATABASE_URL when it is first imported, so point it at a
+# scratch database before any test module imports it.
+_db_dir = tempfile.mkdtemp(prefix="receipt-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'receipts.db')}"
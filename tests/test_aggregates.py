@@ -0,0 +1,70 @@
+import os
+from datetime import date
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from backend.algorithms.aggregate import calculate_aggregates
+from backend.algorithms.query import ReceiptQuery
+from backend.data_storage.column_store import ColumnStore
+from backend.data_storage.database import Base, ReceiptDB, build_engine
+from backend.data_storage.summary import ensure_summaries
+
+# Receipts without an amount count towards the receipt and vendor totals but
+# not the amount statistics, like pandas skipping NaN in the original
+# implementation: one 10.00 receipt and one without an amount have a mean of
+# 10.00, not 5.00.
+
+
+@pytest.fixture(scope="module")
+def Session(tmp_path_factory):
+    engine = build_engine(f"sqlite:///{os.path.join(tmp_path_factory.mktemp('aggregates'), 'receipts.db')}")
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        ensure_summaries(db)
+        db.add(ReceiptDB(vendor="Fresh Market", transaction_date=date(2024, 1, 1), amount=10.0, category="Groceries"))
+        db.add(ReceiptDB(vendor="Fuel Stop", transaction_date=date(2024, 2, 1), amount=None, category="Groceries"))
+        db.commit()
+    yield Session
+    engine.dispose()
+
+
+@pytest.mark.parametrize("exact", [False, True])
+def test_mean_skips_missing_amounts(Session, exact):
+    with Session() as db:
+        aggregates = calculate_aggregates(db, exact=exact)
+    assert aggregates["total_spend"] == 10.0
+    assert aggregates["mean_spend"] == 10.0
+    assert aggregates["median_spend"] == pytest.approx(10.0, rel=0.01)
+    assert aggregates["mode_spend"] == [pytest.approx(10.0, rel=0.01)]
+    assert aggregates["vendor_frequency"] == {"Fresh Market": 1, "Fuel Stop": 1}
+
+
+def test_filtered_mean_skips_missing_amounts(Session):
+    with Session() as db:
+        aggregates = calculate_aggregates(db, spec=ReceiptQuery(category="Groceries"))
+    assert aggregates["total_spend"] == 10.0
+    assert aggregates["mean_spend"] == 10.0
+    assert aggregates["median_spend"] == 10.0
+    assert aggregates["mode_spend"] == [10.0]
+
+
+def test_filtered_mean_without_amounts(Session):
+    with Session() as db:
+        aggregates = calculate_aggregates(db, spec=ReceiptQuery(category="Groceries", start_date=date(2024, 2, 1)))
+    assert aggregates["mean_spend"] == 0.0
+    assert aggregates["median_spend"] == 0.0
+    assert aggregates["mode_spend"] == []
+
+
+def test_column_store_matches_sql(Session):
+    # A separate store loaded from this module's database; the filtered
+    # results must equal what SQL computes, down to the month without amounts
+    store = ColumnStore()
+    store.load(bind=Session.kw["bind"])
+    for spec in [ReceiptQuery(category="Groceries"), ReceiptQuery(category="Groceries", start_date=date(2024, 2, 1))]:
+        with Session() as db:
+            expected = calculate_aggregates(db, conditions=spec.filter_conditions())
+        assert store.aggregates(**spec.column_filters()) == expected
+    assert store.aggregates(category="Groceries")["monthly_spend_trend"] == {"2024-01": 10.0, "2024-02": 0.0}
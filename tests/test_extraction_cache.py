@@ -0,0 +1,47 @@
+import base64
+import json
+
+import pytest
+
+from backend.data_ingestion.cache import extraction_cache
+from backend.data_ingestion.pipeline import _cache_key, decode_and_hash, process_upload_sync
+from backend.data_parsing import rules
+
+# The extraction cache only holds extracted text. A cache hit parses it again
+# with the current rule table, so a rule reload applies to re-uploaded files
+# and the hit still shows up in /rules/stats/.
+
+FILE = base64.b64encode(b"cached receipt").decode()
+TEXT = "Corner Store\n2024-01-05\nFresh food\nTotal: 12.50\n"
+
+
+@pytest.fixture
+def rules_file(tmp_path, monkeypatch):
+    path = tmp_path / "rules.json"
+
+    def write(keyword, category):
+        path.write_text(json.dumps({"categories": [{"category": category, "keywords": [keyword]}]}))
+        rules.reload_rules(force=True)
+
+    monkeypatch.setattr(rules, "RULES_PATH", str(path))
+    yield write
+    monkeypatch.undo()
+    rules.reload_rules(force=True)
+
+
+def test_cache_hit_uses_reloaded_rules(rules_file):
+    _, content_hash = decode_and_hash(FILE)
+    extraction_cache.clear()
+    extraction_cache.put(_cache_key(content_hash, "text/plain"), {"extracted_text": TEXT})
+
+    rules_file("food", "Groceries")
+    _, result = process_upload_sync(FILE, "text/plain")
+    assert result["parsed"]["category"] == "Groceries"
+
+    rules_file("corner store", "Convenience")
+    parsed_before = rules.rule_stats()["parsed"]
+    _, result = process_upload_sync(FILE, "text/plain")
+    assert result["parsed"]["category"] == "Convenience"
+    assert result["parsed"]["category_rule"] == "keyword:corner store"
+    assert rules.rule_stats()["parsed"] == parsed_before + 1
+    assert rules.rule_stats()["rules"]["keyword:corner store"] >= 1
@@ -0,0 +1,101 @@
+from datetime import date
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from backend.api.response_cache import response_cache
+from backend.data_storage import column_store
+from backend.data_storage.database import ReceiptDB, SessionLocal, async_engine, init_db
+from backend.main import app
+
+# The list and export endpoints push filters, sort and limit into a single
+# SELECT. Besides it, /api/receipts/ reads receipt_stats.data_version once
+# for the response cache; with the column store enabled, current_store()
+# reads it again and the page comes from memory instead of the SELECT.
+
+LIST_URL = ("/api/receipts/?sort_by=amount&sort_order=desc&category=groceries"
+            "&start_date=2024-01-01&min_amount=5&limit=2")
+EXPORT_URL = "/api/export_receipts/?category=groceries&start_date=2024-01-01&min_amount=5"
+
+
+@pytest.fixture(scope="module")
+def client():
+    # No `with`: the startup hook would also start the job runner threads
+    init_db()
+    with SessionLocal() as db:
+        for day, vendor, amount, category in [
+            (1, "Fresh Market", 12.5, "Groceries"), (2, "Fresh Market", 40.0, "Groceries"),
+            (3, "Corner Shop", 7.25, "Groceries"), (4, "Corner Shop", 3.0, "Groceries"),
+            (5, "Bistro", 55.0, "Dining"), (6, "Fuel Stop", None, "Groceries"),
+        ]:
+            db.add(ReceiptDB(vendor=vendor, transaction_date=date(2024, 1, day), amount=amount, category=category))
+        db.commit()
+    client = TestClient(app)
+    # Opens the pooled connection, so connect-time statements are not counted
+    assert client.get(LIST_URL).status_code == 200
+    return client
+
+
+@pytest.fixture
+def statements():
+    executed = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    response_cache.clear()
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count)
+    yield executed
+    event.remove(async_engine.sync_engine, "before_cursor_execute", count)
+
+
+@pytest.fixture
+def loaded_store(monkeypatch):
+    # A store of its own in place of the process-global one, which monkeypatch
+    # puts back (still unloaded) afterwards, so later tests query SQL again
+    monkeypatch.setattr(column_store, "COLUMN_STORE", 1)
+    monkeypatch.setattr(column_store, "store", column_store.ColumnStore())
+    column_store.store.load()
+    return column_store.store
+
+
+def is_version_read(statement: str) -> bool:
+    return "data_version" in statement and "receipt_stats" in statement
+
+
+def test_receipt_page_is_one_select(client, statements):
+    response = client.get(LIST_URL)
+    assert response.status_code == 200
+    assert [r["amount"] for r in response.json()] == [40.0, 12.5]
+    assert len(statements) == 2
+    assert is_version_read(statements[0])
+    assert "FROM receipts" in statements[1]
+
+
+def test_cached_receipt_page_only_reads_version(client, statements):
+    client.get(LIST_URL)
+    del statements[:]
+    assert client.get(LIST_URL).status_code == 200
+    assert len(statements) == 1
+    assert is_version_read(statements[0])
+
+
+def test_receipt_page_from_column_store(client, loaded_store, statements):
+    response = client.get(LIST_URL)
+    assert [r["amount"] for r in response.json()] == [40.0, 12.5]
+    assert len(statements) == 2
+    assert all(is_version_read(statement) for statement in statements)
+
+
+def test_export_is_one_select(client, statements):
+    response = client.get(EXPORT_URL)
+    assert response.status_code == 200
+    # Export is in id order
+    assert response.text.splitlines()[1:] == [
+        "1,Fresh Market,2024-01-01,12.5,Groceries",
+        "2,Fresh Market,2024-01-02,40.0,Groceries",
+        "3,Corner Shop,2024-01-03,7.25,Groceries",
+    ]
+    assert len(statements) == 1
+    assert "FROM receipts" in statements[0]